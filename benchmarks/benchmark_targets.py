@@ -0,0 +1,107 @@
+"""
+Compares the event throughput of the python3 targets that generate the same
+StateMachine API:
+
+    python benchmarks/benchmark_targets.py [diagram] [--events N]
+
+Each target is generated from the diagram (benchmarks/benchmark.puml by
+default) into a temporary directory, and any extension module is built in
+place, before timing the same sequence of events on all of them. The
+python3/mypyc target is only included when mypyc is installed.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.absolute()
+DEFAULT_DIAGRAM = Path(__file__).parent / "benchmark.puml"
+TARGETS = ["python3/native", "python3/extension"]
+if importlib.util.find_spec("mypyc") is not None:
+    TARGETS.append("python3/mypyc")
+# Targets whose output is built with its setup.py
+BUILT_TARGETS = {"python3/extension", "python3/mypyc"}
+
+
+def generate(diagram: Path, output_dir: Path, target: str):
+    subprocess.run(
+        [
+            sys.executable,
+            str(ROOT / "gen_statemachine" / "main.py"),
+            str(diagram),
+            str(output_dir),
+            "--target",
+            target,
+        ],
+        cwd=ROOT,
+        env={"PYTHONPATH": str(ROOT)},
+        check=True,
+        capture_output=True,
+    )
+    if target in BUILT_TARGETS:
+        subprocess.run(
+            [sys.executable, "setup.py", "build_ext", "--inplace"],
+            cwd=output_dir,
+            check=True,
+            capture_output=True,
+        )
+
+
+def import_statemachine(output_dir: Path):
+    # Compiled modules are named after their file, so each target is imported
+    # as `statemachine` in turn. Extension modules are named after the output
+    # directory, so do not clash.
+    sys.modules.pop("statemachine", None)
+    sys.path.insert(0, str(output_dir))
+    try:
+        importlib.invalidate_caches()
+        return importlib.import_module("statemachine")
+    finally:
+        sys.path.remove(str(output_dir))
+
+
+def benchmark(module, events: int) -> float:
+    """Returns the number of events processed per second"""
+    machine = module.StateMachine()
+    machine.count = 0
+    machine.start()
+    toggles = 98
+    started = time.perf_counter()
+    for _ in range(events // (toggles + 2)):
+        # Running is entered before the toggles are queued, as its initial
+        # transition is taken by the completion event queued after start
+        machine.queue_event(module.Event.start)
+        machine.process_events()
+        for _ in range(toggles):
+            machine.queue_event(module.Event.toggle)
+        machine.queue_event(module.Event.stop)
+        machine.process_events()
+    return events / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("diagram", nargs="?", type=Path, default=DEFAULT_DIAGRAM)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for target in TARGETS:
+            output_dir = Path(temp_dir) / target.replace("/", "_")
+            generate(args.diagram.absolute(), output_dir, target)
+            module = import_statemachine(output_dir)
+            results[target] = benchmark(module, args.events)
+
+    baseline = results[TARGETS[0]]
+    for target, rate in results.items():
+        print(f"{target:<20} {rate:>12,.0f} events/s {rate / baseline:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
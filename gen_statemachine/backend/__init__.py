@@ -1 +1,2 @@
 from .target_generator import TargetGenerator
+from .options import GenerationOptions
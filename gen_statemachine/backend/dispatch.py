@@ -0,0 +1,131 @@
+"""
+Names and dispatch tables shared by the targets, so that every target names
+its states and events, and dispatches an event to the transitions of a state,
+in the same way.
+
+A target dispatches on the (state, event) of each transition, where the state
+is the transition's source and the event is its trigger, or NULL_EVENT_NAME
+for a completion transition. Transitions of composite states are flattened
+into the dispatch of the vertices they enclose, so that dispatch is a single
+lookup of the current state and event.
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union, cast
+
+from gen_statemachine.model.model import (
+    Action,
+    Event,
+    Guard,
+    InitialState,
+    Region,
+    State,
+    StateMachine,
+    TerminalState,
+    Transition,
+    Vertex,
+)
+
+NULL_EVENT_NAME = "_null_event"
+INITIAL_STATE_NAME = "_initial_state"
+TERMINAL_STATE_NAME = "_terminal_state"
+
+# Attributes that diagram behaviour reads or writes on `self`, e.g. `self.count`,
+# but not methods that it calls, e.g. `self.is_in(...)`
+SELF_ATTRIBUTE_PATTERN = re.compile(r"\bself\.([A-Za-z_]\w*)\b(?!\s*\()")
+
+# (state name, event name)
+DispatchKey = Tuple[str, str]
+
+
+def vertex_namespace(vertex: Vertex) -> str:
+    state = cast(Region, vertex.region).state
+    return (state.name or "") if state else ""
+
+
+def enum_name(entity: Union[Vertex, Event]) -> str:
+    """
+    Returns the name of a state or event in the targets' enumerations. Initial
+    and terminal states are named after the composite state that encloses them.
+    """
+    if isinstance(entity, InitialState):
+        return vertex_namespace(entity) + INITIAL_STATE_NAME
+    elif isinstance(entity, TerminalState):
+        return vertex_namespace(entity) + TERMINAL_STATE_NAME
+    else:
+        return entity.name or ""
+
+
+def extension_module_name(output_dir: Path) -> str:
+    """
+    Returns the name of the extension module generated into `output_dir`,
+    which is derived from the directory's name so that the extension modules
+    of different statemachines can be imported into one process
+    """
+    name = re.sub(r"\W", "_", output_dir.resolve().name, flags=re.ASCII)
+    return f"_{name}_statemachine"
+
+
+def transitions_by_source_and_event(
+    statemachine: StateMachine,
+) -> Dict[DispatchKey, List[Transition]]:
+    """Returns the transitions of each (state, event) in diagram order"""
+    transitions: Dict[DispatchKey, List[Transition]] = {}
+    for transition in statemachine.transitions().values():
+        source_name = enum_name(cast(Vertex, transition.source))
+        event_name = (
+            enum_name(transition.trigger) if transition.trigger else NULL_EVENT_NAME
+        )
+        transitions.setdefault((source_name, event_name), []).append(transition)
+    return transitions
+
+
+def dispatched_transitions(
+    statemachine: StateMachine,
+) -> Dict[DispatchKey, Tuple[List[Transition], List[Vertex]]]:
+    """
+    Returns the transitions of each (state, event) in the dispatch table, with
+    the states that are exited before the transitions' source. Transitions of
+    composite states are inherited by the states they enclose, unless a state
+    (or a nearer composite state) has its own transitions for the event.
+    Pseudo states are not dispatched to other than by their own transitions,
+    so they inherit none. Completion transitions are not inherited, as they
+    follow the sub regions' terminal states.
+    """
+    declared = transitions_by_source_and_event(statemachine)
+    dispatched: Dict[DispatchKey, Tuple[List[Transition], List[Vertex]]] = {
+        key: (transitions, []) for key, transitions in declared.items()
+    }
+    for vertex in statemachine.states().values():
+        vertex_name = enum_name(vertex)
+        exited: List[Vertex] = [vertex]
+        region = cast(Region, vertex.region)
+        while state := region.state:
+            state_name = enum_name(state)
+            for (source_name, event_name), transitions in declared.items():
+                key = (vertex_name, event_name)
+                if (
+                    source_name == state_name
+                    and event_name != NULL_EVENT_NAME
+                    and key not in dispatched
+                ):
+                    dispatched[key] = (transitions, list(exited))
+            exited.append(state)
+            region = cast(Region, state.region)
+    return dispatched
+
+
+def self_attributes(statemachine: StateMachine) -> Set[str]:
+    """Returns the names of the attributes that diagram actions or guards use"""
+    texts = [
+        entity.text
+        for entity in statemachine.entities.values()
+        if isinstance(entity, Action) and entity.text
+    ]
+    texts += [
+        entity.condition
+        for entity in statemachine.entities.values()
+        if isinstance(entity, Guard) and entity.condition
+    ]
+    return set(SELF_ATTRIBUTE_PATTERN.findall("\n".join(texts)))
@@ -5,8 +5,10 @@ from mako.lookup import TemplateLookup
 from mako.runtime import Context
 from mako import exceptions
 from io import StringIO
+from typing import Dict, Optional
 
 from gen_statemachine.model import StateMachine
+from gen_statemachine.backend.options import GenerationOptions
 
 LOGGER = logging.getLogger(__name__)
 
@@ -16,13 +18,33 @@ class MakoRenderer:
     Renders text from Mako template files
     """
 
-    def __init__(self, template_dir: Path, statemachine_model: StateMachine):
+    def __init__(
+        self,
+        template_dir: Path,
+        statemachine_model: StateMachine,
+        options: GenerationOptions,
+        output_dir: Path,
+    ):
         self.template_lookup = TemplateLookup(directories=[template_dir])
         self.statemachine = statemachine_model
+        self.options = options
+        self.output_dir = output_dir
 
-    def render_template(self, template_str: str) -> str:
+    def render_template(
+        self, template_str: str, fan_out_files: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Renders a template, which may add further named outputs to
+        `fan_out_files`
+        """
         buffer = StringIO()
-        context = Context(buffer, statemachine=self.statemachine)
+        context = Context(
+            buffer,
+            statemachine=self.statemachine,
+            options=self.options,
+            output_dir=self.output_dir,
+            fan_out_files=fan_out_files if fan_out_files is not None else {},
+        )
         template = Template(template_str, lookup=self.template_lookup)
         try:
             template.render_context(context)
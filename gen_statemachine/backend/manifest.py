@@ -7,10 +7,19 @@ Currently, files in a target directory can be:
 - Source files, which contain source code in the target language
 - Entrypoint files, which may be used to run the final generated code
 
+A template file may also fan out to many files, e.g. one per state, by adding
+named outputs to the `fan_out_files` dict available to the template. Each is
+written to the file's `fan_out` destination, in which `{name}` is replaced by
+the output's name.
+
+A manifest may also list the diagram features that the target does not
+support in `unsupported` (see `UNSUPPORTED_FEATURES`), so that a diagram
+using them is rejected before any file is generated.
+
 """
 
 from enum import Enum
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 import tomli
 from pathlib import Path
@@ -36,6 +45,7 @@ class TargetFile(BaseModel):
     tags: List[str]
     path: str
     destination: str
+    fan_out: Optional[str] = None
 
     def _is_type_of(self, file_type: FileType):
         return any(tag for tag in self.tags if tag in _file_type_tag_map[file_type])
@@ -50,9 +60,17 @@ class TargetFile(BaseModel):
         return self._is_type_of(FileType.Source)
 
 
+# Diagram features that a target may list as `unsupported`, with their descriptions
+UNSUPPORTED_FEATURES = {
+    "time_events": "Time events",
+    "event_parameters": "Events with parameters",
+}
+
+
 class TargetManifest(BaseModel):
     target: str
     files: Dict[str, TargetFile]
+    unsupported: List[str] = []
 
 
 def load_target_manifest(directory: Path) -> TargetManifest:
@@ -0,0 +1,106 @@
+"""
+Generation options allow the user to vary the code that is generated for a
+target. The options are passed to target templates alongside the StateMachine
+model, and it is up to each target to decide which options it supports.
+"""
+
+import argparse
+from dataclasses import dataclass, field, fields
+from typing import Dict, List
+
+from gen_statemachine.error import ProgramError
+from gen_statemachine.model import CoalescePolicy, StateMachine
+
+
+@dataclass
+class GenerationOptions:
+    # Generate a statemachine that processes events on its own worker thread
+    threaded: bool = False
+    # Maximum number of pending events held by a threaded statemachine
+    queue_size: int = 1024
+    # Generate counters and action timings in the event dispatch code
+    instrument: bool = False
+    # Dispatch events in order of their priority, rather than first in first out
+    priority_queue: bool = False
+    # Generate free-list pools that reuse event payload objects
+    payload_pool: bool = False
+    # Generate code that appends each dispatched event to a binary journal
+    journal: bool = False
+    # Generate an `EventRouter` that broadcasts events to the instances that accept them
+    router: bool = False
+    # Generate each state's event handlers in a module that is loaded on first dispatch
+    shard_handlers: bool = False
+    # Generate `State` and `Event` as int constants, with Enum views built on first use
+    int_constants: bool = False
+    # Write the bytecode of generated Python modules, for the running Python version
+    precompile: bool = False
+    # Coalesce policies given as `EVENT=POLICY`, which override those declared
+    # in the diagram
+    coalesce: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "GenerationOptions":
+        """Creates options from the matching command line arguments"""
+        options = cls(
+            **{
+                option.name: getattr(args, option.name)
+                for option in fields(cls)
+                if hasattr(args, option.name)
+            }
+        )
+        options.validate()
+        return options
+
+    def validate(self):
+        """Raises a `ProgramError` if the options cannot be used together"""
+        if self.queue_size < 1:
+            raise ProgramError(f"Queue size must be at least 1 ({self.queue_size})")
+        self.coalesce_policies()
+
+    def coalesce_policies(self) -> Dict[str, CoalescePolicy]:
+        """Returns the coalesce policies from the `coalesce` option, keyed by event name"""
+        policies = {}
+        for item in self.coalesce:
+            event_name, _, value = item.partition("=")
+            try:
+                policies[event_name.strip()] = CoalescePolicy(value.strip())
+            except ValueError:
+                choices = ", ".join(policy.value for policy in CoalescePolicy)
+                raise ProgramError(
+                    f"Invalid coalesce option '{item}', expected EVENT=POLICY where POLICY is one of: {choices}"
+                )
+        return policies
+
+    def validate_model(self, statemachine: StateMachine):
+        """Raises a `ProgramError` if the options cannot be used with `statemachine`"""
+        event_names = {event.name for event in statemachine.events().values()}
+        if unknown := sorted(set(self.coalesce_policies()) - event_names):
+            raise ProgramError(
+                f"Coalesce option given for unknown events: {', '.join(unknown)}"
+            )
+        if self.journal:
+            if any(event.parameters for event in statemachine.events().values()):
+                raise ProgramError(
+                    "Events with payloads cannot be journaled, as payloads are not recorded"
+                )
+            policies = self.event_coalesce_policies(statemachine)
+            if CoalescePolicy.COUNT in policies.values():
+                raise ProgramError(
+                    "Events with a `count` coalesce policy cannot be journaled, as counts are not recorded"
+                )
+
+    def event_coalesce_policies(
+        self, statemachine: StateMachine
+    ) -> Dict[str, CoalescePolicy]:
+        """
+        Returns the coalesce policies declared in the diagram, overridden by
+        those from the `coalesce` option, keyed by event name
+        """
+        overrides = self.coalesce_policies()
+        policies = {}
+        for event in statemachine.events().values():
+            if not event.name:
+                continue
+            if (policy := overrides.get(event.name, event.coalesce)) is not None:
+                policies[event.name] = policy
+        return policies
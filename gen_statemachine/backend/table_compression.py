@@ -0,0 +1,99 @@
+"""
+Table driven targets look up a value for each (state, event), but most states
+handle only a few events, so a dense `states x events` table is mostly empty.
+
+A table is compressed by row displacement: each row is placed at an offset
+(its `base`) into one vector, so that the cells it holds do not overlap those
+of the rows placed before it, and the cell (row, column) is found at index
+`base[row] + column`. As the gaps of one row are filled by the cells of other
+rows, the `check` vector records which row each index belongs to, and a cell
+is only present if `check[base[row] + column] == row`. A lookup is then two
+array reads and a comparison, and the size of the vectors is close to the
+number of cells that are present rather than `rows x columns`.
+
+The values of a table are not part of the compression, so one layout may be
+shared by several value vectors with the same cells.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Tuple, TypeVar
+
+Cell = Tuple[int, int]
+T = TypeVar("T")
+
+# Value of `check` at the indices that hold no cell
+EMPTY = -1
+
+
+@dataclass
+class CompressedTable:
+    # Index of the first column of each row
+    base: List[int]
+    # Row holding the cell at each index, or EMPTY
+    check: List[int]
+    # Index of each cell that is present
+    slots: Dict[Cell, int]
+
+    def __len__(self) -> int:
+        return len(self.check)
+
+    def values(self, cells: Mapping[Cell, T], default: T) -> List[T]:
+        """
+        Returns a vector holding the value of each of `cells` at its index,
+        and `default` elsewhere
+        """
+        vector = [default] * len(self.check)
+        for cell, value in cells.items():
+            vector[self.slots[cell]] = value
+        return vector
+
+    def lookup(self, values: List[T], row: int, column: int, default: T) -> T:
+        """Returns the value of (row, column) from a vector built by `values`"""
+        index = self.base[row] + column
+        return values[index] if self.check[index] == row else default
+
+
+def compress_table(cells: Iterable[Cell], rows: int, columns: int) -> CompressedTable:
+    """
+    Compresses a `rows x columns` table holding only `cells`. Rows are placed
+    in order of decreasing number of cells, each at the first offset where
+    its cells fit. The vectors are padded so that any (row, column) within
+    the table can be looked up without a bounds check.
+    """
+    row_columns: Dict[int, List[int]] = {row: [] for row in range(rows)}
+    for row, column in set(cells):
+        if not (0 <= row < rows and 0 <= column < columns):
+            raise ValueError(
+                f"Cell {(row, column)} is outside a {rows}x{columns} table"
+            )
+        row_columns[row].append(column)
+
+    base = [0] * rows
+    # Bit `n` is set if index `n` holds a cell
+    occupied = 0
+    # Every index before this one holds a cell
+    first_free = 0
+    for row in sorted(row_columns, key=lambda row: -len(row_columns[row])):
+        row_cells = row_columns[row]
+        if not row_cells:
+            # An empty row may start anywhere, as its lookups never match `check`
+            continue
+        first_column = min(row_cells)
+        mask = sum(1 << column for column in row_cells)
+        offset = max(first_free - first_column, 0)
+        while occupied >> offset & mask:
+            # Only offsets that put the first cell on a free index may fit
+            free = ~occupied >> (offset + first_column + 1)
+            offset += (free & -free).bit_length()
+        base[row] = offset
+        occupied |= mask << offset
+        while occupied >> first_free & 1:
+            first_free += 1
+
+    check = [EMPTY] * (max(base, default=0) + columns)
+    slots = {}
+    for row, row_cells in row_columns.items():
+        for column in row_cells:
+            slots[(row, column)] = base[row] + column
+            check[base[row] + column] = row
+    return CompressedTable(base, check, slots)
@@ -8,15 +8,20 @@ are listed by the manifest and performing actions depending on the file types.
 """
 
 import logging
+import py_compile
 from pathlib import Path
+from typing import Dict, Optional
 from gen_statemachine.error import ProgramError
 from gen_statemachine.model import StateMachine
 
 from gen_statemachine.backend.manifest import (
+    UNSUPPORTED_FEATURES,
     TargetFile,
+    TargetManifest,
     load_target_manifest,
 )
 from gen_statemachine.backend.mako_renderer import MakoRenderer
+from gen_statemachine.backend.options import GenerationOptions
 
 
 LOGGER = logging.getLogger(__name__)
@@ -29,11 +34,18 @@ class TargetGenerator:
         self.targets_dir = Path(__file__).parent / "targets"
         self.generate_entrypoints = True
 
-    def generate(self, target_name: str, output_dir: Path, statemachine: StateMachine):
+    def generate(
+        self,
+        target_name: str,
+        output_dir: Path,
+        statemachine: StateMachine,
+        options: Optional[GenerationOptions] = None,
+    ):
         """
         Attempts to read a manifest file from the directory named `target_name`
         and then sequentially processes all other files in the directory that
-        are listed in the manifest.
+        are listed in the manifest. The generation `options` and `output_dir`
+        are made available to all templates.
         """
         target_dir = self.targets_dir / target_name
         target_dir = target_dir.resolve()
@@ -41,13 +53,44 @@ class TargetGenerator:
         if not target_dir.exists():
             raise ProgramError(f"Target {target_name} not found in {self.targets_dir}")
 
-        self.mako_renderer = MakoRenderer(target_dir, statemachine)
+        options = options or GenerationOptions()
+        self.options = options
+        self.mako_renderer = MakoRenderer(
+            target_dir, statemachine, options, output_dir
+        )
         manifest = load_target_manifest(target_dir)
         LOGGER.info(f"Loaded {manifest.target} manifest")
+        self._validate(manifest, statemachine, options)
 
         for _, file in manifest.files.items():
             self._process_file(file, target_dir, output_dir, statemachine)
 
+    def _validate(
+        self,
+        manifest: TargetManifest,
+        statemachine: StateMachine,
+        options: GenerationOptions,
+    ):
+        """
+        Raises a `ProgramError` if the statemachine uses a feature that the
+        target does not support, or cannot be generated with the `options`
+        """
+        for feature in manifest.unsupported:
+            if feature not in UNSUPPORTED_FEATURES:
+                raise ProgramError(
+                    f"Unknown unsupported feature '{feature}' in the {manifest.target} manifest"
+                )
+        for event in statemachine.events().values():
+            features = ["time_events"] if event.delay is not None else []
+            if event.parameters:
+                features.append("event_parameters")
+            for feature in features:
+                if feature in manifest.unsupported:
+                    raise ProgramError(
+                        f"{UNSUPPORTED_FEATURES[feature]} are not supported by the {manifest.target} target ({event.name})"
+                    )
+        options.validate_model(statemachine)
+
     def _process_file(
         self,
         file: TargetFile,
@@ -58,7 +101,7 @@ class TargetGenerator:
         """
         Depending on the type of the TargetFile, performs actions:
         - For a template file, the template is rendered and text output to a
-          file in the output directory
+          file in the output directory, along with any files it fans out to
         - For a source code file, the file is simply copied into the output dir
           without alteration
         - For an entrypoint file, the file is optionally copied into the output
@@ -72,7 +115,7 @@ class TargetGenerator:
         if file.is_mako_template_file():
             output_path = output_dir / file.destination
             self._create_directories(output_path)
-            self._render_mako_template(file_path, output_path, statemachine)
+            self._render_mako_template(file, file_path, output_dir, statemachine)
         elif file.is_entrypoint_file() and not self.generate_entrypoints:
             LOGGER.info(f"Skipping entrypoint file: {file.path}")
         elif file.is_source_file() or file.is_entrypoint_file():
@@ -80,16 +123,48 @@ class TargetGenerator:
             output_path = output_dir / file.destination
             LOGGER.info(f"Generating {output_path}")
             self._create_directories(output_path)
-            output_path.write_text(file_path.read_text())
+            self._write_output(output_path, file_path.read_text())
         else:
             LOGGER.warn(f"Unexpected file in target manifest: {file.path}")
 
     def _create_directories(self, path: Path):
         path.parent.mkdir(parents=True, exist_ok=True)
 
+    def _write_output(self, output_path: Path, text: str):
+        """
+        Writes an output file, and with the `precompile` option, the bytecode
+        of a Python output to where the running Python version imports it from
+        """
+        output_path.write_text(text)
+        if self.options.precompile and output_path.suffix == ".py":
+            try:
+                py_compile.compile(str(output_path), doraise=True)
+            except py_compile.PyCompileError as e:
+                raise ProgramError(f"Generated {output_path} does not compile: {e.msg}")
+
     def _render_mako_template(
-        self, template_path: Path, output_path: Path, statemachine: StateMachine
+        self,
+        file: TargetFile,
+        template_path: Path,
+        output_dir: Path,
+        statemachine: StateMachine,
     ):
+        output_path = output_dir / file.destination
         LOGGER.info(f"Generating {output_path}")
-        text = self.mako_renderer.render_template(template_path.read_text())
-        output_path.write_text(text)
+        fan_out_files: Dict[str, str] = {}
+        text = self.mako_renderer.render_template(
+            template_path.read_text(), fan_out_files
+        )
+        self._write_output(output_path, text)
+
+        if not fan_out_files:
+            return
+        if (fan_out := file.fan_out) is None:
+            raise ProgramError(
+                f"{file.path} fans out to {len(fan_out_files)} files, but has no 'fan_out' destination in the manifest"
+            )
+        for name, text in fan_out_files.items():
+            fan_out_path = output_dir / fan_out.format(name=name)
+            LOGGER.info(f"Generating {fan_out_path}")
+            self._create_directories(fan_out_path)
+            self._write_output(fan_out_path, text)
@@ -0,0 +1,10 @@
+#include "statemachine.h"
+
+int main(void)
+{
+    /* Statemachines are plain structs, so need no heap allocation */
+    static StateMachine sm;
+    statemachine_init(&sm);
+    statemachine_start(&sm);
+    return 0;
+}
@@ -0,0 +1,270 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    INITIAL_STATE_NAME as _initial_state_name,
+    enum_name,
+)
+
+_indent = "    "
+
+def statement(text):
+    # Diagram actions may omit the semicolon of their last statement
+    text = text.strip()
+    return text if text.endswith((";", "}")) else text + ";"
+
+def states_with_entry_actions():
+    return [state for state in statemachine.states().values() if state.entry_actions]
+
+def states_with_exit_actions():
+    return [state for state in statemachine.states().values() if state.exit_actions]
+
+def transitions_by_source_and_event():
+    return dispatch.transitions_by_source_and_event(statemachine)
+
+def dispatched_transitions():
+    return dispatch.dispatched_transitions(statemachine)
+
+def dispatched_events_by_source():
+    events = {}
+    for source_name, event_name in dispatched_transitions().keys():
+        events.setdefault(source_name, []).append(event_name)
+    return events
+
+def region_set_for_vertex(vertex):
+    regions = []
+    region = vertex.region
+    while region.state:
+        regions.append(region)
+        region = region.state.region
+    return regions
+
+def exited_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    return [region.state for region in source_regions if region not in target_regions]
+
+def entered_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    entered_states = [region.state for region in target_regions if region not in source_regions]
+    entered_states.reverse()
+    return entered_states
+
+def is_lowered_choice(vertex, choices):
+    return isinstance(vertex, gen_statemachine.model.Choice) and vertex.id not in choices
+
+def is_sub_region_terminal_state(vertex):
+    return isinstance(vertex, gen_statemachine.model.TerminalState) and vertex.region.state is not None
+%>\
+<%def name="action_statements(actions, indent_str)">\
+% for action in actions:
+${indent_str}${statement(action.text)}
+% endfor
+</%def>\
+<%def name="enter_substates(vertex, indent_str)">\
+% if type(vertex) is gen_statemachine.model.State and vertex.sub_regions:
+${indent_str}enter_state(self, STATE_${enum_name(vertex.sub_regions[0].initial_state)});
+${enter_substates(vertex.sub_regions[0].initial_state, indent_str)}\
+% endif
+</%def>\
+<%def name="transition_block(transition, indent_str, inherited_exits)">\
+% for exited_state in inherited_exits:
+${indent_str}exit_state(self, STATE_${enum_name(exited_state)});
+% endfor
+${indent_str}exit_state(self, STATE_${enum_name(transition.source)});
+${transition_path(transition, indent_str, [transition.source.id])}\
+</%def>\
+<%def name="transition_path(transition, indent_str, choices)">\
+<% target = transition.target %>\
+% for exited_state in exited_states(transition):
+${indent_str}exit_state(self, STATE_${enum_name(exited_state)});
+% endfor
+% if transition.action:
+${action_statements([transition.action], indent_str)}\
+% endif
+% for entered_state in entered_states(transition):
+${indent_str}enter_state(self, STATE_${enum_name(entered_state)});
+% endfor
+% if is_lowered_choice(target, choices):
+${choice_block(target, indent_str, choices + [target.id])}\
+% elif is_sub_region_terminal_state(target):
+${indent_str}self->current_state = STATE_${enum_name(target.region.state)};
+% else:
+${indent_str}enter_state(self, STATE_${enum_name(target)});
+${enter_substates(target, indent_str)}\
+% endif
+</%def>\
+<%def name="choice_block(choice, indent_str, choices)">\
+<% guarded = [t for t in choice.outgoing_transitions if t.guard] %>\
+<% unguarded = [t for t in choice.outgoing_transitions if not t.guard] %>\
+% for transition in guarded:
+${indent_str}${"if" if loop.first else "} else if"} (${transition.guard.condition.strip()}) {
+${transition_path(transition, indent_str + _indent, choices)}\
+% endfor
+% if guarded:
+${indent_str}} else {
+% endif
+<% branch_indent = indent_str + _indent if guarded else indent_str %>\
+% if unguarded:
+${transition_path(unguarded[0], branch_indent, choices)}\
+% else:
+${branch_indent}enter_state(self, STATE_${enum_name(choice)});
+% endif
+% if guarded:
+${indent_str}}
+% endif
+</%def>\
+/* Generated by gen_statemachine */
+
+#include "statemachine.h"
+
+#define QUEUE_CAPACITY (STATEMACHINE_QUEUE_SIZE + 1u)
+
+#ifdef STATEMACHINE_ACTIONS_HEADER
+/* Declarations used by the diagram's actions and guards */
+#include STATEMACHINE_ACTIONS_HEADER
+#endif
+
+static const char *const state_names[STATE_COUNT] = {
+    % for vertex in statemachine.vertices().values():
+    "${enum_name(vertex)}",
+    % endfor
+};
+
+static const char *const event_names[EVENT_COUNT] = {
+    "${_null_event_name}",
+    % for event in statemachine.events().values():
+    "${event.name}",
+    % endfor
+};
+
+static void exit_state(StateMachine *self, State state)
+{
+    (void)self;
+    switch (state) {
+    % for state in states_with_exit_actions():
+    case STATE_${enum_name(state)}:
+${action_statements(state.exit_actions, _indent * 2)}\
+        break;
+    % endfor
+    default:
+        break;
+    }
+}
+
+static void enter_state(StateMachine *self, State state)
+{
+    switch (state) {
+    % for state in states_with_entry_actions():
+    case STATE_${enum_name(state)}:
+${action_statements(state.entry_actions, _indent * 2)}\
+        break;
+    % endfor
+    default:
+        break;
+    }
+    self->current_state = state;
+}
+% for (source_name, event_name), (transitions, inherited_exits) in dispatched_transitions().items():
+<% transitions_with_guards = [t for t in transitions if t.guard] %>\
+<% transitions_without_guards = [t for t in transitions if not t.guard] %>\
+
+static void process_${event_name}_in_${source_name}(StateMachine *self)
+{
+    % for transition in transitions_with_guards:
+    ${"if" if loop.first else "} else if"} (${transition.guard.condition.strip()}) {
+${transition_block(transition, _indent * 2, inherited_exits)}\
+    % endfor
+    % if transitions_with_guards and transitions_without_guards:
+    } else {
+${transition_block(transitions_without_guards[0], _indent * 2, inherited_exits)}\
+    }
+    % elif transitions_with_guards:
+    }
+    % else:
+${transition_block(transitions_without_guards[0], _indent, inherited_exits)}\
+    % endif
+}
+% endfor
+
+/* Calls the handler of `event` in the current state. Returns false if the event is ignored. */
+static bool dispatch(StateMachine *self, Event event)
+{
+    switch (self->current_state) {
+    % for source_name, event_names in dispatched_events_by_source().items():
+    case STATE_${source_name}:
+        switch (event) {
+        % for event_name in event_names:
+        case EVENT_${event_name}:
+            process_${event_name}_in_${source_name}(self);
+            return true;
+        % endfor
+        default:
+            return false;
+        }
+    % endfor
+    default:
+        return false;
+    }
+}
+
+void statemachine_init(StateMachine *self)
+{
+    self->current_state = STATE_${_initial_state_name};
+    self->queue_head = 0;
+    self->queue_length = 0;
+}
+
+void statemachine_start(StateMachine *self)
+{
+    statemachine_queue_event(self, EVENT_${_null_event_name});
+    statemachine_process_events(self, STATEMACHINE_ALL_EVENTS);
+}
+
+static void push_event(StateMachine *self, Event event)
+{
+    self->event_queue[(self->queue_head + self->queue_length) % QUEUE_CAPACITY] = event;
+    self->queue_length++;
+}
+
+bool statemachine_queue_event(StateMachine *self, Event event)
+{
+    if (self->queue_length >= STATEMACHINE_QUEUE_SIZE) {
+        return false;
+    }
+    push_event(self, event);
+    return true;
+}
+
+size_t statemachine_process_events(StateMachine *self, size_t max_events)
+{
+    size_t processed = 0;
+    while (self->queue_length && processed != max_events) {
+        Event event = (Event)self->event_queue[self->queue_head];
+        self->queue_head = (self->queue_head + 1) % QUEUE_CAPACITY;
+        self->queue_length--;
+        if (dispatch(self, event)) {
+            /*
+             * Queues the completion event, which takes any completion transitions of
+             * the new state. Events queued by actions stop at the queue size, so
+             * the completion event always fits in the reserved slot.
+             */
+            push_event(self, EVENT_${_null_event_name});
+        }
+        processed++;
+    }
+    return self->queue_length;
+}
+
+const char *statemachine_state_name(State state)
+{
+    return state_names[state];
+}
+
+const char *statemachine_event_name(Event event)
+{
+    return event_names[event];
+}
@@ -0,0 +1,85 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    enum_name,
+)
+
+def event_id_type():
+    # Narrowest unsigned type that holds every event ID, for the event queue
+    for bits in [8, 16]:
+        if len(statemachine.events()) < 2 ** bits:
+            return f"uint{bits}_t"
+    return "uint32_t"
+%>\
+/* Generated by gen_statemachine */
+
+#ifndef STATEMACHINE_H
+#define STATEMACHINE_H
+
+#include <stdbool.h>
+#include <stddef.h>
+#include <stdint.h>
+
+typedef enum {
+    % for vertex in statemachine.vertices().values():
+    STATE_${enum_name(vertex)} = ${loop.index},
+    % endfor
+} State;
+
+#define STATE_COUNT ${len(statemachine.vertices())}
+
+typedef enum {
+    EVENT_${_null_event_name} = 0,
+    % for event in statemachine.events().values():
+    EVENT_${event.name} = ${loop.index + 1},
+    % endfor
+} Event;
+
+#define EVENT_COUNT ${len(statemachine.events()) + 1}
+
+/* Maximum number of pending events held by a statemachine */
+#define STATEMACHINE_QUEUE_SIZE ${options.queue_size}u
+
+/* Passed as `max_events` to process every pending event */
+#define STATEMACHINE_ALL_EVENTS SIZE_MAX
+
+/*
+ * A statemachine holds its pending events in a fixed size ring buffer, so it
+ * needs no heap allocation. The buffer has one slot more than the queue size,
+ * which only the completion event queued after each transition may take, so
+ * that actions filling the queue cannot cause completion transitions to be
+ * missed. Fields that the diagram's actions and guards
+ * access through `self->` may be added by defining STATEMACHINE_USER_FIELDS,
+ * e.g. `-DSTATEMACHINE_USER_FIELDS="int count;"`.
+ */
+typedef struct StateMachine {
+    State current_state;
+    ${event_id_type()} event_queue[STATEMACHINE_QUEUE_SIZE + 1u];
+    size_t queue_head;
+    size_t queue_length;
+#ifdef STATEMACHINE_USER_FIELDS
+    STATEMACHINE_USER_FIELDS
+#endif
+} StateMachine;
+
+void statemachine_init(StateMachine *self);
+
+/* Takes the initial transitions, processing any events they queue */
+void statemachine_start(StateMachine *self);
+
+/* Returns false, and drops the event, if the event queue is full */
+bool statemachine_queue_event(StateMachine *self, Event event);
+
+/*
+ * Processes pending events, including those queued while processing, until
+ * none remain or `max_events` events have been processed. Returns the number
+ * of events that remain pending.
+ */
+size_t statemachine_process_events(StateMachine *self, size_t max_events);
+
+const char *statemachine_state_name(State state);
+const char *statemachine_event_name(Event event);
+
+#endif
@@ -0,0 +1,610 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend.table_compression import compress_table
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    INITIAL_STATE_NAME as _initial_state_name,
+    enum_name,
+    extension_module_name,
+)
+
+# Handler program operations, followed by their operands:
+# - OP_EXIT state: Runs the exit actions of `state`
+# - OP_ENTER state: Runs the entry actions of `state` and makes it the current state
+# - OP_SET_STATE state: Makes `state` the current state, without running its entry actions
+# - OP_ACTION action: Runs a transition action
+# - OP_GUARD guard offset: Evaluates a guard, and continues at `offset` if it is false
+# - OP_JUMP offset: Continues at `offset`
+_ops = ["OP_END", "OP_EXIT", "OP_ENTER", "OP_SET_STATE", "OP_ACTION", "OP_GUARD", "OP_JUMP"]
+
+def state_values():
+    return {enum_name(vertex): index for index, vertex in enumerate(statemachine.vertices().values())}
+
+def event_values():
+    values = {_null_event_name: 0}
+    for index, event in enumerate(statemachine.events().values()):
+        values[event.name] = index + 1
+    return values
+
+def guard_indices():
+    # Guards and actions are indexed in the same order by statemachine.mako
+    guards = [transition.guard for transition in statemachine.transitions().values() if transition.guard]
+    return {guard.id: index for index, guard in enumerate(guards)}
+
+def action_indices():
+    actions = [transition.action for transition in statemachine.transitions().values() if transition.action]
+    return {action.id: index for index, action in enumerate(actions)}
+
+def transitions_by_source_and_event():
+    return dispatch.transitions_by_source_and_event(statemachine)
+
+def dispatched_transitions():
+    return dispatch.dispatched_transitions(statemachine)
+
+def region_set_for_vertex(vertex):
+    regions = []
+    region = vertex.region
+    while region.state:
+        regions.append(region)
+        region = region.state.region
+    return regions
+
+def exited_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    return [region.state for region in source_regions if region not in target_regions]
+
+def entered_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    entered_states = [region.state for region in target_regions if region not in source_regions]
+    entered_states.reverse()
+    return entered_states
+
+class HandlerCompiler:
+    """
+    Compiles the transitions of each (state, event) into one program of
+    operations, with the same behaviour as the handlers of the python3/native
+    target, so that dispatch runs in C and only calls back into Python for
+    guards and behaviour
+    """
+
+    def __init__(self):
+        self.program = []
+        self.offsets = {}
+        self.states = state_values()
+        self.guards = guard_indices()
+        self.actions = action_indices()
+
+    def compile(self):
+        for key, (transitions, inherited_exits) in dispatched_transitions().items():
+            self.offsets[key] = len(self.program)
+            guarded = [t for t in transitions if t.guard]
+            unguarded = [t for t in transitions if not t.guard]
+            def transition_block(transition):
+                for state in inherited_exits + [transition.source]:
+                    self.emit("OP_EXIT", self.states[enum_name(state)])
+                self.transition_path(transition, [transition.source.id])
+            self.guard_chain(guarded, transition_block, (lambda: transition_block(unguarded[0])) if unguarded else None)
+            self.emit("OP_END")
+        return self
+
+    def handler_programs(self):
+        # The compiled program of each (state, event)
+        ends = list(self.offsets.values())[1:] + [len(self.program)]
+        return [(key, self.program[offset:end]) for (key, offset), end in zip(self.offsets.items(), ends)]
+
+    def emit(self, op, *operands):
+        self.program += [op, *operands]
+
+    def guard_chain(self, guarded, branch, fallback):
+        # Each guard jumps past its branch if false, and each branch jumps to the end
+        end_jumps = []
+        for transition in guarded:
+            self.emit("OP_GUARD", self.guards[transition.guard.id], None)
+            false_jump = len(self.program) - 1
+            branch(transition)
+            self.emit("OP_JUMP", None)
+            end_jumps.append(len(self.program) - 1)
+            self.program[false_jump] = len(self.program)
+        if fallback:
+            fallback()
+        for end_jump in end_jumps:
+            self.program[end_jump] = len(self.program)
+
+    def transition_path(self, transition, choices):
+        for state in exited_states(transition):
+            self.emit("OP_EXIT", self.states[enum_name(state)])
+        if transition.action:
+            self.emit("OP_ACTION", self.actions[transition.action.id])
+        for state in entered_states(transition):
+            self.emit("OP_ENTER", self.states[enum_name(state)])
+        target = transition.target
+        if isinstance(target, gen_statemachine.model.Choice) and target.id not in choices:
+            guarded = [t for t in target.outgoing_transitions if t.guard]
+            unguarded = [t for t in target.outgoing_transitions if not t.guard]
+            branch = lambda t: self.transition_path(t, choices + [target.id])
+            rest = lambda: self.emit("OP_ENTER", self.states[enum_name(target)])
+            self.guard_chain(guarded, branch, (lambda: branch(unguarded[0])) if unguarded else rest)
+        elif isinstance(target, gen_statemachine.model.TerminalState) and target.region.state is not None:
+            self.emit("OP_SET_STATE", self.states[enum_name(target.region.state)])
+        else:
+            self.emit("OP_ENTER", self.states[enum_name(target)])
+            while type(target) is gen_statemachine.model.State and target.sub_regions:
+                target = target.sub_regions[0].initial_state
+                self.emit("OP_ENTER", self.states[enum_name(target)])
+
+def ancestor_states(vertex):
+    states = {enum_name(vertex)}
+    region = vertex.region
+    while region.state:
+        states.add(enum_name(region.state))
+        region = region.state.region
+    return states
+
+def handler_table(compiler):
+    # The program offset of each (state, event) that has a handler
+    states, events = state_values(), event_values()
+    offsets = {(states[source_name], events[event_name]): offset for (source_name, event_name), offset in compiler.offsets.items()}
+    table = compress_table(offsets, len(states), len(events))
+    return table, table.values(offsets, -1)
+
+def ancestor_table():
+    # A cell is present for each state and the states that enclose it
+    states = state_values()
+    cells = [(index, states[name]) for index, vertex in enumerate(statemachine.vertices().values()) for name in ancestor_states(vertex)]
+    return compress_table(cells, len(states), len(states))
+
+def array_items(values, per_line=16):
+    return [", ".join(str(value) for value in values[start:start + per_line]) for start in range(0, len(values), per_line)]
+
+def event_id_type():
+    for bits in [8, 16]:
+        if len(statemachine.events()) < 2 ** bits:
+            return f"uint{bits}_t"
+    return "uint32_t"
+%>\
+<%
+compiler = HandlerCompiler().compile()
+module_name = extension_module_name(output_dir)
+%>\
+/* Generated by gen_statemachine */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+#define STATE_COUNT ${len(state_values())}
+#define EVENT_COUNT ${len(event_values())}
+#define NULL_EVENT 0
+#define INITIAL_STATE ${state_values()[_initial_state_name]}
+#define INITIAL_QUEUE_CAPACITY 16
+
+typedef ${event_id_type()} event_id;
+
+enum {
+    % for op in _ops:
+    ${op},
+    % endfor
+};
+
+/* Handler programs of all (state, event) pairs, see the python3/extension target */
+static const int32_t program[] = {
+    % for (source_name, event_name), operations in compiler.handler_programs():
+    /* ${event_name} in ${source_name} */
+    ${", ".join(str(operation) for operation in operations)},
+    % endfor
+    OP_END,
+};
+
+/*
+ * The (state, event) and (state, state) tables are compressed by row
+ * displacement: the cell of (row, column) is at `base[row] + column` of the
+ * table's other arrays, and only belongs to `row` if `check` holds `row` there
+ */
+<% handlers, handler_offsets = handler_table(compiler) %>\
+static const int32_t handler_base[STATE_COUNT] = {
+    % for items in array_items(handlers.base):
+    ${items},
+    % endfor
+};
+static const int32_t handler_check[${len(handlers)}] = {
+    % for items in array_items(handlers.check):
+    ${items},
+    % endfor
+};
+/* Offset of the handler program of each cell, or -1 where the event is ignored */
+static const int32_t handler_offset[${len(handlers)}] = {
+    % for items in array_items(handler_offsets):
+    ${items},
+    % endfor
+};
+
+static int32_t handler_of(int32_t state, event_id event)
+{
+    int32_t cell = handler_base[state] + event;
+    return handler_check[cell] == state ? handler_offset[cell] : -1;
+}
+
+/* A cell is present where the first state is the second state or is nested within it */
+<% ancestors = ancestor_table() %>\
+static const int32_t ancestor_base[STATE_COUNT] = {
+    % for items in array_items(ancestors.base):
+    ${items},
+    % endfor
+};
+static const int32_t ancestor_check[${len(ancestors)}] = {
+    % for items in array_items(ancestors.check):
+    ${items},
+    % endfor
+};
+
+static int is_in_state(int32_t state, int32_t ancestor)
+{
+    return ancestor_check[ancestor_base[state] + ancestor] == state;
+}
+
+/* time.monotonic, set when the module is initialised */
+static PyObject *monotonic = NULL;
+
+typedef struct {
+    PyObject_HEAD
+    int32_t state;
+    /* Python callbacks, taken from the `_callbacks` of the instance's class by __init__ */
+    PyObject *guards;
+    PyObject *actions;
+    PyObject *entry_actions;
+    PyObject *exit_actions;
+    /* Ring buffer of pending events, which grows as needed */
+    event_id *queue;
+    Py_ssize_t queue_capacity;
+    Py_ssize_t queue_head;
+    Py_ssize_t queue_length;
+} StateMachineObject;
+
+static int push_event(StateMachineObject *self, event_id event)
+{
+    if (self->queue_length == self->queue_capacity) {
+        Py_ssize_t capacity = self->queue_capacity ? self->queue_capacity * 2 : INITIAL_QUEUE_CAPACITY;
+        event_id *queue = PyMem_New(event_id, capacity);
+        if (queue == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        for (Py_ssize_t i = 0; i < self->queue_length; i++) {
+            queue[i] = self->queue[(self->queue_head + i) % self->queue_capacity];
+        }
+        PyMem_Free(self->queue);
+        self->queue = queue;
+        self->queue_capacity = capacity;
+        self->queue_head = 0;
+    }
+    self->queue[(self->queue_head + self->queue_length) % self->queue_capacity] = event;
+    self->queue_length++;
+    return 0;
+}
+
+static int call_callback(PyObject *callbacks, int32_t index, StateMachineObject *self)
+{
+    PyObject *callback = PyTuple_GET_ITEM(callbacks, index);
+    if (callback == Py_None) {
+        return 0;
+    }
+    PyObject *result = PyObject_CallFunctionObjArgs(callback, (PyObject *)self, NULL);
+    if (result == NULL) {
+        return -1;
+    }
+    Py_DECREF(result);
+    return 0;
+}
+
+/* Runs the handler program at `pc`. Returns -1 if a callback raised an exception. */
+static int run_handler(StateMachineObject *self, int32_t pc)
+{
+    for (;;) {
+        switch (program[pc]) {
+        case OP_END:
+            return 0;
+        case OP_EXIT:
+            if (call_callback(self->exit_actions, program[pc + 1], self) < 0) {
+                return -1;
+            }
+            pc += 2;
+            break;
+        case OP_ENTER:
+            if (call_callback(self->entry_actions, program[pc + 1], self) < 0) {
+                return -1;
+            }
+            self->state = program[pc + 1];
+            pc += 2;
+            break;
+        case OP_SET_STATE:
+            self->state = program[pc + 1];
+            pc += 2;
+            break;
+        case OP_ACTION:
+            if (call_callback(self->actions, program[pc + 1], self) < 0) {
+                return -1;
+            }
+            pc += 2;
+            break;
+        case OP_GUARD: {
+            PyObject *result = PyObject_CallFunctionObjArgs(
+                PyTuple_GET_ITEM(self->guards, program[pc + 1]), (PyObject *)self, NULL);
+            if (result == NULL) {
+                return -1;
+            }
+            int accepted = PyObject_IsTrue(result);
+            Py_DECREF(result);
+            if (accepted < 0) {
+                return -1;
+            }
+            pc = accepted ? pc + 3 : program[pc + 2];
+            break;
+        }
+        case OP_JUMP:
+            pc = program[pc + 1];
+            break;
+        }
+    }
+}
+
+static int event_from_object(PyObject *object, event_id *event)
+{
+    long value = PyLong_AsLong(object);
+    if (value == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (value < 0 || value >= EVENT_COUNT) {
+        PyErr_Format(PyExc_ValueError, "%ld is not a valid Event", value);
+        return -1;
+    }
+    *event = (event_id)value;
+    return 0;
+}
+
+static int StateMachine_init(StateMachineObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *callbacks = PyObject_GetAttrString((PyObject *)Py_TYPE(self), "_callbacks");
+    if (callbacks == NULL) {
+        return -1;
+    }
+    PyObject *guards, *actions, *entry_actions, *exit_actions;
+    if (!PyTuple_Check(callbacks) ||
+        !PyArg_ParseTuple(callbacks, "O!O!O!O!:_callbacks", &PyTuple_Type, &guards, &PyTuple_Type, &actions,
+                          &PyTuple_Type, &entry_actions, &PyTuple_Type, &exit_actions)) {
+        Py_DECREF(callbacks);
+        if (!PyErr_Occurred()) {
+            PyErr_SetString(PyExc_TypeError, "_callbacks must be a tuple");
+        }
+        return -1;
+    }
+    if (PyTuple_GET_SIZE(guards) != ${len(guard_indices())} || PyTuple_GET_SIZE(actions) != ${len(action_indices())} ||
+        PyTuple_GET_SIZE(entry_actions) != STATE_COUNT || PyTuple_GET_SIZE(exit_actions) != STATE_COUNT) {
+        Py_DECREF(callbacks);
+        PyErr_SetString(PyExc_ValueError, "_callbacks are those of a different statemachine");
+        return -1;
+    }
+    Py_INCREF(guards);
+    Py_XSETREF(self->guards, guards);
+    Py_INCREF(actions);
+    Py_XSETREF(self->actions, actions);
+    Py_INCREF(entry_actions);
+    Py_XSETREF(self->entry_actions, entry_actions);
+    Py_INCREF(exit_actions);
+    Py_XSETREF(self->exit_actions, exit_actions);
+    Py_DECREF(callbacks);
+    self->state = INITIAL_STATE;
+    self->queue_head = 0;
+    self->queue_length = 0;
+    return 0;
+}
+
+static int StateMachine_traverse(StateMachineObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->guards);
+    Py_VISIT(self->actions);
+    Py_VISIT(self->entry_actions);
+    Py_VISIT(self->exit_actions);
+    return 0;
+}
+
+static int StateMachine_clear(StateMachineObject *self)
+{
+    Py_CLEAR(self->guards);
+    Py_CLEAR(self->actions);
+    Py_CLEAR(self->entry_actions);
+    Py_CLEAR(self->exit_actions);
+    return 0;
+}
+
+static void StateMachine_dealloc(StateMachineObject *self)
+{
+    PyObject_GC_UnTrack(self);
+    StateMachine_clear(self);
+    PyMem_Free(self->queue);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *StateMachine_queue_event(StateMachineObject *self, PyObject *event_object)
+{
+    event_id event;
+    if (event_from_object(event_object, &event) < 0 || push_event(self, event) < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/*
+ * Processes pending events until none remain, `max_events` (unless -1) events
+ * have been processed or the monotonic clock has reached `deadline` (unless
+ * NULL). Returns -1 if a callback raised an exception.
+ */
+static int process_events(StateMachineObject *self, Py_ssize_t max_events, const double *deadline)
+{
+    if (self->guards == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "StateMachineBase.__init__() has not been called");
+        return -1;
+    }
+    Py_ssize_t processed = 0;
+    while (self->queue_length && processed != max_events) {
+        if (deadline != NULL) {
+            PyObject *now = PyObject_CallObject(monotonic, NULL);
+            if (now == NULL) {
+                return -1;
+            }
+            double now_value = PyFloat_AsDouble(now);
+            Py_DECREF(now);
+            if (now_value >= *deadline) {
+                break;
+            }
+        }
+        event_id event = self->queue[self->queue_head];
+        self->queue_head = (self->queue_head + 1) % self->queue_capacity;
+        self->queue_length--;
+        processed++;
+        int32_t handler = handler_of(self->state, event);
+        if (handler >= 0) {
+            if (run_handler(self, handler) < 0 || push_event(self, NULL_EVENT) < 0) {
+                return -1;
+            }
+        }
+    }
+    return 0;
+}
+
+static PyObject *StateMachine_process_events(StateMachineObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *keywords[] = {"max_events", "deadline", NULL};
+    PyObject *max_events_object = Py_None;
+    PyObject *deadline_object = Py_None;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OO:process_events", keywords, &max_events_object, &deadline_object)) {
+        return NULL;
+    }
+    Py_ssize_t max_events = -1;
+    if (max_events_object != Py_None) {
+        max_events = PyLong_AsSsize_t(max_events_object);
+        if (max_events == -1 && PyErr_Occurred()) {
+            return NULL;
+        }
+    }
+    double deadline = 0;
+    if (deadline_object != Py_None) {
+        deadline = PyFloat_AsDouble(deadline_object);
+        if (deadline == -1 && PyErr_Occurred()) {
+            return NULL;
+        }
+    }
+    if (process_events(self, max_events, deadline_object != Py_None ? &deadline : NULL) < 0) {
+        return NULL;
+    }
+    return PyLong_FromSsize_t(self->queue_length);
+}
+
+static PyObject *StateMachine_start(StateMachineObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (push_event(self, NULL_EVENT) < 0 || process_events(self, -1, NULL) < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *StateMachine_can_handle(StateMachineObject *self, PyObject *event_object)
+{
+    event_id event;
+    if (event_from_object(event_object, &event) < 0) {
+        return NULL;
+    }
+    return PyBool_FromLong(handler_of(self->state, event) >= 0);
+}
+
+static PyObject *StateMachine_is_in(StateMachineObject *self, PyObject *state_object)
+{
+    long state = PyLong_AsLong(state_object);
+    if (state == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+    if (state < 0 || state >= STATE_COUNT) {
+        PyErr_Format(PyExc_ValueError, "%ld is not a valid State", state);
+        return NULL;
+    }
+    return PyBool_FromLong(is_in_state(self->state, (int32_t)state));
+}
+
+static PyObject *StateMachine_get_state(StateMachineObject *self, void *Py_UNUSED(closure))
+{
+    return PyLong_FromLong(self->state);
+}
+
+static PyObject *StateMachine_get_pending_events(StateMachineObject *self, void *Py_UNUSED(closure))
+{
+    return PyLong_FromSsize_t(self->queue_length);
+}
+
+static PyMethodDef StateMachine_methods[] = {
+    {"queue_event", (PyCFunction)StateMachine_queue_event, METH_O, "Queues an event, to be processed by process_events()"},
+    {"process_events", (PyCFunction)(void (*)(void))StateMachine_process_events, METH_VARARGS | METH_KEYWORDS,
+     "Processes pending events until none remain, `max_events` events have been processed or the time.monotonic() "
+     "clock has reached `deadline`. Returns the number of events that remain pending."},
+    {"start", (PyCFunction)StateMachine_start, METH_NOARGS, "Takes the initial transitions"},
+    {"can_handle", (PyCFunction)StateMachine_can_handle, METH_O, "Returns True if the current state handles `event`"},
+    {"is_in", (PyCFunction)StateMachine_is_in, METH_O, "Returns True if the current state is `state` or is nested within `state`"},
+    {NULL},
+};
+
+static PyGetSetDef StateMachine_getset[] = {
+    {"_state", (getter)StateMachine_get_state, NULL, "Value of the current state", NULL},
+    {"pending_events", (getter)StateMachine_get_pending_events, NULL, "Number of pending events", NULL},
+    {NULL},
+};
+
+static PyTypeObject StateMachineType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "${module_name}.StateMachineBase",
+    .tp_basicsize = sizeof(StateMachineObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,
+    .tp_doc = "Statemachine whose event queue and dispatch are implemented in C",
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc)StateMachine_init,
+    .tp_dealloc = (destructor)StateMachine_dealloc,
+    .tp_traverse = (traverseproc)StateMachine_traverse,
+    .tp_clear = (inquiry)StateMachine_clear,
+    .tp_methods = StateMachine_methods,
+    .tp_getset = StateMachine_getset,
+};
+
+static struct PyModuleDef module_def = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "${module_name}",
+    .m_doc = "Event queue and dispatch of a generated statemachine",
+    .m_size = -1,
+};
+
+PyMODINIT_FUNC PyInit_${module_name}(void)
+{
+    if (PyType_Ready(&StateMachineType) < 0) {
+        return NULL;
+    }
+    PyObject *time_module = PyImport_ImportModule("time");
+    if (time_module == NULL) {
+        return NULL;
+    }
+    Py_XSETREF(monotonic, PyObject_GetAttrString(time_module, "monotonic"));
+    Py_DECREF(time_module);
+    if (monotonic == NULL) {
+        return NULL;
+    }
+    PyObject *module = PyModule_Create(&module_def);
+    if (module == NULL) {
+        return NULL;
+    }
+    Py_INCREF(&StateMachineType);
+    if (PyModule_AddObject(module, "StateMachineBase", (PyObject *)&StateMachineType) < 0) {
+        Py_DECREF(&StateMachineType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
@@ -0,0 +1,15 @@
+<%
+from gen_statemachine.backend.dispatch import extension_module_name
+%>\
+"""
+Builds the generated ${extension_module_name(output_dir)} extension module in place:
+
+    python setup.py build_ext --inplace
+"""
+
+from setuptools import Extension, setup
+
+setup(
+    name="statemachine",
+    ext_modules=[Extension("${extension_module_name(output_dir)}", sources=["_statemachine.c"])],
+)
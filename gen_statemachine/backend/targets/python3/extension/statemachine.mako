@@ -0,0 +1,85 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    enum_name,
+    extension_module_name,
+)
+
+def guards():
+    # Guards and actions are indexed in the same order by _statemachine.c.mako
+    return [transition.guard for transition in statemachine.transitions().values() if transition.guard]
+
+def actions():
+    return [transition.action for transition in statemachine.transitions().values() if transition.action]
+
+def behaviour_function(vertex, kind):
+    actions = getattr(vertex, f"{kind}_actions", None)
+    return f"_{kind}_{enum_name(vertex)}" if actions else "None"
+
+def user_attributes():
+    # Attributes that diagram behaviour reads or writes on `self` need slots,
+    # apart from those of the C base class
+    return sorted(dispatch.self_attributes(statemachine) - {"_state", "pending_events"})
+%>\
+from enum import IntEnum
+from ${extension_module_name(output_dir)} import StateMachineBase
+
+class State(IntEnum):
+    % for vertex in statemachine.vertices().values():
+    ${enum_name(vertex)} = ${loop.index}
+    % endfor
+
+class Event(IntEnum):
+    ${_null_event_name} = 0
+    % for event in statemachine.events().values():
+    ${event.name} = ${loop.index + 1}
+    % endfor
+
+_STATES = tuple(State)
+
+# Guards and behaviour of the diagram, which are called back by the C dispatch code
+% for guard in guards():
+
+def _guard_${loop.index}(self):
+    return ${guard.condition}
+% endfor
+% for action in actions():
+
+def _action_${loop.index}(self):
+    ${action.text}
+% endfor
+% for kind in ["entry", "exit"]:
+% for vertex in statemachine.vertices().values():
+% if getattr(vertex, f"{kind}_actions", None):
+
+def ${behaviour_function(vertex, kind)}(self):
+    % for action in getattr(vertex, f"{kind}_actions"):
+    ${action.text}
+    % endfor
+% endif
+% endfor
+% endfor
+
+class StateMachine(StateMachineBase):
+    """
+    Has the same API as the StateMachine of the python3/native target, but its
+    event queue and dispatch are implemented in C by the ${extension_module_name(output_dir)} module
+    """
+
+    # Guard, action, entry action and exit action callbacks, which each
+    # instance takes from its class when it is initialised
+    _callbacks = (
+        (${"".join(f"_guard_{index}, " for index in range(len(guards())))}),
+        (${"".join(f"_action_{index}, " for index in range(len(actions())))}),
+        (${"".join(behaviour_function(vertex, "entry") + ", " for vertex in statemachine.vertices().values())}),
+        (${"".join(behaviour_function(vertex, "exit") + ", " for vertex in statemachine.vertices().values())}),
+    )
+
+    __slots__ = (${"".join(f'"{name}", ' for name in user_attributes())})
+
+    @property
+    def _current_state(self) -> State:
+        return _STATES[self._state]
@@ -0,0 +1,293 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend.table_compression import compress_table
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    INITIAL_STATE_NAME as _initial_state_name,
+    enum_name,
+)
+
+def transition_name(transition):
+    return transition.id.split(".")[-1]
+
+def terminal_states_in_sub_regions():
+    return [terminal_state for terminal_state in statemachine.terminal_states().values() if terminal_state.region.state]
+
+def dispatched_transitions():
+    return dispatch.dispatched_transitions(statemachine)
+
+def region_set_for_vertex(vertex):
+    regions = []
+    region = vertex.region
+    while region.state:
+        regions.append(region)
+        region = region.state.region
+    return regions
+
+def exited_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    return [region.state for region in source_regions if region not in target_regions]
+
+def entered_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    return [region.state for region in target_regions if region not in source_regions]
+
+def resolved_target(transition):
+    # Entering a composite state enters the initial states of its sub regions
+    vertex = transition.target
+    while type(vertex) is gen_statemachine.model.State and vertex.sub_regions:
+        vertex = vertex.sub_regions[0].initial_state
+    return vertex
+
+def has_behaviour(transition, exited_substates=()):
+    # Inherited transitions also exit the states nested within their source
+    exited = list(exited_substates) + [transition.source] + exited_states(transition)
+    entered = entered_states(transition) + [transition.target]
+    return bool(
+        transition.action
+        or any(getattr(state, "exit_actions", None) for state in exited)
+        or any(getattr(state, "entry_actions", None) for state in entered)
+    )
+
+def candidate_transitions(transitions):
+    # Same precedence as the native target: guards first, in diagram order
+    guarded = [t for t in transitions if t.guard]
+    unguarded = [t for t in transitions if not t.guard]
+    return guarded + unguarded[:1]
+
+def needs_callbacks(transitions, exited_substates=()):
+    return any(t.guard or has_behaviour(t, exited_substates) for t in candidate_transitions(transitions))
+
+def state_values():
+    return {enum_name(vertex): index for index, vertex in enumerate(statemachine.vertices().values())}
+
+def event_values():
+    values = {_null_event_name: 0}
+    for event in statemachine.events().values():
+        values[event.name] = len(values)
+    return values
+
+def transition_table():
+    # The next state of each (state, event) cell, which is -1 for cells that
+    # are resolved through the callbacks
+    states, events = state_values(), event_values()
+    next_states, callbacks = {}, {}
+    for (source_name, event_name), (transitions, exited) in dispatched_transitions().items():
+        cell = (states[source_name], events[event_name])
+        if needs_callbacks(transitions, exited):
+            next_states[cell] = -1
+            callbacks[cell] = 1
+        else:
+            next_states[cell] = states[enum_name(resolved_target(candidate_transitions(transitions)[0]))]
+    for terminal_state in terminal_states_in_sub_regions():
+        next_states[(states[enum_name(terminal_state)], events[_null_event_name])] = states[enum_name(terminal_state.region.state)]
+    table = compress_table(next_states, len(states), len(events))
+    return table, table.values(next_states, -1), table.values(callbacks, 0)
+
+def array_items(values, per_line=16):
+    return [", ".join(str(value) for value in values[start:start + per_line]) for start in range(0, len(values), per_line)]
+
+def state_dtype():
+    for bits in [8, 16, 32]:
+        if len(statemachine.vertices()) < 2 ** (bits - 1):
+            return f"np.int{bits}"
+    return "np.int64"
+%>\
+from collections import Counter
+from enum import IntEnum
+from typing import Callable, Dict, Iterable, Mapping, Optional, Union
+import numpy as np
+
+class State(IntEnum):
+    % for vertex in statemachine.vertices().values():
+    ${enum_name(vertex)} = ${loop.index}
+    % endfor
+
+class Event(IntEnum):
+    ${_null_event_name} = 0
+    % for event in statemachine.events().values():
+    ${event.name} = ${loop.index + 1}
+    % endfor
+
+class Transition(IntEnum):
+    % for transition in statemachine.transitions().values():
+    ${transition_name(transition)} = ${loop.index}
+    % endfor
+
+# Diagram text of transition guards and actions, for reference
+# when implementing the fleet's callbacks
+GUARDS = {
+    % for transition in statemachine.transitions().values():
+    % if transition.guard:
+    Transition.${transition_name(transition)}: ${repr(transition.guard.condition)},
+    % endif
+    % endfor
+}
+ACTIONS = {
+    % for transition in statemachine.transitions().values():
+    % if transition.action:
+    Transition.${transition_name(transition)}: ${repr(transition.action.text)},
+    % endif
+    % endfor
+}
+
+STATE_DTYPE = ${state_dtype()}
+NUM_STATES = len(State)
+NUM_EVENTS = len(Event)
+
+# The (state, event) tables are compressed by row displacement: the cell of
+# (state, event) is at index `TABLE_BASE[state] + event` of the other TABLE_
+# arrays, and only belongs to `state` if TABLE_CHECK holds `state` there
+<% table, next_states, callbacks = transition_table() %>\
+TABLE_BASE = np.array([
+    % for items in array_items(table.base):
+    ${items},
+    % endfor
+], dtype=np.intp)
+TABLE_CHECK = np.array([
+    % for items in array_items(table.check):
+    ${items},
+    % endfor
+], dtype=STATE_DTYPE)
+# Next state of each cell, or -1 where the event is ignored or resolved through callbacks
+TABLE_NEXT = np.array([
+    % for items in array_items(next_states):
+    ${items},
+    % endfor
+], dtype=STATE_DTYPE)
+# Whether each cell is resolved through the fleet's callbacks, see CALLBACK_CELLS
+TABLE_CALLBACK = np.array([
+    % for items in array_items(callbacks):
+    ${items},
+    % endfor
+], dtype=bool)
+
+# (state, event) cells with guarded transitions or behaviour are resolved
+# per instance through the fleet's callbacks. Each cell lists its candidate
+# transitions in order of precedence: (transition, next state, has guard,
+# has behaviour)
+CALLBACK_CELLS = {
+    % for key, (transitions, exited) in dispatched_transitions().items():
+    % if needs_callbacks(transitions, exited):
+    (State.${key[0]}, Event.${key[1]}): (
+        % for transition in candidate_transitions(transitions):
+        (Transition.${transition_name(transition)}, State.${enum_name(resolved_target(transition))}, ${bool(transition.guard)}, ${has_behaviour(transition, exited)}),
+        % endfor
+    ),
+    % endif
+    % endfor
+}
+
+# guard(transition, indices) -> bool array with an entry for each index
+GuardCallback = Callable[[Transition, np.ndarray], np.ndarray]
+# action(transition, indices) is called for the instances taking a transition
+ActionCallback = Callable[[Transition, np.ndarray], None]
+
+class StateMachineFleet:
+    """
+    Holds the current states of `size` identical statemachines and applies
+    events to many of them in one vectorized step. Guards and behaviour from
+    the diagram are not run by the fleet, instead they are delegated to the
+    `guard` and `action` callbacks for only the instances that need them.
+    Completion transitions are followed for up to `max_completion_steps`
+    steps per dispatch.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        guard: Optional[GuardCallback] = None,
+        action: Optional[ActionCallback] = None,
+        max_completion_steps: int = NUM_STATES,
+    ):
+        self.states = np.full(size, State.${_initial_state_name}, dtype=STATE_DTYPE)
+        self.guard = guard
+        self.action = action
+        self.max_completion_steps = max_completion_steps
+
+    def start(self):
+        self.dispatch(Event.${_null_event_name})
+
+    def dispatch(self, events: Union[Event, np.ndarray], indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Applies `events` to the instances at `indices` (all instances by default),
+        where `events` is one event for every instance or an array with an event
+        per instance. Instances that transition then process completion (null
+        event) transitions. Returns the indices of instances that transitioned.
+        """
+        indices = np.arange(len(self.states)) if indices is None else np.asarray(indices)
+        events = np.broadcast_to(np.asarray(events, dtype=np.intp), indices.shape)
+        transitioned = moved = self._step(indices, events)
+        for _ in range(self.max_completion_steps):
+            if not moved.size:
+                break
+            moved = self._step(moved, np.full(moved.shape, Event.${_null_event_name}, dtype=np.intp))
+        return transitioned
+
+    def in_state(self, state: State) -> np.ndarray:
+        """Returns the indices of instances currently in `state`"""
+        return np.flatnonzero(self.states == state)
+
+    def count_by_state(self) -> Dict[State, int]:
+        counts = np.bincount(self.states, minlength=NUM_STATES)
+        return {state: int(counts[state]) for state in State if counts[state]}
+
+    @classmethod
+    def _state_counts(cls, fleets: Iterable["StateMachineFleet"]) -> Counter:
+        """Returns the number of instances in each state across `fleets` (see hot_reload.py)"""
+        counts = Counter()
+        for fleet in fleets:
+            counts.update(fleet.count_by_state())
+        return counts
+
+    _MIGRATABLE = True
+
+    @classmethod
+    def _migrate(cls, fleet, states: Mapping, events: Mapping):
+        """
+        Migrates `fleet`, an instance of an earlier generation of this class,
+        by mapping the states of its instances with `states` in one lookup.
+        Returns the migrated fleet and the dropped events, of which there are
+        none as a fleet has no pending events.
+        """
+        table = np.full(max(states, default=0) + 1, -1, dtype=STATE_DTYPE)
+        for old_state, new_state in states.items():
+            table[old_state] = new_state
+        fleet.__class__ = cls
+        fleet.states = table[fleet.states]
+        return fleet, []
+
+    def _step(self, indices: np.ndarray, events: np.ndarray) -> np.ndarray:
+        sources = self.states[indices]
+        cells = TABLE_BASE[sources] + events
+        present = TABLE_CHECK[cells] == sources
+        targets = np.where(present, TABLE_NEXT[cells], -1).astype(STATE_DTYPE, copy=False)
+        callbacks = TABLE_CALLBACK[cells] & present
+        if callbacks.any():
+            self._resolve_callback_cells(indices, sources, events, targets, callbacks)
+        moved = targets >= 0
+        self.states[indices[moved]] = targets[moved]
+        return indices[moved]
+
+    def _resolve_callback_cells(self, indices, sources, events, targets, callbacks):
+        positions = np.flatnonzero(callbacks)
+        cells = sources[positions].astype(np.intp) * NUM_EVENTS + events[positions]
+        for cell in np.unique(cells):
+            pending = positions[cells == cell]
+            for transition, target, has_guard, has_behaviour in CALLBACK_CELLS[divmod(int(cell), NUM_EVENTS)]:
+                if not pending.size:
+                    break
+                if has_guard:
+                    if self.guard is None:
+                        raise RuntimeError(f"A guard callback is required for {transition!r}")
+                    accepted = np.asarray(self.guard(transition, indices[pending]), dtype=bool)
+                    taken, pending = pending[accepted], pending[~accepted]
+                else:
+                    taken, pending = pending, pending[:0]
+                targets[taken] = target
+                if has_behaviour and self.action is not None and taken.size:
+                    self.action(transition, indices[taken])
@@ -0,0 +1,11 @@
+from fleet import StateMachineFleet
+
+
+def main():
+    fleet = StateMachineFleet(size=1_000_000)
+    fleet.start()
+    print(fleet.count_by_state())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Hot reload of a regenerated statemachine module, which migrates the live
+instances of the module's statemachine class to the regenerated class.
+
+States and events are matched by name, so their integer values may change
+between generations. The names may also be mapped to new names with
+`state_renames` and `event_renames`, e.g. when a state has been renamed in
+the diagram. If any instance is in a state that cannot be mapped, a
+`StateMigrationError` listing all such states is raised, and if either
+class cannot migrate its instances (threaded statemachines), a `TypeError`
+is raised. Both are raised before the module or any instance is changed.
+
+Instances are migrated without being re-initialised. An instance keeps its
+identity if the regenerated class has the same slots, otherwise an instance
+of the regenerated class takes its place in `ReloadReport.machines`.
+"""
+
+import importlib.util
+from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Type
+
+# Statemachine classes generated by each python target
+STATEMACHINE_CLASS_NAMES = ["StateMachine", "StateMachineFleet"]
+
+
+class StateMigrationError(Exception):
+    def __init__(self, unknown_states: Dict[str, int]):
+        self.unknown_states = unknown_states
+        states = ", ".join(
+            f"{name} ({count})" for name, count in unknown_states.items()
+        )
+        super().__init__(f"Instances are in states that no longer exist: {states}")
+
+
+@dataclass
+class ReloadReport:
+    # The migrated instances, in the order they were given
+    machines: List[object] = field(default_factory=list)
+    # Number of pending events that no longer exist and were dropped, by name
+    dropped_events: Counter = field(default_factory=Counter)
+
+
+def statemachine_class(module: ModuleType) -> Any:
+    for name in STATEMACHINE_CLASS_NAMES:
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise TypeError(
+        f"{module.__name__} does not contain a generated statemachine class"
+    )
+
+
+def uses_int_constants(module: ModuleType) -> bool:
+    """Returns `True` if the module was generated with --int-constants"""
+    return not (isinstance(module.State, type) and issubclass(module.State, Enum))
+
+
+def enum_view(module: ModuleType, name: str) -> Type[Enum]:
+    """
+    Returns the `State` or `Event` Enum of a module, which is the lazily built
+    `StateEnum` or `EventEnum` view if the module uses int constants
+    """
+    return getattr(module, f"{name}Enum" if uses_int_constants(module) else name)
+
+
+def member_map(
+    old_enum: Type[Enum], new_enum: Type[Enum], renames: Dict[str, str]
+) -> Dict[Enum, Enum]:
+    """Maps the members of `old_enum` to the members of `new_enum` with the same (or renamed) name"""
+    members: Dict[Enum, Enum] = {}
+    for member in old_enum:
+        name = renames.get(member.name, member.name)
+        if name in new_enum.__members__:
+            members[member] = new_enum[name]
+    return members
+
+
+def reload_statemachines(
+    module: ModuleType,
+    machines: Iterable[object],
+    state_renames: Optional[Dict[str, str]] = None,
+    event_renames: Optional[Dict[str, str]] = None,
+) -> ReloadReport:
+    """
+    Imports the regenerated source of `module` in place and migrates `machines`,
+    instances of the module's current statemachine class, to the new class
+    """
+    machines = list(machines)
+    old_class = statemachine_class(module)
+    spec = module.__spec__
+    if spec is None or spec.loader is None:
+        raise TypeError(f"{module.__name__} was not imported from a source file")
+
+    new_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(new_module)
+    new_class = statemachine_class(new_module)
+    for cls in [old_class, new_class]:
+        if not cls._MIGRATABLE:
+            raise TypeError(
+                f"Instances of {cls.__name__} cannot be migrated, as threaded statemachines are owned by their worker thread"
+            )
+
+    old_states, old_events = enum_view(module, "State"), enum_view(module, "Event")
+    state_members = member_map(
+        old_states, enum_view(new_module, "State"), state_renames or {}
+    )
+    event_members = member_map(
+        old_events, enum_view(new_module, "Event"), event_renames or {}
+    )
+    states: Mapping[Enum, object] = state_members
+    events: Mapping[Enum, object] = event_members
+    if uses_int_constants(new_module):
+        # Instances of the new class hold the plain values of the view's members
+        states = {old: new.value for old, new in state_members.items()}
+        events = {old: new.value for old, new in event_members.items()}
+
+    unknown_states = {
+        old_states(state).name: count
+        for state, count in old_class._state_counts(machines).items()
+        if state not in states
+    }
+    if unknown_states:
+        raise StateMigrationError(unknown_states)
+
+    module.__dict__.update(new_module.__dict__)
+    report = ReloadReport()
+    for machine in machines:
+        migrated, dropped_events = new_class._migrate(machine, states, events)
+        report.machines.append(migrated)
+        report.dropped_events.update(old_events(event).name for event in dropped_events)
+    return report
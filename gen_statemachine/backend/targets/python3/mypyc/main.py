@@ -0,0 +1,10 @@
+from statemachine import StateMachine
+
+
+def main():
+    sm = StateMachine()
+    sm.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+Compiles the generated statemachine module with mypyc, which must be
+installed (`pip install mypy`):
+
+    python setup.py build_ext --inplace
+
+The module also runs, more slowly, without being compiled.
+"""
+
+from mypyc.build import mypycify
+from setuptools import setup
+
+setup(
+    name="statemachine",
+    # The module is named after the file, wherever the output directory is
+    ext_modules=mypycify(["--explicit-package-bases", "statemachine.py"]),
+)
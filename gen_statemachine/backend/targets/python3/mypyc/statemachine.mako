@@ -0,0 +1,326 @@
+<%
+import gen_statemachine
+import gen_statemachine.model
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.table_compression import compress_table
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    INITIAL_STATE_NAME as _initial_state_name,
+    enum_name,
+)
+
+_indent = "    "
+
+class IfOrElif:
+    def __init__(self):
+        self.called = False
+    def __next__(self):
+        if not self.called:
+            self.called = True
+            return "if"
+        return "elif"
+
+def state_constant(vertex_or_name):
+    name = vertex_or_name if isinstance(vertex_or_name, str) else enum_name(vertex_or_name)
+    return f"_STATE_{name}"
+
+def event_constant(event_name):
+    return f"_EVENT_{event_name}"
+
+def event_values():
+    values = {_null_event_name: 0}
+    for event in statemachine.events().values():
+        values[event.name] = len(values)
+    return values
+
+def user_attributes():
+    # Attributes that diagram behaviour reads or writes on `self` are declared,
+    # as a compiled class has no instance dict
+    return sorted(dispatch.self_attributes(statemachine) - {"_current_state", "_event_queue"})
+
+def states_with_entry_actions():
+    return [state for state in statemachine.states().values() if state.entry_actions]
+
+def states_with_exit_actions():
+    return [state for state in statemachine.states().values() if state.exit_actions]
+
+def transitions_by_source_and_event():
+    return dispatch.transitions_by_source_and_event(statemachine)
+
+def dispatched_transitions():
+    return dispatch.dispatched_transitions(statemachine)
+
+def state_values():
+    return {enum_name(vertex): index for index, vertex in enumerate(statemachine.vertices().values())}
+
+def handler_table():
+    # The handler of each (state, event), compressed in the same way as the
+    # tables of python3/extension so that dispatch is an index rather than a
+    # comparison with each state
+    states, events = state_values(), event_values()
+    handlers = {(states[source_name], events[event_name]): f"_process_{event_name}_in_{source_name}" for source_name, event_name in dispatched_transitions().keys()}
+    table = compress_table(handlers, len(states), len(events))
+    return table, table.values(handlers, "")
+
+def array_items(values, per_line=16):
+    return [", ".join(str(value) for value in values[start:start + per_line]) for start in range(0, len(values), per_line)]
+
+def accepted_event_masks():
+    # Bit `n` of a state's mask is set if the state handles the event with value `n`
+    masks = {enum_name(vertex): 0 for vertex in statemachine.vertices().values()}
+    values = event_values()
+    for source_name, event_name in dispatched_transitions().keys():
+        masks[source_name] |= 1 << values[event_name]
+    return masks
+
+def ancestor_state_masks():
+    # Bit `n` of a vertex's mask is set if the vertex, or a state enclosing it,
+    # has the state value `n`
+    values = {vertex.id: index for index, vertex in enumerate(statemachine.vertices().values())}
+    masks = []
+    for vertex in statemachine.vertices().values():
+        mask = 1 << values[vertex.id]
+        region = vertex.region
+        while region.state:
+            mask |= 1 << values[region.state.id]
+            region = region.state.region
+        masks.append(mask)
+    return masks
+
+def region_set_for_vertex(vertex):
+    regions = []
+    region = vertex.region
+    while region.state:
+        regions.append(region)
+        region = region.state.region
+    return regions
+
+def exited_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    return [region.state for region in source_regions if region not in target_regions]
+
+def entered_states(transition):
+    source_regions = region_set_for_vertex(transition.source)
+    target_regions = region_set_for_vertex(transition.target)
+    entered_states = [region.state for region in target_regions if region not in source_regions]
+    entered_states.reverse()
+    return entered_states
+
+def is_lowered_choice(vertex, choices):
+    return isinstance(vertex, gen_statemachine.model.Choice) and vertex.id not in choices
+
+def is_sub_region_terminal_state(vertex):
+    return isinstance(vertex, gen_statemachine.model.TerminalState) and vertex.region.state is not None
+%>\
+<%def name="action_block(action, indent_str)">\
+${indent_str}${action.text}
+</%def>\
+<%def name="enter_substates(vertex, indent_str)">\
+% if type(vertex) is gen_statemachine.model.State and vertex.sub_regions:
+${indent_str}self._enter_state(${state_constant(vertex.sub_regions[0].initial_state)})
+${enter_substates(vertex.sub_regions[0].initial_state, indent_str)}\
+% endif
+</%def>\
+<%def name="transition_block(transition, indent_str, inherited_exits)">\
+% for exited_state in inherited_exits:
+${indent_str}self._exit_state(${state_constant(exited_state)})
+% endfor
+${indent_str}self._exit_state(${state_constant(transition.source)})
+${transition_path(transition, indent_str, [transition.source.id])}\
+</%def>\
+<%def name="transition_path(transition, indent_str, choices)">\
+<% target = transition.target %>\
+% for exited_state in exited_states(transition):
+${indent_str}self._exit_state(${state_constant(exited_state)})
+% endfor
+% if transition.action:
+${action_block(transition.action, indent_str)}\
+% endif
+% for entered_state in entered_states(transition):
+${indent_str}self._enter_state(${state_constant(entered_state)})
+% endfor
+% if is_lowered_choice(target, choices):
+${choice_block(target, indent_str, choices + [target.id])}\
+% elif is_sub_region_terminal_state(target):
+${indent_str}self._current_state = ${state_constant(target.region.state)}
+% else:
+${indent_str}self._enter_state(${state_constant(target)})
+${enter_substates(target, indent_str)}\
+% endif
+</%def>\
+<%def name="choice_block(choice, indent_str, choices)">\
+<% guarded = [t for t in choice.outgoing_transitions if t.guard] %>\
+<% unguarded = [t for t in choice.outgoing_transitions if not t.guard] %>\
+% for transition in guarded:
+${indent_str}${"if" if loop.first else "elif"} ${transition.guard.condition.strip()}:
+${transition_path(transition, indent_str + _indent, choices)}\
+% endfor
+% if guarded:
+${indent_str}else:
+% endif
+<% branch_indent = indent_str + _indent if guarded else indent_str %>\
+% if unguarded:
+${transition_path(unguarded[0], branch_indent, choices)}\
+% else:
+${branch_indent}self._enter_state(${state_constant(choice)})
+% endif
+</%def>\
+"""
+Generated by gen_statemachine for compilation with mypyc (see setup.py).
+States and events are dispatched as plain `int` constants; the `State` and
+`Event` enums are only a named view of the same values for callers.
+"""
+
+from collections import deque
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Callable, Deque, Final, Optional, Tuple, final
+
+% for vertex in statemachine.vertices().values():
+${state_constant(vertex)}: Final = ${loop.index}
+% endfor
+
+% for event_name, value in event_values().items():
+${event_constant(event_name)}: Final = ${value}
+% endfor
+
+class State(IntEnum):
+    % for vertex in statemachine.vertices().values():
+    ${enum_name(vertex)} = ${state_constant(vertex)}
+    % endfor
+
+class Event(IntEnum):
+    % for event_name in event_values():
+    ${event_name} = ${event_constant(event_name)}
+    % endfor
+
+# Bit `n` is set for each event with value `n` handled by the state at that index
+_ACCEPTED_EVENTS: Final[Tuple[int, ...]] = (
+    % for mask in accepted_event_masks().values():
+    ${bin(mask)},
+    % endfor
+)
+
+# Each state and the states that enclose it, with bit `n` set for the state with value `n`
+_ANCESTOR_STATES: Final[Tuple[int, ...]] = (
+    % for mask in ancestor_state_masks():
+    ${bin(mask)},
+    % endfor
+)
+<% handlers, handler_names = handler_table() %>
+# The (state, event) table is compressed by row displacement: the handler of
+# (state, event) is at `_HANDLER_BASE[state] + event` of `_HANDLERS`, and is
+# only present if `_HANDLER_CHECK` holds the state there
+_HANDLER_BASE: Final[Tuple[int, ...]] = (
+    % for items in array_items(handlers.base):
+    ${items},
+    % endfor
+)
+_HANDLER_CHECK: Final[Tuple[int, ...]] = (
+    % for items in array_items(handlers.check):
+    ${items},
+    % endfor
+)
+
+@final
+class StateMachine:
+    % for attribute in user_attributes():
+    ${attribute}: Any
+    % endfor
+
+    def __init__(self) -> None:
+        self._current_state: int = ${state_constant(_initial_state_name)}
+        self._event_queue: Deque[int] = deque()
+
+    def start(self) -> None:
+        self.queue_event(${event_constant(_null_event_name)})
+        self.process_events()
+
+    def queue_event(self, event: int) -> None:
+        self._event_queue.append(event)
+
+    def process_events(self, max_events: Optional[int] = None, deadline: Optional[float] = None) -> int:
+        """
+        Processes pending events, including those queued while processing,
+        until none remain, `max_events` events have been processed or the
+        `time.monotonic()` clock has reached `deadline`. Returns the number of
+        events that remain pending.
+        """
+        if max_events is None and deadline is None:
+            while self._event_queue:
+                self._process_event(self._event_queue.popleft())
+            return 0
+        processed = 0
+        while self._event_queue and processed != max_events and (deadline is None or monotonic() < deadline):
+            self._process_event(self._event_queue.popleft())
+            processed += 1
+        return len(self._event_queue)
+
+    def can_handle(self, event: int) -> bool:
+        """Returns `True` if the current state handles `event`"""
+        return bool(_ACCEPTED_EVENTS[self._current_state] >> event & 1)
+
+    def is_in(self, state: int) -> bool:
+        """Returns `True` if the current state is `state` or is nested within `state`"""
+        return bool(_ANCESTOR_STATES[self._current_state] >> state & 1)
+
+    def _process_event(self, event: int) -> None:
+        state = self._current_state
+        cell = _HANDLER_BASE[state] + event
+        handler = _HANDLERS[cell]
+        if handler is None or _HANDLER_CHECK[cell] != state:
+            return
+        handler(self)
+        # Queues the completion event, which takes any completion transitions of the new state
+        self._event_queue.append(${event_constant(_null_event_name)})
+
+    def _exit_state(self, state: int) -> None:
+<% if_elif = IfOrElif() %>\
+        % for state in states_with_exit_actions():
+        ${next(if_elif)} state == ${state_constant(state)}:
+            % for action in state.exit_actions:
+${action_block(action, _indent * 3)}\
+            % endfor
+        % endfor
+        % if not states_with_exit_actions():
+        pass
+        % endif
+
+    def _enter_state(self, state: int) -> None:
+<% if_elif = IfOrElif() %>\
+        % for state in states_with_entry_actions():
+        ${next(if_elif)} state == ${state_constant(state)}:
+            % for action in state.entry_actions:
+${action_block(action, _indent * 3)}\
+            % endfor
+        % endfor
+        self._current_state = state
+% for (source_name, event_name), (transitions, inherited_exits) in dispatched_transitions().items():
+<% transitions_with_guards = [t for t in transitions if t.guard] %>\
+<% transitions_without_guards = [t for t in transitions if not t.guard] %>\
+
+    def _process_${event_name}_in_${source_name}(self) -> None:
+        % for transition in transitions_with_guards:
+        ${"if" if loop.first else "elif"} ${transition.guard.condition.strip()}:
+${transition_block(transition, _indent * 3, inherited_exits)}\
+        % endfor
+        % if transitions_with_guards and transitions_without_guards:
+        else:
+${transition_block(transitions_without_guards[0], _indent * 3, inherited_exits)}\
+        % elif not transitions_with_guards:
+${transition_block(transitions_without_guards[0], _indent * 2, inherited_exits)}\
+        % endif
+% endfor
+
+# Handler of each cell of the table, or None where the event is ignored. The
+# handlers are looked up by name, which compiles to much less code than
+# a reference to each method.
+_HANDLERS: Final[Tuple[Optional[Callable[[StateMachine], None]], ...]] = tuple(
+    getattr(StateMachine, name) if name else None
+    for name in (
+        % for name in handler_names:
+        "${name}",
+        % endfor
+    )
+)
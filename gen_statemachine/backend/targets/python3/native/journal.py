@@ -0,0 +1,145 @@
+"""
+A compact binary journal of the events dispatched by a statemachine, which may
+be replayed to re-drive a statemachine into the same state (e.g. after a crash).
+
+A journal starts with a header, holding the struct format of its records,
+followed by fixed width records of (state ID, event ID, monotonic timestamp
+in ns), where the state is the one that the event was dispatched in.
+
+Records are buffered in memory and written out in batches. Each batch is made
+durable with a single fsync (group commit), when a record is appended once
+`commit_records` records are buffered or `commit_interval` seconds have passed
+since the last commit. There is no background timer, so the records appended
+after the last commit stay buffered until the next append, `commit()` or
+`close()`.
+
+Running this file replays a journal with a generated statemachine module:
+
+    python journal.py events.journal --module statemachine
+"""
+
+import argparse
+import importlib
+import os
+import struct
+import time
+from typing import Callable, Iterator, Tuple
+
+MAGIC = b"GSMJ"
+VERSION = 1
+# Magic, version and the length of the record format that follows
+_HEADER = struct.Struct("<4sBB")
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal:
+    """
+    Arguments:
+    - path: Journal file, which is appended to if it already exists
+    - record_format: Struct format of a (state ID, event ID, timestamp) record
+    - commit_records: Number of buffered records that triggers a commit
+    - commit_interval: Seconds after the last commit that an appended record triggers a commit
+    - clock: Returns the current monotonic time in ns
+    """
+
+    def __init__(
+        self,
+        path: str,
+        record_format: str,
+        commit_records: int = 1024,
+        commit_interval: float = 0.05,
+        clock: Callable[[], int] = time.monotonic_ns,
+    ):
+        self._record = struct.Struct(record_format)
+        self._commit_size = commit_records * self._record.size
+        self._commit_interval_ns = int(commit_interval * 1e9)
+        self._clock = clock
+        self._buffer = bytearray()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            format_bytes = record_format.encode("ascii")
+            self._file.write(_HEADER.pack(MAGIC, VERSION, len(format_bytes)))
+            self._file.write(format_bytes)
+        elif read_header(path) != record_format:
+            self._file.close()
+            raise JournalError(f"{path} holds records of a different format")
+        self._last_commit = clock()
+
+    def append(self, state_id: int, event_id: int):
+        now = self._clock()
+        self._buffer += self._record.pack(state_id, event_id, now)
+        if (
+            len(self._buffer) >= self._commit_size
+            or now - self._last_commit >= self._commit_interval_ns
+        ):
+            self.commit()
+
+    def commit(self):
+        """Writes out the buffered records and waits until they are durable"""
+        self._file.write(self._buffer)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+        self._last_commit = self._clock()
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_header(path: str) -> str:
+    """Returns the record format of the journal at `path`"""
+    with open(path, "rb") as file:
+        header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise JournalError(f"{path} is not a journal")
+        magic, version, format_length = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise JournalError(f"{path} is not a version {VERSION} journal")
+        return file.read(format_length).decode("ascii")
+
+
+def read_journal(path: str) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields the (state ID, event ID, timestamp) records of the journal at `path`.
+    An incomplete record at the end, from a write that was interrupted, is ignored.
+    """
+    record_format = read_header(path)
+    record = struct.Struct(record_format)
+    with open(path, "rb") as file:
+        file.seek(_HEADER.size + len(record_format))
+        while chunk := file.read(record.size * 4096):
+            complete = len(chunk) - len(chunk) % record.size
+            yield from record.iter_unpack(chunk[:complete])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a statemachine journal")
+    parser.add_argument("journal", help="Path of the journal file")
+    parser.add_argument(
+        "--module",
+        default="statemachine",
+        help="Generated statemachine module to replay with (default: statemachine)",
+    )
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.module)
+    started = time.perf_counter()
+    machine = module.replay_journal(args.journal)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Replayed {args.journal} in {elapsed:.3f}s, final state: {machine._current_state}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 <%
+import ast
 import gen_statemachine
 import gen_statemachine.model
+from gen_statemachine.backend import dispatch
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME as _null_event_name,
+    enum_name,
+)
 
-_null_event_name = "_null_event"
-_initial_state_name = "_initial_state"
-_terminal_state_name = "_terminal_state"
 _event_handler_prefix = "_process_event_in_"
+# Output directory of the handler shard modules, which matches the fan_out of files.toml
+_handler_shards_dir = "statemachine_handlers"
 _indent = "    "
+# Fewest consecutive equality guards on one expression that are compiled into a decision table
+_decision_table_min_branches = 4
 
 class IfOrElif:
     def __init__(self):
@@ -17,32 +24,31 @@ class IfOrElif:
             return "if"
         return "elif"
 
-def vertex_namespace(vertex):
-    return (vertex.region.state.name 
-            if vertex.region.state 
-            else ""
-    )
+def time_events():
+    return [event for event in statemachine.events().values() if event.delay is not None]
 
-def enum_name(vertex):
-    if isinstance(vertex, gen_statemachine.model.InitialState):
-        return vertex_namespace(vertex) + _initial_state_name
-    elif isinstance(vertex, gen_statemachine.model.TerminalState):
-        return vertex_namespace(vertex) + _terminal_state_name
-    else:
-        return vertex.name
+def state_time_events(state):
+    # Timers for these events are started on entry to the state and cancelled on exit
+    events = {transition.trigger.id: transition.trigger for transition in state.outgoing_transitions if transition.trigger}
+    return [event for event in events.values() if event.delay is not None]
+
+def wakes_worker():
+    # The worker of a threaded statemachine is woken by a queued _WAKE entry
+    # when events are handed to it outside of the bounded queue
+    return options.threaded and (time_events() or coalesce_policies())
+
+def states_with_time_events():
+    return [state for state in statemachine.states().values() if state_time_events(state)]
 
 def states_with_entry_actions():
-    return [state for state in statemachine.states().values() if state.entry_actions]
+    return [state for state in statemachine.states().values() if state.entry_actions or state_time_events(state)]
 
 def states_with_exit_actions():
-    return [state for state in statemachine.states().values() if state.exit_actions]
+    return [state for state in statemachine.states().values() if state.exit_actions or state_time_events(state)]
 
 def vertices_with_outgoing_transitions():
     return [vertex for vertex in statemachine.vertices().values() if vertex.outgoing_transitions]
 
-def terminal_states_in_sub_regions():
-    return [terminal_state for terminal_state in statemachine.terminal_states().values() if terminal_state.region.state]
-
 def transitions_by_source():
     transitions = {}
     for transition in statemachine.transitions().values():
@@ -55,16 +61,234 @@ def transitions_by_source():
 def preprocess_model():
     return
 
+def value_of(expression):
+    # Enum members are unwrapped to their values, --int-constants are already values
+    return expression if options.int_constants else f"{expression}.value"
+
+def identity_operator(negated=False):
+    # Enum members are compared by identity, while --int-constants may be large ints
+    if options.int_constants:
+        return "!=" if negated else "=="
+    return "is not" if negated else "is"
+
+def iterable(enum_name):
+    # Every member of State or Event, in value order
+    return f"_{enum_name.upper()}S" if options.int_constants else enum_name
+
+def mask_literal(mask):
+    # Masks of large statemachines are written as shifts, so that the source
+    # grows linearly rather than quadratically with the number of states
+    if mask.bit_length() <= 64:
+        return bin(mask)
+    return " | ".join(f"1 << {bit}" for bit in range(mask.bit_length()) if mask >> bit & 1)
+
+def coalesce_policies():
+    # Policies declared in the diagram, overridden by the `coalesce` option
+    return options.event_coalesce_policies(statemachine)
+
+def counts_events():
+    return gen_statemachine.model.CoalescePolicy.COUNT in coalesce_policies().values()
+
+def payload_events():
+    return [event for event in statemachine.events().values() if event.parameters]
+
+def payload_class(event):
+    return f"{event.name}Payload"
+
+def parameter_list(event):
+    return ", ".join(f"{parameter.name}: {parameter.type}" if parameter.type else parameter.name for parameter in event.parameters)
+
+def queue_entry(event, payload="payload"):
+    # Queued events are paired with their payload if any event has parameters
+    return f"({event}, {payload})" if payload_events() else event
+
+def priority_entry(level, event, payload="payload"):
+    # Entries of a threaded priority queue are ordered by level, then by sequence number
+    if payload_events():
+        return f"({level}, next(self._event_sequence), {event}, {payload})"
+    return f"({level}, next(self._event_sequence), {event})"
+
+def dequeued(entry):
+    return f"*{entry}" if payload_events() else entry
+
+def queue_event_parameters():
+    return "self, event: Event, payload=None" if payload_events() else "self, event: Event"
+
+def handler_parameters():
+    return "self, event: Event, payload" if payload_events() else "self, event: Event"
+
+def handler_arguments():
+    return "self, event, payload" if payload_events() else "self, event"
+
+def equality_test(guard):
+    # Returns the (expression, value) of a guard of the form `<expression> == <literal>`
+    condition = guard.condition.strip()
+    try:
+        compare = ast.parse(condition, mode="eval").body
+    except SyntaxError:
+        return None
+    if not (isinstance(compare, ast.Compare) and len(compare.ops) == 1 and isinstance(compare.ops[0], ast.Eq)):
+        return None
+    for expression, literal in [(compare.left, compare.comparators[0]), (compare.comparators[0], compare.left)]:
+        try:
+            value = ast.literal_eval(literal)
+        except ValueError:
+            continue
+        if isinstance(value, (str, bytes, int, float, type(None))):
+            return ast.get_source_segment(condition, expression), value
+    return None
+
+def guard_segments(transitions):
+    # Splits guarded transitions, in order of precedence, into single guards
+    # ("guard", transition) and decision tables ("table", expression, {value: transition})
+    # for runs of equality tests on the same expression. A table keeps the first
+    # transition for each value, so the first match still wins. Instrumented
+    # guards are never compiled, so that every evaluation is counted.
+    runs = []
+    for transition in transitions:
+        test = None if options.instrument else equality_test(transition.guard)
+        if test and runs and runs[-1][0] and runs[-1][0] == test[0]:
+            runs[-1][1].append((test[1], transition))
+        else:
+            runs.append((test[0] if test else None, [(test[1] if test else None, transition)]))
+    segments = []
+    for expression, branches in runs:
+        if expression is not None and len(branches) >= _decision_table_min_branches:
+            table = {}
+            for value, transition in branches:
+                table.setdefault(value, transition)
+            segments.append(("table", expression, table))
+        else:
+            segments += [("guard", transition) for _, transition in branches]
+    return segments
+
+# Decision tables of the handler being generated, as (name, [(value, branch body)])
+decision_tables = []
+decision_table_count = [0]
+
+# Expression that decision tables are looked up on, which is the class that
+# holds the handler being generated
+decision_table_owner = ["self"]
+
+def add_decision_table(values, bodies):
+    name = f"_decision_table_{decision_table_count[0]}"
+    decision_table_count[0] += 1
+    decision_tables.append((name, list(zip(values, bodies))))
+    return name
+
+def handler_shards():
+    # Source state names mapped to the keys of their handlers, for the states
+    # whose handlers are generated in a separate module by --shard-handlers
+    shards = {}
+    if options.shard_handlers:
+        for key, value in dispatched_transitions().items():
+            shards.setdefault(key[0], {})[key] = value
+    return shards
+
+def runtime_attributes():
+    if options.priority_queue and not options.threaded:
+        attributes = ["_current_state", "_event_queues"]
+    else:
+        attributes = ["_current_state", "_event_queue"]
+    if options.threaded:
+        attributes += ["_internal_events", "_worker", "_error"]
+    if options.threaded and options.priority_queue:
+        attributes += ["_event_sequence"]
+    if options.instrument:
+        attributes += ["instrumentation"]
+    if time_events():
+        attributes += ["_timing_wheel", "_timers", "_time_events"]
+    if coalesce_policies():
+        attributes += ["_pending_events"]
+    if coalesce_policies() and payload_events():
+        attributes += ["_pending_payloads"]
+    if coalesce_policies() and options.threaded:
+        attributes += ["_pending_lock", "_queueing_events"]
+    if counts_events():
+        attributes += ["event_count"]
+    if options.journal:
+        attributes += ["journal"]
+    if options.router:
+        attributes += ["_router"]
+    return attributes
+
+def init_parameters():
+    parameters = ["self"]
+    if options.instrument:
+        parameters.append("instrumentation: Optional[Instrumentation] = None")
+    if time_events():
+        parameters.append("timing_wheel: Optional[TimingWheel] = None")
+    if options.journal:
+        parameters.append("journal: Optional[Journal] = None")
+    return ", ".join(parameters)
+
+def guard_expression(guard):
+    if options.instrument:
+        return f"self.instrumentation.count_guard({guard.condition!r}) and ({guard.condition})"
+    return guard.condition
+
+def priority_levels():
+    # Completion (null) events take the highest level, so that a chain of
+    # completion transitions is finished before any other event is dispatched
+    priorities = sorted(set(event.priority or 0 for event in statemachine.events().values()), reverse=True)
+    return [None] + priorities
+
+def event_level(event):
+    return priority_levels().index(event.priority or 0)
+
+def event_values():
+    values = {_null_event_name: 0}
+    for index, event in enumerate(statemachine.events().values()):
+        values[event.name] = index + 1
+    return values
+
+def accepted_event_masks():
+    # Bit `n` of a state's mask is set if the state handles the event with value `n`
+    masks = {enum_name(vertex): 0 for vertex in statemachine.vertices().values()}
+    values = event_values()
+    for source_name, event_name in dispatched_transitions().keys():
+        masks[source_name] |= 1 << values[event_name]
+    return masks
+
+def ancestor_state_masks():
+    # Bit `n` of a vertex's mask is set if the vertex, or a state enclosing it,
+    # has the state value `n`
+    values = {vertex.id: index for index, vertex in enumerate(statemachine.vertices().values())}
+    masks = {}
+    for vertex in statemachine.vertices().values():
+        mask = 1 << values[vertex.id]
+        region = vertex.region
+        while region.state:
+            mask |= 1 << values[region.state.id]
+            region = region.state.region
+        masks[enum_name(vertex)] = mask
+    return masks
+
+def id_format(count):
+    # Narrowest unsigned struct format that holds `count` IDs
+    for format, bits in [("B", 8), ("H", 16)]:
+        if count <= 2 ** bits:
+            return format
+    return "I"
+
+def user_attributes():
+    # Attributes that diagram behaviour reads or writes on `self` need slots too
+    return sorted(dispatch.self_attributes(statemachine) - set(runtime_attributes()))
+
 def transitions_by_source_and_event():
-    transitions = {}
-    for transition in statemachine.transitions().values():
-        source_name = enum_name(transition.source)
-        event_name = _null_event_name if not transition.trigger else enum_name(transition.trigger)
-        key = (source_name, event_name)
-        if key not in transitions:
-            transitions[key] = []
-        transitions[key].append(transition)
-    return transitions
+    return dispatch.transitions_by_source_and_event(statemachine)
+
+def is_lowered_choice(vertex, choices):
+    # Decisions of a choice are inlined into the handlers of its incoming
+    # transitions, unless the choice has already been passed through
+    return isinstance(vertex, gen_statemachine.model.Choice) and vertex.id not in choices
+
+def is_sub_region_terminal_state(vertex):
+    # Reaching the terminal state of a sub region completes the enclosing state
+    return isinstance(vertex, gen_statemachine.model.TerminalState) and vertex.region.state is not None
+
+def dispatched_transitions():
+    return dispatch.dispatched_transitions(statemachine)
 
 def vertex_outgoing_transitions_by_event(vertex):
     transitions = {}
@@ -110,9 +334,18 @@ ${indent_str}self._exit_state(State.${enum_name(exited_state)})
 ${indent_str}self._enter_state(State.${enum_name(entered_state)})
 % endfor
 </%def>\
+<%def name="action_block(action, indent_str)">\
+% if options.instrument:
+${indent_str}_action_started = perf_counter_ns()
+${indent_str}${action.text}
+${indent_str}self.instrumentation.record_action(${repr(action.text)}, perf_counter_ns() - _action_started)
+% else:
+${indent_str}${action.text}
+% endif
+</%def>\
 <%def name="transition_action(transition, indent_str)">\
 % if transition.action:
-${indent_str}${transition.action.text}
+${action_block(transition.action, indent_str)}\
 % endif
 </%def>\
 <%def name="enter_substates(vertex, indent_str)">\
@@ -121,19 +354,254 @@ ${indent_str}self._enter_state(State.${enum_name(vertex.sub_regions[0].initial_s
 ${enter_substates(vertex.sub_regions[0].initial_state, indent_str)}\
 % endif
 </%def>\
-<%def name="transition_block(transition, indent_lvl)">\
-<% indent_str = _indent * indent_lvl %>\
+<%def name="transition_block(transition, indent_str, inherited_exits=())">\
+% for exited_state in inherited_exits:
+${indent_str}self._exit_state(State.${enum_name(exited_state)})
+% endfor
 ${indent_str}self._exit_state(State.${enum_name(transition.source)})
+${transition_path(transition, indent_str, [transition.source.id])}\
+</%def>\
+<%def name="transition_path(transition, indent_str, choices)">\
+<% target = transition.target %>\
 ${exit_superstates(transition, indent_str)}\
 ${transition_action(transition, indent_str)}\
 ${enter_superstates(transition, indent_str)}\
-${indent_str}self._enter_state(State.${enum_name(transition.target)})
-${enter_substates(transition.target, indent_str)}\
+% if is_lowered_choice(target, choices):
+${choice_block(target, indent_str, choices + [target.id])}\
+% elif is_sub_region_terminal_state(target):
+${indent_str}self._current_state = State.${enum_name(target.region.state)}
+% else:
+${indent_str}self._enter_state(State.${enum_name(target)})
+${enter_substates(target, indent_str)}\
+% endif
+</%def>\
+<%def name="choice_block(choice, indent_str, choices)">\
+<% guarded = [t for t in choice.outgoing_transitions if t.guard] %>\
+<% unguarded = [t for t in choice.outgoing_transitions if not t.guard] %>\
+${guard_chain(guarded, indent_str, lambda transition, indent_str: capture(transition_path, transition, indent_str, choices))}\
+% if guarded:
+${indent_str}else:
+<% indent_str += _indent %>\
+% endif
+% if unguarded:
+${transition_path(unguarded[0], indent_str, choices)}\
+% else:
+${indent_str}self._enter_state(State.${enum_name(choice)})
+% endif
+</%def>\
+<%def name="guard_chain(transitions, indent_str, transition_body)">\
+% for segment in guard_segments(transitions):
+<% keyword = "if" if loop.first else "elif" %>\
+% if segment[0] == "table":
+<% table_name = add_decision_table(segment[2].keys(), [transition_body(transition, _indent * 2) for transition in segment[2].values()]) %>\
+${indent_str}${keyword} (branch := _decide(${decision_table_owner[0]}.${table_name}, ${segment[1]})) is not None:
+${indent_str}${_indent}branch(${handler_arguments()})
+% else:
+${indent_str}${keyword} ${guard_expression(segment[1].guard)}:
+${transition_body(segment[1], indent_str + _indent)}\
+% endif
+% endfor
+</%def>\
+<%def name="decision_table_block()">\
+% for table_name, branches in decision_tables:
+% for value, branch_body in branches:
+    def ${table_name}_${loop.index}(${handler_parameters()}):
+${branch_body}\
+
+% endfor
+    ${table_name} = MappingProxyType({
+        % for value, branch_body in branches:
+        ${repr(value)}: ${table_name}_${loop.index},
+        % endfor
+    })
+
+% endfor
+<% decision_tables.clear() %>\
+</%def>\
+<%def name="event_handler(source_name, event_name, transitions, inherited_exits)">\
+<% transitions_with_guards = [t for t in transitions if t.guard] %>\
+<% transitions_without_guards = [t for t in transitions if not t.guard] %>\
+    def _process_${event_name}_in_${source_name}(${handler_parameters()}):
+${guard_chain(transitions_with_guards, _indent * 2, lambda transition, indent_str: capture(transition_block, transition, indent_str, inherited_exits))}\
+        % for transition in transitions_without_guards[:1]:
+        % if transitions_with_guards:
+        else:
+${transition_block(transition, _indent * 3, inherited_exits)}\
+        % else:
+${transition_block(transition, _indent * 2, inherited_exits)}\
+        % endif
+        % endfor
+
+${decision_table_block()}\
+</%def>\
+<%def name="handler_shard(source_name, handlers)">\
+"""
+Event handlers of the ${source_name} state, which statemachine.py loads on the
+first dispatch of an event in ${source_name}. The handlers run with the globals
+of statemachine.py.
+"""
+
+class _Handlers:
+% for (_, event_name), (transitions, inherited_exits) in handlers.items():
+${event_handler(source_name, event_name, transitions, inherited_exits)}\
+% endfor
+EVENT_HANDLERS = {
+    % for _, event_name in handlers.keys():
+    Event.${event_name}: _Handlers._process_${event_name}_in_${source_name},
+    % endfor
+}
+</%def>\
+<%
+def render_handler_shards():
+    decision_table_owner[0] = "_Handlers"
+    for source_name, handlers in handler_shards().items():
+        fan_out_files[source_name] = capture(handler_shard, source_name, handlers)
+    decision_table_owner[0] = "self"
+%>\
+<%def name="merge_pending_event(indent_str)">\
+${indent_str}if event in self._pending_events:
+% if options.threaded:
+${indent_str}    if event in self._queueing_events:
+${indent_str}        self._queueing_events[event] = True
+% endif
+% if counts_events():
+${indent_str}    if _COALESCE_POLICIES[event] == "count":
+${indent_str}        self._pending_events[event] += 1
+% endif
+% if payload_events():
+${indent_str}    if _COALESCE_POLICIES[event] != "drop":
+${indent_str}        payload, self._pending_payloads[event] = self._pending_payloads[event], payload
+% if options.payload_pool:
+${indent_str}    if payload is not None:
+${indent_str}        payload.release()
+% endif
+% endif
+${indent_str}    return False
+${indent_str}self._pending_events[event] = 1
+% if payload_events():
+${indent_str}self._pending_payloads[event] = payload
+% endif
+% if options.threaded:
+${indent_str}if threading.current_thread() is not self._worker:
+${indent_str}    # Merges are tracked until the producer has queued this occurrence
+${indent_str}    self._queueing_events[event] = False
+% endif
+${indent_str}return True
+</%def>\
+<%def name="dispatch_unless_wake(event, arguments)">\
+% if wakes_worker():
+            if ${event} is not _WAKE:
+                self._process_event(${arguments})
+% else:
+            self._process_event(${arguments})
+% endif
+</%def>\
+<%def name="coalesce_queued_event()">\
+% if coalesce_policies() and payload_events():
+        if event in _COALESCE_POLICIES:
+            # The payload of a coalesced event is held by the pending event
+            # index, where it may be replaced by later occurrences
+            if not self._add_pending_event(event, payload):
+                return
+            payload = None
+% elif coalesce_policies():
+        if event in _COALESCE_POLICIES and not self._add_pending_event(event):
+            return
+% endif
 </%def>\
 <% preprocess_model() %>\
+% if options.instrument:
+from collections import Counter, defaultdict, deque
+from time import perf_counter_ns
+% else:
+from collections import Counter, deque
+% endif
+% if options.int_constants:
+from enum import IntEnum
+% else:
 from enum import Enum
-from queue import SimpleQueue
+% endif
+from types import MappingProxyType
+% if options.shard_handlers:
+import importlib.util
+from pathlib import Path
+% endif
+% if options.threaded:
+% if options.priority_queue:
+from itertools import count
+from queue import PriorityQueue
+% else:
+from queue import Queue
+% endif
+% if coalesce_policies() or time_events():
+from queue import Full
+% endif
+import threading
+% else:
+import struct
+from time import monotonic
+% endif
+from typing import Iterable, List, Mapping, Optional
+% if time_events():
+from functools import partial
+from timing_wheel import TimingWheel, shared_timing_wheel
+% endif
+% if options.journal:
+from journal import Journal, JournalError, read_journal
+% endif
+
+% if options.int_constants:
+class State:
+    """Values of the states, as plain ints. `StateEnum` is an Enum view of them."""
+    % for vertex in statemachine.vertices().values():
+    ${enum_name(vertex)} = ${loop.index}
+    % endfor
+
+class Event:
+    """Values of the events, as plain ints. `EventEnum` is an Enum view of them."""
+    ${_null_event_name} = 0
+    % for event in statemachine.events().values():
+    ${event.name} = ${loop.index + 1}
+    % endfor
+
+_STATE_NAMES = (
+    % for vertex in statemachine.vertices().values():
+    "${enum_name(vertex)}",
+    % endfor
+)
+_EVENT_NAMES = (
+    "${_null_event_name}",
+    % for event in statemachine.events().values():
+    "${event.name}",
+    % endfor
+)
+
+def __getattr__(name: str):
+    # The Enum views are only built on first use, as creating an Enum with
+    # many members is slow
+    if name == "StateEnum":
+        view = IntEnum("State", [(state_name, value) for value, state_name in enumerate(_STATE_NAMES)], module=__name__)
+    elif name == "EventEnum":
+        view = IntEnum("Event", [(event_name, value) for value, event_name in enumerate(_EVENT_NAMES)], module=__name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = view
+    return view
 
+# Events handled in each state, with bit `n` set for the event with value `n`
+_ACCEPTED_EVENTS = (
+    % for mask in accepted_event_masks().values():
+    ${mask_literal(mask)},
+    % endfor
+)
+
+# Each state and the states that enclose it, with bit `n` set for the state with value `n`
+_ANCESTOR_STATES = (
+    % for mask in ancestor_state_masks().values():
+    ${mask_literal(mask)},
+    % endfor
+)
+% else:
 class State(Enum):
     % for vertex in statemachine.vertices().values():
     ${enum_name(vertex)} = ${loop.index}
@@ -145,41 +613,801 @@ class Event(Enum):
     ${event.name} = ${loop.index + 1}
     % endfor
 
-class StateMachine:
+# Events handled in each state, with bit `n` set for the event with value `n`
+_ACCEPTED_EVENTS = MappingProxyType({
+    % for state_name, mask in accepted_event_masks().items():
+    State.${state_name}: ${mask_literal(mask)},
+    % endfor
+})
+
+# Each state and the states that enclose it, with bit `n` set for the state with value `n`
+_ANCESTOR_STATES = MappingProxyType({
+    % for state_name, mask in ancestor_state_masks().items():
+    State.${state_name}: ${mask_literal(mask)},
+    % endfor
+})
+% endif
+% if options.shard_handlers:
+
+# Directory of the modules that hold each state's event handlers (see files.toml)
+_HANDLER_SHARDS_DIR = Path(__file__).parent / "${_handler_shards_dir}"
+# States that have a handler shard module
+_HANDLER_SHARDS = frozenset({
+    % for source_name in handler_shards():
+    State.${source_name},
+    % endfor
+})
+
+class _LazyEventHandlers(dict):
+    """
+    Maps (state, event) to handler functions, loading the handlers of a state
+    from its shard module on the first lookup in that state. Events that a
+    state does not handle are mapped to None once looked up.
+    """
+
     def __init__(self):
-        self._current_state = State._initial_state
-        self._event_queue = SimpleQueue()
-        self._event_handlers = {}
-        % for source_name, event_name in transitions_by_source_and_event().keys():
-        self._event_handlers[(State.${source_name}, Event.${event_name})] = self._process_${event_name}_in_${source_name}
+        super().__init__()
+        self._loaded_states = set()
+
+    def __missing__(self, key):
+        state = key[0]
+        if state in _HANDLER_SHARDS and state not in self._loaded_states:
+            self._load_shard(state)
+            self._loaded_states.add(state)
+            if key in self:
+                return self[key]
+        self[key] = None
+        return None
+
+    def _load_shard(self, state: State):
+        % if options.int_constants:
+        state_name = _STATE_NAMES[state]
+        % else:
+        state_name = state.name
+        % endif
+        path = _HANDLER_SHARDS_DIR / f"{state_name}.py"
+        spec = importlib.util.spec_from_file_location(f"{__name__}_handlers_{state_name}", path)
+        shard = importlib.util.module_from_spec(spec)
+        # Handlers run with the globals of this module, as if they were defined in it
+        shard.__dict__.update({name: value for name, value in globals().items() if not name.startswith("__")})
+        spec.loader.exec_module(shard)
+        for event, handler in shard.EVENT_HANDLERS.items():
+            self[(state, event)] = handler
+% endif
+
+% if options.payload_pool and payload_events():
+# Maximum number of free payload objects kept by each payload class
+_PAYLOAD_POOL_SIZE = ${options.queue_size}
+
+% endif
+% for event in payload_events():
+class ${payload_class(event)}:
+    """Data carried by an occurrence of `Event.${event.name}`"""
+
+    __slots__ = (
+        % for parameter in event.parameters:
+        "${parameter.name}",
+        % endfor
+    )
+    % if options.payload_pool:
+    _pool: List["${payload_class(event)}"] = []
+    % endif
+
+    def __init__(self, ${parameter_list(event)}):
+        % for parameter in event.parameters:
+        self.${parameter.name} = ${parameter.name}
         % endfor
-        % for terminal_state in terminal_states_in_sub_regions():
-        self._event_handlers[(State.${enum_name(terminal_state)}, Event.${_null_event_name})] = self._process_${_null_event_name}_in_${enum_name(terminal_state)}
+    % if options.payload_pool:
+
+    @classmethod
+    def acquire(cls, ${parameter_list(event)}) -> "${payload_class(event)}":
+        """Returns a free payload from the pool, or a new payload if the pool is empty"""
+        try:
+            payload = cls._pool.pop()
+        except IndexError:
+            return cls(${", ".join(parameter.name for parameter in event.parameters)})
+        % for parameter in event.parameters:
+        payload.${parameter.name} = ${parameter.name}
+        % endfor
+        return payload
+
+    def release(self):
+        """Returns the payload to the pool, after which it must no longer be used"""
+        if len(self._pool) < _PAYLOAD_POOL_SIZE:
+            self._pool.append(self)
+    % endif
+
+% endfor
+% if options.instrument:
+class Instrumentation:
+    """
+    Counters and action timings collected by a statemachine. A single instance
+    may be shared by many statemachines to aggregate their measurements.
+    """
+
+    __slots__ = ("transitions", "guard_evaluations", "action_calls", "action_time_ns", "action_latency")
+
+    def __init__(self):
+        # Number of handled events, keyed by (state, event)
+        self.transitions = Counter()
+        # Number of guard evaluations, keyed by guard condition
+        self.guard_evaluations = Counter()
+        # Action calls, total time and a latency histogram, keyed by action text.
+        # Histogram bucket `b` counts calls that took [2 ** (b - 1), 2 ** b) ns
+        self.action_calls = Counter()
+        self.action_time_ns = Counter()
+        self.action_latency = defaultdict(Counter)
+
+    def count_guard(self, guard: str) -> bool:
+        self.guard_evaluations[guard] += 1
+        return True
+
+    def record_action(self, action: str, elapsed_ns: int):
+        self.action_calls[action] += 1
+        self.action_time_ns[action] += elapsed_ns
+        self.action_latency[action][elapsed_ns.bit_length()] += 1
+
+% endif
+% if options.priority_queue:
+# Priority level of each event, where level 0 is dispatched first
+_EVENT_LEVELS = MappingProxyType({
+    Event.${_null_event_name}: 0,
+    % for event in statemachine.events().values():
+    Event.${event.name}: ${event_level(event)},
+    % endfor
+})
+% if options.threaded:
+# Stop requests are queued below all events
+_STOP_LEVEL = ${len(priority_levels())}
+% endif
+
+% endif
+% if wakes_worker():
+# Queued to wake the worker in place of an event, when an event is handed to
+# it outside of the queue
+_WAKE = object()
+
+% endif
+% if coalesce_policies():
+# Coalesce policy of each event that is queued at most once at a time
+_COALESCE_POLICIES = MappingProxyType({
+    % for event_name, policy in coalesce_policies().items():
+    Event.${event_name}: "${policy.value}",
+    % endfor
+})
+
+% endif
+% if options.journal:
+# Journal records are a state ID, an event ID and a monotonic timestamp in ns
+_JOURNAL_FORMAT = "<${id_format(len(statemachine.vertices()))}${id_format(len(statemachine.events()) + 1)}q"
+
+% endif
+% if options.int_constants:
+_STATES = range(${len(statemachine.vertices())})
+_EVENTS = range(${len(statemachine.events()) + 1})
+
+% elif not options.threaded or options.journal:
+_STATES = tuple(State)
+_EVENTS = tuple(Event)
+
+% endif
+% if not options.threaded:
+# Snapshots are a fixed width state ID and event count, followed by the pending event IDs
+_SNAPSHOT_HEADER = struct.Struct("<${id_format(len(statemachine.vertices()))}I")
+_SNAPSHOT_EVENT_FORMAT = "${id_format(len(statemachine.events()) + 1)}"
+_SNAPSHOT_EVENT_SIZE = struct.calcsize(_SNAPSHOT_EVENT_FORMAT)
+_SNAPSHOT_COUNT = struct.Struct("<I")
+
+% endif
+class StateMachine:
+    __slots__ = (
+        % for attribute in runtime_attributes() + user_attributes():
+        "${attribute}",
         % endfor
+    )
 
+    def __init__(${init_parameters()}):
+        self._current_state = State._initial_state
+        % if options.instrument:
+        self.instrumentation = instrumentation or Instrumentation()
+        % endif
+        % if time_events():
+        self._timing_wheel = timing_wheel if timing_wheel is not None else shared_timing_wheel()
+        # Pending timers of time events, keyed by the state that started them
+        self._timers = {}
+        # Time events whose timers have expired, as (event, state, timers)
+        self._time_events = deque()
+        % endif
+        % if coalesce_policies():
+        # Number of occurrences merged into each pending coalesced event
+        self._pending_events = {}
+        % endif
+        % if coalesce_policies() and payload_events():
+        # Payloads of pending coalesced events
+        self._pending_payloads = {}
+        % endif
+        % if coalesce_policies() and options.threaded:
+        self._pending_lock = threading.Lock()
+        # Whether occurrences have been merged into each coalesced event that
+        # a producer is queueing
+        self._queueing_events = {}
+        % endif
+        % if counts_events():
+        # Number of occurrences of the event being processed
+        self.event_count = 1
+        % endif
+        % if options.journal:
+        self.journal = journal
+        % endif
+        % if options.router:
+        self._router = None
+        % endif
+        % if options.threaded:
+        % if options.priority_queue:
+        # Entries are (level, sequence number, event), so that events on
+        # the same level are dispatched in the order they were queued
+        self._event_queue = PriorityQueue(maxsize=${options.queue_size})
+        self._event_sequence = count()
+        % else:
+        self._event_queue = Queue(maxsize=${options.queue_size})
+        % endif
+        self._internal_events = deque()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        # Exception raised by an action or guard, which stopped the worker
+        self._error = None
+        % elif options.priority_queue:
+        # One FIFO queue per priority level, highest priority first
+        self._event_queues = tuple(deque() for _ in range(${len(priority_levels())}))
+        % else:
+        self._event_queue = deque()
+        % endif
+
+% if options.threaded:
+    def start(self):
+        % if options.priority_queue:
+        self._event_queue.put(${priority_entry(0, "Event." + _null_event_name, "None")})
+        % else:
+        self._event_queue.put(${queue_entry("Event." + _null_event_name, "None")})
+        % endif
+        self._worker.start()
+
+    def stop(self):
+        """
+        Requests the worker to stop once the events queued before the request
+        have been processed. Raises the exception that stopped the worker, if
+        an action or guard has raised one.
+        """
+        % if options.priority_queue:
+        self._event_queue.put(${priority_entry("_STOP_LEVEL", "None", "None")})
+        % else:
+        self._event_queue.put(None)
+        % endif
+        if self._error is not None:
+            raise self._error
+
+    def join(self, timeout: Optional[float] = None):
+        """Waits for the worker to stop, and raises the exception that stopped it, if any"""
+        self._worker.join(timeout)
+        if self._error is not None:
+            raise self._error
+
+    def queue_event(${queue_event_parameters()}, block: bool = True, timeout: Optional[float] = None):
+        if self._error is not None:
+            raise self._error
+${coalesce_queued_event()}\
+        # Events raised by the worker itself (i.e. from actions) bypass the
+        # bounded queue, otherwise the worker could block on its own queue
+        if threading.current_thread() is self._worker:
+            self._internal_events.append(${queue_entry("event")})
+        % if coalesce_policies():
+        else:
+            try:
+                % if options.priority_queue:
+                self._event_queue.put(${priority_entry("_EVENT_LEVELS[event]", "event")}, block, timeout)
+                % else:
+                self._event_queue.put(${queue_entry("event")}, block, timeout)
+                % endif
+            except Full:
+                if event not in _COALESCE_POLICIES or not self._abandon_pending_event(event):
+                    raise
+                # Occurrences were merged into this one while it was being
+                # queued, so it must still be dispatched and bypasses the queue
+                self._internal_events.append(${queue_entry("event")})
+                self._wake_worker()
+        % else:
+        else:
+            % if options.priority_queue:
+            self._event_queue.put(${priority_entry("_EVENT_LEVELS[event]", "event")}, block, timeout)
+            % else:
+            self._event_queue.put(${queue_entry("event")}, block, timeout)
+            % endif
+        % endif
+
+    def _run(self):
+        try:
+            self._dispatch_events()
+        except Exception as error:
+            self._error = error
+            # Producers must not block on a queue that is no longer processed,
+            # so later events are discarded until the stop request
+            % if options.priority_queue:
+            while self._event_queue.get()[2] is not None:
+                pass
+            % else:
+            while self._event_queue.get() is not None:
+                pass
+            % endif
+
+    def _dispatch_events(self):
+        % if options.priority_queue and payload_events():
+        while (entry := self._event_queue.get())[2] is not None:
+${dispatch_unless_wake("entry[2]", "*entry[2:]")}\
+        % elif options.priority_queue:
+        while (event := self._event_queue.get()[2]) is not None:
+${dispatch_unless_wake("event", "event")}\
+        % elif payload_events():
+        while (entry := self._event_queue.get()) is not None:
+${dispatch_unless_wake("entry[0]", "*entry")}\
+        % else:
+        while (event := self._event_queue.get()) is not None:
+${dispatch_unless_wake("event", "event")}\
+        % endif
+            while self._internal_events:
+                self._process_event(${dequeued("self._internal_events.popleft()")})
+            % if time_events():
+            while self._time_events:
+                self._process_time_event(*self._time_events.popleft())
+                while self._internal_events:
+                    self._process_event(${dequeued("self._internal_events.popleft()")})
+            % endif
+% if wakes_worker():
+
+    def _wake_worker(self):
+        try:
+            % if options.priority_queue:
+            self._event_queue.put_nowait(${priority_entry(0, "_WAKE", "None")})
+            % else:
+            self._event_queue.put_nowait(${queue_entry("_WAKE", "None")})
+            % endif
+        except Full:
+            # The worker processes the events handed to it after each queued event
+            pass
+% endif
+% else:
     def start(self):
         self.queue_event(Event.${_null_event_name})
         self.process_events()
 
-    def queue_event(self, event: Event):
-        self._event_queue.put(event)
+    def queue_event(${queue_event_parameters()}):
+${coalesce_queued_event()}\
+        % if options.priority_queue:
+        self._event_queues[_EVENT_LEVELS[event]].append(${queue_entry("event")})
+        % else:
+        self._event_queue.append(${queue_entry("event")})
+        % endif
+
+    def process_events(self, max_events: Optional[int] = None, deadline: Optional[float] = None) -> int:
+        """
+        Processes pending events, including those queued while processing,
+        until none remain, `max_events` events have been processed or the
+        `time.monotonic()` clock has reached `deadline`. Returns the number of
+        events that remain pending.
+        """
+        processed = 0
+        % if options.priority_queue:
+        while processed != max_events and (deadline is None or monotonic() < deadline):
+            for queue in self._event_queues:
+                if queue:
+                    self._process_event(${dequeued("queue.popleft()")})
+                    break
+            else:
+                % if time_events():
+                if not self._time_events:
+                    return 0
+                self._process_time_event(*self._time_events.popleft())
+                % else:
+                return 0
+                % endif
+            processed += 1
+        % if time_events():
+        return sum(len(queue) for queue in self._event_queues) + len(self._time_events)
+        % else:
+        return sum(len(queue) for queue in self._event_queues)
+        % endif
+        % elif time_events():
+        # Expired time events are dispatched once no queued events remain
+        while (self._event_queue or self._time_events) and processed != max_events and (deadline is None or monotonic() < deadline):
+            if self._event_queue:
+                self._process_event(${dequeued("self._event_queue.popleft()")})
+            else:
+                self._process_time_event(*self._time_events.popleft())
+            processed += 1
+        return len(self._event_queue) + len(self._time_events)
+        % else:
+        if max_events is None and deadline is None:
+            while self._event_queue:
+                self._process_event(${dequeued("self._event_queue.popleft()")})
+            return 0
+        while self._event_queue and processed != max_events and (deadline is None or monotonic() < deadline):
+            self._process_event(${dequeued("self._event_queue.popleft()")})
+            processed += 1
+        return len(self._event_queue)
+        % endif
+
+    def snapshot(self) -> bytes:
+        """
+        Returns the ID of the current state followed by the IDs of the pending
+        events. Attributes set by the diagram's behaviour are not included.
+        """
+        buffer = bytearray()
+        self._write_snapshot(buffer)
+        return bytes(buffer)
+
+    def restore(self, snapshot: bytes):
+        """Replaces the current state and pending events with those from `snapshot`"""
+        self._read_snapshot(snapshot, 0)
+        % if options.router:
+        if self._router is not None:
+            self._router._update(self)
+        % endif
+
+    def _write_snapshot(self, buffer: bytearray):
+        % if options.priority_queue:
+        # Events are written in dispatch order
+        events = [entry for queue in self._event_queues for entry in queue]
+        % else:
+        events = self._event_queue
+        % endif
+        % if payload_events():
+        if any(payload is not None for _, payload in events)${" or any(payload is not None for payload in self._pending_payloads.values())" if coalesce_policies() else ""}:
+            raise ValueError("Pending events with payloads cannot be included in a snapshot")
+        events = [event for event, _ in events]
+        % endif
+        % if counts_events():
+        # Merged occurrences are written out, and merged again on restore
+        events = [event for event in events for _ in range(self._pending_events.get(event, 1))]
+        % endif
+        event_count = len(events)
+        buffer += _SNAPSHOT_HEADER.pack(${value_of("self._current_state")}, event_count)
+        if event_count:
+            buffer += struct.pack(f"<{event_count}{_SNAPSHOT_EVENT_FORMAT}", *[${value_of("event")} for event in events])
+
+    def _read_snapshot(self, buffer: bytes, offset: int) -> int:
+        """Restores from the snapshot at `offset` and returns the offset following it"""
+        state, event_count = _SNAPSHOT_HEADER.unpack_from(buffer, offset)
+        offset += _SNAPSHOT_HEADER.size
+        self._current_state = _STATES[state]
+        % if options.priority_queue:
+        for queue in self._event_queues:
+            queue.clear()
+        % else:
+        self._event_queue = deque()
+        % endif
+        % if coalesce_policies():
+        self._pending_events.clear()
+        % endif
+        % if coalesce_policies() and payload_events():
+        self._pending_payloads.clear()
+        % endif
+        % if time_events():
+        # Timers started before the restore may belong to states that are no
+        # longer active, so those of the restored state and the states that
+        # enclose it are started again
+        self._cancel_timers()
+        % for state in states_with_time_events():
+        if self.is_in(State.${enum_name(state)}):
+            self._start_timers(State.${enum_name(state)})
+        % endfor
+        % endif
+        if event_count:
+            events = struct.unpack_from(f"<{event_count}{_SNAPSHOT_EVENT_FORMAT}", buffer, offset)
+            % if options.priority_queue or coalesce_policies():
+            for event in events:
+                self.queue_event(_EVENTS[event])
+            % else:
+            self._event_queue.extend([${queue_entry("_EVENTS[event]", "None")} for event in events])
+            % endif
+            offset += event_count * _SNAPSHOT_EVENT_SIZE
+        return offset
+% endif
+% if options.journal:
+
+    def _replay_event(self, event: Event):
+        """
+        Dispatches an event read from a journal. The journal holds every
+        dispatched event, so events queued by earlier events are discarded.
+        """
+        % if options.threaded:
+        # Replay runs in place of the worker, so events queued by actions are internal
+        self._internal_events.clear()
+        % elif options.priority_queue:
+        for queue in self._event_queues:
+            queue.clear()
+        % else:
+        self._event_queue.clear()
+        % endif
+        % if coalesce_policies():
+        self._pending_events.clear()
+        if event in _COALESCE_POLICIES:
+            self._pending_events[event] = 1
+        % endif
+        self._process_event(event)
+% endif
+
+    def can_handle(self, event: Event) -> bool:
+        """Returns `True` if the current state handles `event`"""
+        return bool(_ACCEPTED_EVENTS[self._current_state] >> ${value_of("event")} & 1)
+
+    def is_in(self, state: State) -> bool:
+        """Returns `True` if the current state is `state` or is nested within `state`"""
+        return bool(_ANCESTOR_STATES[self._current_state] >> ${value_of("state")} & 1)
+
+    @classmethod
+    def _state_counts(cls, machines: Iterable["StateMachine"]) -> Counter:
+        """Returns the number of `machines` in each state (see hot_reload.py)"""
+        return Counter(machine._current_state for machine in machines)
 
-    def process_events(self):
-        while not self._event_queue.empty():
-            self._process_event(self._event_queue.get())
+% if options.threaded:
+    # Threaded statemachines cannot be migrated, as their state is owned by a
+    # worker thread (see hot_reload.py)
+    _MIGRATABLE = False
 
-    def _process_event(self, event: Event):
+% else:
+    _MIGRATABLE = True
+
+    def _pending_entries(self) -> List[tuple]:
+        """Returns the pending (event, payload, count) entries in dispatch order"""
+        % if options.priority_queue:
+        entries = [entry for queue in self._event_queues for entry in queue]
+        % else:
+        entries = list(self._event_queue)
+        % endif
+        % if not payload_events():
+        entries = [(event, None) for event in entries]
+        % endif
+        % if coalesce_policies() and payload_events():
+        entries = [
+            (event, self._pending_payloads[event] if event in _COALESCE_POLICIES else payload)
+            for event, payload in entries
+        ]
+        % endif
+        % if coalesce_policies():
+        return [(event, payload, self._pending_events.get(event, 1)) for event, payload in entries]
+        % else:
+        return [(event, payload, 1) for event, payload in entries]
+        % endif
+
+    @classmethod
+    def _migrate(cls, machine, states: Mapping, events: Mapping):
+        """
+        Migrates `machine`, an instance of an earlier generation of this class,
+        by mapping its state and events with `states` and `events`. Returns
+        the migrated instance and the pending events that were dropped.
+        """
+        entries = machine._pending_entries()
+        timers = getattr(machine, "_timers", {})
+        if type(machine).__slots__ == cls.__slots__:
+            machine.__class__ = cls
+            migrated = machine
+        else:
+            migrated = object.__new__(cls)
+            for name in set(cls.__slots__) & set(type(machine).__slots__):
+                if hasattr(machine, name):
+                    setattr(migrated, name, getattr(machine, name))
+        migrated._current_state = states[machine._current_state]
+        % if options.instrument:
+        if not hasattr(migrated, "instrumentation"):
+            migrated.instrumentation = Instrumentation()
+        % endif
+        % if options.journal:
+        if not hasattr(migrated, "journal"):
+            migrated.journal = None
+        % endif
+        % if counts_events():
+        if not hasattr(migrated, "event_count"):
+            migrated.event_count = 1
+        % endif
+        % if options.router:
+        # Routers index the earlier states, so instances are added to a new router
+        migrated._router = None
+        % endif
+        % if options.priority_queue:
+        migrated._event_queues = tuple(deque() for _ in range(${len(priority_levels())}))
+        % else:
+        migrated._event_queue = deque()
+        % endif
+        % if coalesce_policies():
+        migrated._pending_events = {}
+        % endif
+        % if coalesce_policies() and payload_events():
+        migrated._pending_payloads = {}
+        % endif
+        dropped = []
+        for event, payload, count in entries:
+            if event not in events:
+                dropped += [event] * count
+                continue
+            % if payload_events():
+            migrated.queue_event(events[event], payload)
+            % else:
+            migrated.queue_event(events[event])
+            % endif
+            % if counts_events():
+            if count > 1 and _COALESCE_POLICIES.get(events[event]) == "count":
+                migrated._pending_events[events[event]] = count
+            % endif
+        % if time_events():
+        # Running timers are moved to the new states and events, keeping their
+        # expiry, as are the events of expired timers whose state is active
+        if not hasattr(migrated, "_timing_wheel"):
+            migrated._timing_wheel = shared_timing_wheel()
+        migrated._timers = {}
+        for state, state_timers in timers.items():
+            if state not in states:
+                for timer in state_timers:
+                    timer.cancel()
+                continue
+            migrated._timers[states[state]] = migrated_timers = []
+            for timer in state_timers:
+                timer.cancel()
+                event = timer.callback.args[0]
+                if event in events:
+                    migrated_timers.append(
+                        migrated._timing_wheel.schedule(
+                            migrated._timing_wheel.remaining(timer),
+                            partial(migrated._expire_time_event, events[event], states[state], migrated_timers),
+                        )
+                    )
+        expired = getattr(machine, "_time_events", ())
+        migrated._time_events = deque()
+        for event, state, state_timers in expired:
+            if timers.get(state) is state_timers and state in states and event in events:
+                migrated._time_events.append((events[event], states[state], migrated._timers[states[state]]))
+        % else:
+        for state_timers in timers.values():
+            for timer in state_timers:
+                timer.cancel()
+        % endif
+        return migrated, dropped
+
+% endif
+% if coalesce_policies():
+    def _add_pending_event(self, event: Event${", payload" if payload_events() else ""}) -> bool:
+        """
+        Records an occurrence of a coalesced event. Returns False if the
+        occurrence was merged into one that is already pending.
+        """
+        % if options.threaded:
+        with self._pending_lock:
+${merge_pending_event(_indent * 3)}\
+        % else:
+${merge_pending_event(_indent * 2)}\
+        % endif
+
+    % if options.threaded:
+    def _abandon_pending_event(self, event: Event) -> bool:
+        """
+        Removes an occurrence of a coalesced event that its producer failed to
+        queue. Returns True, and keeps the occurrence pending, if others were
+        merged into it in the meantime, as they must still be dispatched.
+        """
+        with self._pending_lock:
+            if self._queueing_events.pop(event):
+                return True
+            del self._pending_events[event]
+            % if payload_events():
+            del self._pending_payloads[event]
+            % endif
+            return False
+
+    % endif
+    % if payload_events():
+    def _take_pending_event(self, event: Event):
+        """Removes a coalesced event that is being dispatched, returning its number of occurrences and payload"""
+        % if options.threaded:
+        with self._pending_lock:
+            self._queueing_events.pop(event, None)
+            return self._pending_events.pop(event), self._pending_payloads.pop(event)
+        % else:
+        return self._pending_events.pop(event), self._pending_payloads.pop(event)
+        % endif
+    % else:
+    def _take_pending_event(self, event: Event) -> int:
+        """Removes a coalesced event that is being dispatched, returning its number of occurrences"""
+        % if options.threaded:
+        with self._pending_lock:
+            self._queueing_events.pop(event, None)
+            return self._pending_events.pop(event)
+        % else:
+        return self._pending_events.pop(event)
+        % endif
+    % endif
+
+% endif
+% if time_events():
+    def _expire_time_event(self, event: Event, state: State, timers: list):
+        """
+        Called from the timing wheel's thread when a timer started on entry
+        to `state` expires. The event is handed to the thread that processes
+        events without blocking or touching the pending event index, so that
+        a full queue cannot hold up the timers of other statemachines.
+        """
+        self._time_events.append((event, state, timers))
+        % if options.threaded:
+        self._wake_worker()
+        % endif
+
+    def _process_time_event(self, event: Event, state: State, timers: list):
+        # The state has been exited since its timers were started, and the
+        # timer expired before it could be cancelled
+        if self._timers.get(state) is not timers:
+            return
+        % if coalesce_policies() and payload_events():
+        if event in _COALESCE_POLICIES and not self._add_pending_event(event, None):
+            return
+        % elif coalesce_policies():
+        if event in _COALESCE_POLICIES and not self._add_pending_event(event):
+            return
+        % endif
+        self._process_event(event)
+
+% endif
+    def _process_event(${queue_event_parameters()}):
+        % if options.journal:
+        if self.journal is not None:
+            self.journal.append(${value_of("self._current_state")}, ${value_of("event")})
+        % endif
+        % if counts_events() and payload_events():
+        if event in _COALESCE_POLICIES:
+            self.event_count, payload = self._take_pending_event(event)
+        else:
+            self.event_count = 1
+        % elif coalesce_policies() and payload_events():
+        if event in _COALESCE_POLICIES:
+            _, payload = self._take_pending_event(event)
+        % elif counts_events():
+        self.event_count = self._take_pending_event(event) if event in _COALESCE_POLICIES else 1
+        % elif coalesce_policies():
+        if event in _COALESCE_POLICIES:
+            self._take_pending_event(event)
+        % endif
+        % if options.shard_handlers:
+        if handler := self._event_handlers[(self._current_state, event)]:
+        % else:
         if handler := self._event_handlers.get((self._current_state, event), None):
-            handler(event)
+        % endif
+            % if options.instrument:
+            self.instrumentation.transitions[(self._current_state, event)] += 1
+            % endif
+            % if options.router:
+            state = self._current_state
+            % endif
+            % if payload_events():
+            handler(self, event, payload)
+            % else:
+            handler(self, event)
+            % endif
+            % if options.router:
+            if self._current_state is not state and self._router is not None:
+                self._router._update(self)
+            % endif
             self.queue_event(Event.${_null_event_name})
+        % if options.payload_pool and payload_events():
+        if payload is not None:
+            payload.release()
+        % endif
 
     def _exit_state(self, state: State):
 <% if_elif = IfOrElif() %>\
         % for state in states_with_exit_actions():
-        ${next(if_elif)} state is State.${enum_name(state)}:
+        ${next(if_elif)} state ${identity_operator()} State.${enum_name(state)}:
             % for action in state.exit_actions:
-            ${action.text}
+${action_block(action, _indent * 3)}\
             % endfor
+            % if state_time_events(state):
+            for timer in self._timers.pop(State.${enum_name(state)}, ()):
+                timer.cancel()
+            % endif
         % endfor
         % if not states_with_exit_actions():
         pass
@@ -188,37 +1416,240 @@ class StateMachine:
     def _enter_state(self, state: State):
 <% if_elif = IfOrElif() %>\
         % for state in states_with_entry_actions():
-        ${next(if_elif)} state is State.${enum_name(state)}:
+        ${next(if_elif)} state ${identity_operator()} State.${enum_name(state)}:
             % for action in state.entry_actions:
-            ${action.text}
+${action_block(action, _indent * 3)}\
             % endfor
+            % if state_time_events(state):
+            self._start_timers(State.${enum_name(state)})
+            % endif
         % endfor
         self._current_state = state
+% if time_events():
 
-% for key, transitions in transitions_by_source_and_event().items():
-<% source_name = key[0] %>\
-<% event_name = key[1] %>\
+    def _start_timers(self, state: State):
+        # The list identifies this entry to the state, so that the events
+        # of its timers are dropped once the state has been exited
+        self._timers[state] = timers = []
 <% if_elif = IfOrElif() %>\
-<% transitions_with_guards = [t for t in transitions if t.guard] %>\
-<% transitions_without_guards = [t for t in transitions if not t.guard] %>\
-    def _process_${event_name}_in_${source_name}(self, event: Event):
-        % for transition in transitions_with_guards:
-        ${next(if_elif)} ${transition.guard.condition}:
-${transition_block(transition, indent_lvl=3)}\
+        % for state in states_with_time_events():
+        ${next(if_elif)} state ${identity_operator()} State.${enum_name(state)}:
+            % for event in state_time_events(state):
+            timers.append(self._timing_wheel.schedule(${event.delay}, partial(self._expire_time_event, Event.${event.name}, state, timers)))
+            % endfor
         % endfor
-        % for transition in transitions_without_guards:
-        % if transitions_with_guards:
-        else:
-${transition_block(transition, indent_lvl=3)}\
+
+    def _cancel_timers(self):
+        for timers in self._timers.values():
+            for timer in timers:
+                timer.cancel()
+        self._timers.clear()
+        self._time_events.clear()
+% endif
+
+% if options.shard_handlers:
+<% render_handler_shards() %>\
+    # Dispatch table shared by all instances, mapping (state, event) to handler
+    # functions, which are loaded from each state's shard module as needed
+    _event_handlers = _LazyEventHandlers()
+% else:
+% for (source_name, event_name), (transitions, inherited_exits) in dispatched_transitions().items():
+${event_handler(source_name, event_name, transitions, inherited_exits)}\
+% endfor
+    # Dispatch table shared by all instances, mapping (state, event) to handler functions
+    _event_handlers = MappingProxyType({
+        % for source_name, event_name in dispatched_transitions().keys():
+        (State.${source_name}, Event.${event_name}): _process_${event_name}_in_${source_name},
+        % endfor
+    })
+% endif
+% if options.journal:
+
+def open_journal(path: str, **kwargs) -> Journal:
+    """Opens a journal for statemachines of this module, see `Journal` for the keyword arguments"""
+    return Journal(path, _JOURNAL_FORMAT, **kwargs)
+% endif
+% if not options.threaded:
+
+def pack_snapshots(machines: Iterable[StateMachine]) -> bytes:
+    """Packs the snapshots of many statemachines into one contiguous buffer"""
+    machines = list(machines)
+    buffer = bytearray(_SNAPSHOT_COUNT.pack(len(machines)))
+    for machine in machines:
+        machine._write_snapshot(buffer)
+    return bytes(buffer)
+
+def unpack_snapshots(buffer: bytes) -> List[StateMachine]:
+    """Creates a statemachine for each snapshot in a buffer from `pack_snapshots`"""
+    machine_count, = _SNAPSHOT_COUNT.unpack_from(buffer, 0)
+    offset = _SNAPSHOT_COUNT.size
+    machines = []
+    for _ in range(machine_count):
+        machine = StateMachine()
+        offset = machine._read_snapshot(buffer, offset)
+        machines.append(machine)
+    return machines
+% endif
+% if options.journal:
+
+def replay_journal(path: str, machine: Optional[StateMachine] = None) -> StateMachine:
+    """
+    Re-drives `machine` (a new statemachine by default) through the events
+    recorded in the journal at `path`, and returns it. Raises a `JournalError`
+    if the statemachine is not in the journaled state of an event, e.g.
+    because a guard reads data that is not part of the journal.
+    % if options.threaded:
+    The events are dispatched on the calling thread, so `machine` must not
+    have been started.
+    % endif
+    """
+    if machine is None:
+        % if time_events():
+        # Time events are replayed from the journal, so the timers are never advanced
+        machine = StateMachine(timing_wheel=TimingWheel())
         % else:
-${transition_block(transition, indent_lvl=2)}\
+        machine = StateMachine()
         % endif
-        % endfor
+    % if options.threaded:
+    if machine._worker.is_alive():
+        raise JournalError("Cannot replay into a started statemachine")
+    # Events that actions queue while replaying are then internal events,
+    # rather than blocking on the bounded queue
+    worker, machine._worker = machine._worker, threading.current_thread()
+    try:
+        for index, (state, event, _) in enumerate(read_journal(path)):
+            if machine._current_state ${identity_operator(negated=True)} _STATES[state]:
+                raise JournalError(
+                    f"Replay diverged at record {index}: in {machine._current_state}, journaled {_STATES[state]}"
+                )
+            machine._replay_event(_EVENTS[event])
+        machine._internal_events.clear()
+    finally:
+        machine._worker = worker
+    % else:
+    for index, (state, event, _) in enumerate(read_journal(path)):
+        if machine._current_state ${identity_operator(negated=True)} _STATES[state]:
+            raise JournalError(
+                f"Replay diverged at record {index}: in {machine._current_state}, journaled {_STATES[state]}"
+            )
+        machine._replay_event(_EVENTS[event])
+    % endif
+    return machine
+% endif
+% if options.router:
 
-% endfor
-% for terminal_state in terminal_states_in_sub_regions():
-    def _process_${_null_event_name}_in_${enum_name(terminal_state)}(self, event: Event):
-        self._exit_state(State.${enum_name(terminal_state)})
-        self._current_state = State.${enum_name(terminal_state.region.state)}
+# States that handle each event
+_ACCEPTING_STATES = MappingProxyType({
+    event: tuple(state for state in ${iterable("State")} if _ACCEPTED_EVENTS[state] >> ${value_of("event")} & 1)
+    for event in ${iterable("Event")}
+})
 
-% endfor
+class EventRouter:
+    """
+    Indexes statemachines by their current state, so that a broadcast event
+    only reaches the statemachines whose current state handles it. The index
+    is updated by the statemachines as they change state. A statemachine may
+    belong to one router at a time.
+    """
+
+    __slots__ = ("_instances", "_states"${', "_lock"' if options.threaded else ""})
+
+    def __init__(self, machines: Iterable[StateMachine] = ()):
+        # Statemachines in each state, as insertion ordered sets
+        self._instances = {state: {} for state in ${iterable("State")}}
+        # The state that each statemachine is indexed by
+        self._states = {}
+        % if options.threaded:
+        self._lock = threading.Lock()
+        % endif
+        for machine in machines:
+            self.add(machine)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def add(self, machine: StateMachine):
+        % if options.threaded:
+        with self._lock:
+            self._add(machine)
+
+    def _add(self, machine: StateMachine):
+        % endif
+        if machine._router is not None:
+            raise ValueError("The statemachine already belongs to a router")
+        machine._router = self
+        self._states[machine] = machine._current_state
+        self._instances[machine._current_state][machine] = None
+
+    def remove(self, machine: StateMachine):
+        % if options.threaded:
+        with self._lock:
+            del self._instances[self._states.pop(machine)][machine]
+            machine._router = None
+        % else:
+        del self._instances[self._states.pop(machine)][machine]
+        machine._router = None
+        % endif
+
+    def subscribers(self, event: Event) -> List[StateMachine]:
+        """Returns the statemachines whose current state handles `event`"""
+        % if options.threaded:
+        with self._lock:
+            return [machine for state in _ACCEPTING_STATES[event] for machine in self._instances[state]]
+        % else:
+        return [machine for state in _ACCEPTING_STATES[event] for machine in self._instances[state]]
+        % endif
+
+    def broadcast(${queue_event_parameters()}) -> int:
+        """
+        Queues `event` to each statemachine whose current state handles it,
+        % if not options.threaded:
+        and processes their events. Returns the number of statemachines reached.
+        % else:
+        Returns the number of statemachines reached.
+        % endif
+        """
+        % if options.payload_pool and payload_events():
+        if payload is not None:
+            raise ValueError("Pooled payloads are released by each statemachine, so cannot be broadcast")
+        % endif
+        machines = self.subscribers(event)
+        for machine in machines:
+            % if payload_events():
+            machine.queue_event(event, payload)
+            % else:
+            machine.queue_event(event)
+            % endif
+            % if not options.threaded:
+            machine.process_events()
+            % endif
+        return len(machines)
+
+    def _update(self, machine: StateMachine):
+        """Moves `machine` to the index of its current state"""
+        % if options.threaded:
+        with self._lock:
+            self._move(machine)
+
+    def _move(self, machine: StateMachine):
+        % endif
+        state = machine._current_state
+        if (previous := self._states.get(machine)) is not None and previous is not state:
+            del self._instances[previous][machine]
+            self._instances[state][machine] = None
+            self._states[machine] = state
+% endif
+% if decision_table_count[0]:
+
+
+def _decide(table: Mapping, value):
+    """
+    Returns the branch of a decision table for the value of the expression its
+    guards compare, or `None`. As the guards would, a value that cannot be
+    hashed is compared with each of the table's values in turn.
+    """
+    try:
+        return table.get(value)
+    except TypeError:
+        return next((branch for key, branch in table.items() if value == key), None)
+% endif
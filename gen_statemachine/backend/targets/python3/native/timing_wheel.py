@@ -0,0 +1,177 @@
+"""
+A hierarchical timing wheel, which runs the timers of statemachine time events
+(e.g. `after_5s`). A single wheel is shared by all statemachines in a process.
+
+Timers are inserted into, and cancelled from, a slot of the wheel in O(1).
+Timers due within one rotation of the lowest level are held in that level,
+with one slot per tick. Timers further in the future are held by higher
+levels, whose slots each span a full rotation of the level below, and move
+down a level each time the level below wraps around.
+"""
+
+import threading
+import time
+from math import ceil, floor
+from typing import Callable, Dict, List, Optional
+
+
+class Timer:
+    """A callback scheduled on a `TimingWheel`, which may be cancelled until it expires"""
+
+    __slots__ = ("expiry", "callback", "_wheel", "_slot")
+
+    def __init__(self, wheel: "TimingWheel", expiry: int, callback: Callable[[], None]):
+        self.expiry = expiry
+        self.callback = callback
+        self._wheel = wheel
+        self._slot: Optional[Dict["Timer", None]] = None
+
+    def cancel(self):
+        self._wheel._cancel(self)
+
+
+class TimingWheel:
+    """
+    Arguments:
+    - tick: Resolution of the wheel in seconds
+    - slots: Number of slots in each level of the wheel
+    - levels: Number of levels. Timers beyond the range of the highest level
+      are held in the highest level until they come into range
+    - clock: Returns the current time in seconds
+    """
+
+    def __init__(
+        self,
+        tick: float = 0.01,
+        slots: int = 256,
+        levels: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.tick = tick
+        self._slots = slots
+        self._levels = levels
+        # Number of ticks spanned by one slot of each level
+        self._spans = [slots**level for level in range(levels)]
+        self._wheels: List[List[Dict[Timer, None]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self._clock = clock
+        self._start_time = clock()
+        self._current_tick = 0
+        self._timer_count = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def __len__(self) -> int:
+        """Returns the number of pending timers"""
+        return self._timer_count
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """Calls `callback` once `delay` seconds have passed, unless cancelled"""
+        with self._lock:
+            now_tick = self._now_tick()
+            if not self._timer_count:
+                # Nothing to expire, so the wheel can skip ahead to now
+                self._current_tick = max(self._current_tick, now_tick)
+            ticks = max(1, ceil(round(delay / self.tick, 9)))
+            timer = Timer(self, max(now_tick, self._current_tick) + ticks, callback)
+            self._insert(timer)
+            self._timer_count += 1
+        return timer
+
+    def remaining(self, timer: Timer) -> float:
+        """Returns the number of seconds until `timer` expires"""
+        with self._lock:
+            return max(0, timer.expiry - self._now_tick()) * self.tick
+
+    def advance(self) -> int:
+        """
+        Expires all timers that are due by the current time and calls their
+        callbacks. Returns the number of expired timers.
+        """
+        expired: List[Timer] = []
+        with self._lock:
+            now_tick = self._now_tick()
+            while self._current_tick < now_tick:
+                if not self._timer_count:
+                    self._current_tick = now_tick
+                    break
+                self._current_tick += 1
+                self._cascade()
+                expired += self._expire()
+        for timer in expired:
+            timer.callback()
+        return len(expired)
+
+    def start(self):
+        """Advances the wheel once per tick from a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            self.advance()
+
+    def _now_tick(self) -> int:
+        return floor(round((self._clock() - self._start_time) / self.tick, 9))
+
+    def _insert(self, timer: Timer):
+        remaining = timer.expiry - self._current_tick
+        level = 0
+        while level < self._levels - 1 and remaining >= self._spans[level + 1]:
+            level += 1
+        index = (timer.expiry // self._spans[level]) % self._slots
+        slot = self._wheels[level][index]
+        slot[timer] = None
+        timer._slot = slot
+
+    def _cancel(self, timer: Timer):
+        with self._lock:
+            if timer._slot is not None:
+                del timer._slot[timer]
+                timer._slot = None
+                self._timer_count -= 1
+
+    def _cascade(self):
+        """Moves timers down from the levels that the current tick has wrapped around"""
+        wrapped_levels = 1
+        while (
+            wrapped_levels < self._levels
+            and self._current_tick % self._spans[wrapped_levels] == 0
+        ):
+            wrapped_levels += 1
+        for level in reversed(range(1, wrapped_levels)):
+            index = (self._current_tick // self._spans[level]) % self._slots
+            slot = self._wheels[level][index]
+            timers = list(slot)
+            slot.clear()
+            for timer in timers:
+                self._insert(timer)
+
+    def _expire(self) -> List[Timer]:
+        slot = self._wheels[0][self._current_tick % self._slots]
+        expired = [timer for timer in slot if timer.expiry <= self._current_tick]
+        for timer in expired:
+            del slot[timer]
+            timer._slot = None
+        self._timer_count -= len(expired)
+        return expired
+
+
+_shared_timing_wheel: Optional[TimingWheel] = None
+_shared_timing_wheel_lock = threading.Lock()
+
+
+def shared_timing_wheel() -> TimingWheel:
+    """Returns the process wide `TimingWheel`, which is created and started on first use"""
+    global _shared_timing_wheel
+    with _shared_timing_wheel_lock:
+        if _shared_timing_wheel is None:
+            _shared_timing_wheel = TimingWheel()
+            _shared_timing_wheel.start()
+        return _shared_timing_wheel
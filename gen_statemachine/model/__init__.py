@@ -1,4 +1,10 @@
 from gen_statemachine.model.builder import ModelBuilder
+from gen_statemachine.model.optimise import (
+    minimise_states,
+    prune_unreachable,
+    MinimisationReport,
+    PruningReport,
+)
 from gen_statemachine.model.model import (
     StateMachine,
     State,
@@ -7,6 +13,8 @@ from gen_statemachine.model.model import (
     Transition,
     Action,
     Event,
+    Parameter,
     Guard,
     Choice,
+    CoalescePolicy,
 )
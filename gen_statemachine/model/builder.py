@@ -6,6 +6,7 @@ model.
 """
 
 import logging
+import re
 from typing import Optional, List
 
 from gen_statemachine.frontend import ParseTree
@@ -15,6 +16,19 @@ from .model import *
 
 LOGGER = logging.getLogger(__name__)
 
+# Transition stereotypes that set properties of the trigger event, e.g.
+# <<priority=2>> or <<priority=2, coalesce=latest>>
+EVENT_PROPERTY_PATTERN = re.compile(r"^\s*(priority|coalesce)\s*=\s*(\S+)\s*$")
+PRIORITY_PATTERN = re.compile(r"^-?\d+$")
+
+# Trigger with optional payload parameters, e.g. EvSample or EvSample(value: float, source)
+TRIGGER_PATTERN = re.compile(r"^([A-Za-z_]\w*)\s*(?:\((.*)\))?$")
+PARAMETER_PATTERN = re.compile(r"^\s*([A-Za-z_]\w*)\s*(?::\s*(\S.*?))?\s*$")
+
+# Trigger of a time event, e.g. after_5s or after_250ms
+TIME_EVENT_PATTERN = re.compile(r"^after_(\d+)(ms|s|m|h)$")
+TIME_EVENT_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
 
 def find_first_token(
     node: ParseTreeNode, token_types: List[TokenType]
@@ -59,6 +73,17 @@ def lookup_vertex(statemachine: StateMachine, decl_node: ParseTreeNode, region:
     )
 
 
+def lookup_event(statemachine: StateMachine, event_name: str) -> Optional[Event]:
+    """Looks for an existing event with the same name, so that triggers sharing a name share an `Event`"""
+    return next(
+        filter(
+            lambda e: e.name == event_name,
+            statemachine.events().values(),
+        ),
+        None,
+    )
+
+
 class ChoiceBuilder:
     """Creates `ChoicePseudoState` objects from state_declaration expressions"""
 
@@ -200,6 +225,7 @@ class TransitionBuilder:
             self.add_event()
             self.add_guard()
             self.add_action()
+        self.add_event_properties()
 
         self.transition.type = TransitionType.INTERNAL
 
@@ -250,8 +276,83 @@ class TransitionBuilder:
         if event_token := find_first_token(
             self.transition_label_node, [TokenType.TRIGGER]
         ):
-            self.transition.trigger = self.statemachine.new_event()
-            self.transition.trigger.name = event_token.text.strip()
+            trigger_text = event_token.text.strip()
+            if not (trigger_match := TRIGGER_PATTERN.match(trigger_text)):
+                raise RuntimeError(f"Invalid trigger '{trigger_text}'")
+            event_name = trigger_match.group(1)
+            if not (event := lookup_event(self.statemachine, event_name)):
+                event = self.statemachine.new_event()
+                event.name = event_name
+                if match := TIME_EVENT_PATTERN.match(event_name):
+                    event.delay = int(match.group(1)) * TIME_EVENT_UNITS[match.group(2)]
+            self.transition.trigger = event
+            if trigger_match.group(2) and trigger_match.group(2).strip():
+                self.add_event_parameters(event, trigger_match.group(2))
+
+    def add_event_parameters(self, event: Event, parameters_text: str):
+        parameters = []
+        for parameter_text in parameters_text.split(","):
+            if not (match := PARAMETER_PATTERN.match(parameter_text)):
+                raise RuntimeError(
+                    f"Invalid parameter '{parameter_text.strip()}' of event {event.name}"
+                )
+            parameters.append(Parameter(match.group(1), match.group(2)))
+        if event.delay is not None:
+            raise RuntimeError(f"Time event {event.name} cannot have parameters")
+        if not event.parameters:
+            event.parameters = parameters
+        elif event.parameters != parameters:
+            raise RuntimeError(
+                f"Event {event.name} is declared with different parameters"
+            )
+
+    def add_event_properties(self):
+        if not self.transition.stereotype:
+            return
+        matches = [
+            EVENT_PROPERTY_PATTERN.match(part)
+            for part in self.transition.stereotype.split(",")
+        ]
+        if not all(matches):
+            return
+        if not (event := self.transition.trigger):
+            raise RuntimeError(
+                f"Event stereotype used on {self.transition.id}, which has no trigger event"
+            )
+        for match in matches:
+            if match.group(1) == "priority":
+                self.add_event_priority(event, match.group(2))
+            else:
+                self.add_event_coalesce_policy(event, match.group(2))
+
+    def add_event_priority(self, event: Event, value: str):
+        if not PRIORITY_PATTERN.match(value):
+            raise RuntimeError(
+                f"Invalid priority '{value}' on {self.transition.id}, expected an integer"
+            )
+        priority = int(value)
+        if event.priority is None:
+            event.priority = priority
+        elif event.priority != priority:
+            LOGGER.warning(
+                f"Event {event.name} is given priorities {event.priority} and {priority}, using the highest"
+            )
+            event.priority = max(event.priority, priority)
+
+    def add_event_coalesce_policy(self, event: Event, value: str):
+        try:
+            policy = CoalescePolicy(value)
+        except ValueError:
+            policies = ", ".join(policy.value for policy in CoalescePolicy)
+            raise RuntimeError(
+                f"Invalid coalesce policy '{value}' on {self.transition.id}, expected one of: {policies}"
+            )
+        if event.coalesce is None:
+            event.coalesce = policy
+        elif event.coalesce is not policy:
+            raise RuntimeError(
+                f"Event {event.name} is given coalesce policies {event.coalesce.value} and {policy.value}"
+            )
 
     def add_guard(self):
         if guard_token := find_first_token(
@@ -24,9 +24,27 @@ class Entity:
         return f"id:{self.id}, name:{self.name}"
 
 
+@dataclass
+class Parameter:
+    name: str
+    # Type annotation text, `None` if the diagram does not give a type
+    type: Optional[str] = None
+
+
 @dataclass
 class Event(Entity):
-    pass
+    # Events with a higher priority may be dispatched before other pending
+    # events, `None` if the diagram does not declare a priority
+    priority: Optional[int] = None
+    # Time events (e.g. `after_5s`) occur once their source state has been
+    # active for `delay` seconds, `None` for all other events
+    delay: Optional[float] = None
+    # How further occurrences of the event are handled while one is already
+    # pending, `None` if every occurrence is queued
+    coalesce: Optional[CoalescePolicy] = None
+    # Fields of the data carried by each occurrence of the event,
+    # e.g. `EvSample(value: float)`
+    parameters: List[Parameter] = field(default_factory=list)
 
 
 @dataclass
@@ -39,6 +57,15 @@ class Guard(Entity):
     condition: Optional[str] = None
 
 
+class CoalescePolicy(Enum):
+    # The pending occurrence takes the data of the latest occurrence
+    LATEST = "latest"
+    # Occurrences are dropped while one is pending
+    DROP = "drop"
+    # As `LATEST`, and the number of merged occurrences is counted
+    COUNT = "count"
+
+
 class TransitionType(Enum):
     INVALID = 1
     EXTERNAL = 2
@@ -0,0 +1,342 @@
+"""
+Optimisation passes, which may be run on a StateMachine model after it is
+built by the ModelBuilder and before code is generated from it. Each pass
+changes the model in place, so that every target generates less code for
+the same behaviour, and returns a report of what it changed.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Set, cast
+
+from .model import *
+
+LOGGER = logging.getLogger(__name__)
+
+# States referenced by diagram behaviour, e.g. `self.is_in(State.Idle)`
+STATE_REFERENCE_PATTERN = re.compile(r"\bState\.([A-Za-z_]\w*)")
+
+
+@dataclass
+class MinimisationReport:
+    # Names of the states merged into each remaining state
+    merged_states: Dict[str, List[str]] = field(default_factory=dict)
+    # Number of transitions removed with the merged states
+    removed_transitions: int = 0
+
+    def __str__(self) -> str:
+        if not self.merged_states:
+            return "No equivalent states found"
+        merged = "; ".join(
+            f"{', '.join(names)} into {name}"
+            for name, names in self.merged_states.items()
+        )
+        count = sum(len(names) for names in self.merged_states.values())
+        return (
+            f"Merged {count} equivalent states ({merged}), "
+            f"removing {self.removed_transitions} transitions"
+        )
+
+
+@dataclass
+class PruningReport:
+    # Names of the vertices that cannot be reached from the initial state
+    removed_vertices: List[str] = field(default_factory=list)
+    # Transitions that are never taken, or that leave a removed vertex
+    removed_transitions: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        removed = []
+        if self.removed_vertices:
+            removed.append(
+                f"{len(self.removed_vertices)} unreachable states "
+                f"({', '.join(self.removed_vertices)})"
+            )
+        if self.removed_transitions:
+            removed.append(
+                f"{len(self.removed_transitions)} transitions "
+                f"({', '.join(self.removed_transitions)})"
+            )
+        if not removed:
+            return "No unreachable states or dead transitions found"
+        return f"Removed {' and '.join(removed)}"
+
+
+def vertex_label(vertex: Vertex) -> str:
+    """Returns the name of a vertex, as the targets name initial and terminal states"""
+    state = region_of(vertex).state
+    namespace = state.name if state and state.name else ""
+    if isinstance(vertex, InitialState):
+        return f"{namespace}_initial_state"
+    if isinstance(vertex, TerminalState):
+        return f"{namespace}_terminal_state"
+    return vertex.name or vertex.id
+
+
+def transition_label(transition: Transition) -> str:
+    source, target = source_of(transition), target_of(transition)
+    label = f"{vertex_label(source)} --> {vertex_label(target)}"
+    return f"{label} : {transition.trigger.name}" if transition.trigger else label
+
+
+# The ModelBuilder gives every transition a source and a target, and every
+# vertex a region, so these are not `None` in a built model
+
+
+def source_of(transition: Transition) -> Vertex:
+    return cast(Vertex, transition.source)
+
+
+def target_of(transition: Transition) -> Vertex:
+    return cast(Vertex, transition.target)
+
+
+def region_of(vertex: Vertex) -> Region:
+    return cast(Region, vertex.region)
+
+
+def remove_transition(statemachine: StateMachine, transition: Transition):
+    """Removes a transition, and its guard and action, from the model"""
+    source, target = source_of(transition), target_of(transition)
+    source.outgoing_transitions = [
+        t for t in source.outgoing_transitions if t is not transition
+    ]
+    target.incoming_transitions = [
+        t for t in target.incoming_transitions if t is not transition
+    ]
+    for region in statemachine.regions().values():
+        region.transitions = [t for t in region.transitions if t is not transition]
+    for entity in [transition, transition.guard, transition.action]:
+        if entity:
+            del statemachine.entities[entity.id]
+
+
+def remove_vertex(statemachine: StateMachine, vertex: Vertex):
+    """
+    Removes a vertex with no incoming transitions from the model, with its
+    outgoing transitions and its entry and exit actions. The sub regions of
+    a composite state are also removed, but not the vertices within them.
+    """
+    for transition in list(vertex.outgoing_transitions):
+        remove_transition(statemachine, transition)
+    for action in getattr(vertex, "entry_actions", []) + getattr(
+        vertex, "exit_actions", []
+    ):
+        del statemachine.entities[action.id]
+    for region in getattr(vertex, "sub_regions", []):
+        del statemachine.entities[region.id]
+    region = region_of(vertex)
+    region.sub_vertices = [v for v in region.sub_vertices if v is not vertex]
+    if region.initial_state is vertex:
+        region.initial_state = None
+    if region.terminal_state is vertex:
+        region.terminal_state = None
+    del statemachine.entities[vertex.id]
+
+
+def referenced_state_names(statemachine: StateMachine) -> Set[str]:
+    """Returns the names of states that diagram actions or guards refer to"""
+    texts = [
+        entity.text
+        for entity in statemachine.entities.values()
+        if isinstance(entity, Action) and entity.text
+    ]
+    texts += [
+        entity.condition
+        for entity in statemachine.entities.values()
+        if isinstance(entity, Guard) and entity.condition
+    ]
+    return set(STATE_REFERENCE_PATTERN.findall("\n".join(texts)))
+
+
+def is_mergeable(vertex: Vertex, referenced_names: Set[str]) -> bool:
+    # Pseudo states other than choices are unique to their region, and the
+    # sub regions of a composite state give it behaviour of its own
+    if type(vertex) is State:
+        return not vertex.sub_regions and vertex.name not in referenced_names
+    return type(vertex) is Choice
+
+
+def minimise_states(statemachine: StateMachine) -> MinimisationReport:
+    """
+    Merges behaviourally equivalent states by partition refinement.
+
+    Simple states and choices start in the same block if they are in the same
+    region and have the same stereotype and entry and exit actions, and every
+    other vertex starts in a block of its own. A block is split while its
+    vertices differ in their outgoing transitions, which are compared in
+    diagram order by trigger, guard, action and the block of their target.
+    As in Hopcroft's algorithm, only the blocks with transitions into the
+    vertices that moved to a new block need to be refined again.
+
+    Once no block can be split, the vertices of each block are merged into
+    the first of them in diagram order. The transitions into the merged
+    vertices are redirected to it, and their outgoing transitions removed.
+    States referred to by name from actions or guards are never merged.
+    """
+    vertices = list(statemachine.vertices().values())
+    referenced_names = referenced_state_names(statemachine)
+
+    initial_keys: Dict[Hashable, int] = {}
+    block_of: Dict[Id, int] = {}
+    for vertex in vertices:
+        key: Hashable
+        if is_mergeable(vertex, referenced_names):
+            key = (
+                region_of(vertex).id,
+                type(vertex).__name__,
+                vertex.stereotype,
+                tuple(action.text for action in getattr(vertex, "entry_actions", [])),
+                tuple(action.text for action in getattr(vertex, "exit_actions", [])),
+            )
+        else:
+            key = vertex.id
+        block_of[vertex.id] = initial_keys.setdefault(key, len(initial_keys))
+    blocks: Dict[int, List[Vertex]] = {}
+    for vertex in vertices:
+        blocks.setdefault(block_of[vertex.id], []).append(vertex)
+
+    def signature(vertex: Vertex) -> tuple:
+        return tuple(
+            (
+                transition.trigger.id if transition.trigger else None,
+                transition.guard.condition if transition.guard else None,
+                transition.action.text if transition.action else None,
+                transition.type,
+                transition.stereotype,
+                block_of[target_of(transition).id],
+            )
+            for transition in vertex.outgoing_transitions
+        )
+
+    pending = set(blocks)
+    while pending:
+        block = pending.pop()
+        if len(blocks[block]) < 2:
+            continue
+        groups: Dict[tuple, List[Vertex]] = {}
+        for vertex in blocks[block]:
+            groups.setdefault(signature(vertex), []).append(vertex)
+        if len(groups) < 2:
+            continue
+        # The largest group keeps the block, so only the vertices of the
+        # other groups change block
+        largest, *others = sorted(groups.values(), key=len, reverse=True)
+        blocks[block] = largest
+        for group in others:
+            new_block = len(blocks)
+            blocks[new_block] = group
+            pending.add(new_block)
+            for vertex in group:
+                block_of[vertex.id] = new_block
+            for vertex in group:
+                for transition in vertex.incoming_transitions:
+                    pending.add(block_of[source_of(transition).id])
+
+    report = MinimisationReport()
+    order = {vertex.id: index for index, vertex in enumerate(vertices)}
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        kept, *merged = sorted(members, key=lambda vertex: order[vertex.id])
+        for vertex in merged:
+            for transition in vertex.incoming_transitions:
+                transition.target = kept
+                kept.incoming_transitions.append(transition)
+            vertex.incoming_transitions = []
+            report.removed_transitions += len(vertex.outgoing_transitions)
+            remove_vertex(statemachine, vertex)
+        report.merged_states[kept.name or kept.id] = [
+            vertex.name or vertex.id for vertex in merged
+        ]
+    return report
+
+
+def dead_transitions(statemachine: StateMachine) -> List[Transition]:
+    """
+    Returns the transitions that are never taken. As every target dispatches
+    the transitions of a vertex and trigger by trying those with guards in
+    diagram order and then the first without a guard, any further
+    transitions without a guard are never taken.
+    """
+    dead = []
+    for vertex in statemachine.vertices().values():
+        unguarded_triggers = set()
+        for transition in vertex.outgoing_transitions:
+            if transition.guard:
+                continue
+            trigger = transition.trigger.id if transition.trigger else None
+            if trigger in unguarded_triggers:
+                dead.append(transition)
+            unguarded_triggers.add(trigger)
+    return dead
+
+
+def reachable_vertices(statemachine: StateMachine, dead: List[Transition]) -> Set[Id]:
+    """
+    Returns the IDs of the vertices that can be reached from the initial
+    state of the statemachine's region without taking a `dead` transition.
+    Reaching a vertex also reaches the states that enclose it, as their
+    transitions may then be taken, and reaching a composite state reaches
+    the initial states of its sub regions. States referred to by name from
+    actions or guards are treated as reached, as the code generated for
+    the reference needs them to exist.
+    """
+    dead_ids = {transition.id for transition in dead}
+    referenced_names = referenced_state_names(statemachine)
+    roots: List[Vertex] = []
+    successors: Dict[Id, List[Vertex]] = {}
+    for vertex in statemachine.vertices().values():
+        if isinstance(vertex, State) and vertex.name in referenced_names:
+            roots.append(vertex)
+        successors[vertex.id] = [
+            target_of(transition)
+            for transition in vertex.outgoing_transitions
+            if transition.id not in dead_ids
+        ]
+        if state := region_of(vertex).state:
+            successors[vertex.id].append(state)
+        for region in getattr(vertex, "sub_regions", []):
+            if region.initial_state:
+                successors[vertex.id].append(region.initial_state)
+
+    if statemachine.region and statemachine.region.initial_state:
+        roots.append(statemachine.region.initial_state)
+    reachable = {vertex.id for vertex in roots}
+    pending = list(roots)
+    while pending:
+        for successor in successors[pending.pop().id]:
+            if successor.id not in reachable:
+                reachable.add(successor.id)
+                pending.append(successor)
+    return reachable
+
+
+def prune_unreachable(statemachine: StateMachine) -> PruningReport:
+    """
+    Removes the transitions that are never taken, and then the vertices that
+    cannot be reached, with their transitions. Events are kept even if no
+    transition is triggered by them any more, so they may still be queued.
+    States referred to by name from actions or guards are never removed.
+    """
+    dead = dead_transitions(statemachine)
+    reachable = reachable_vertices(statemachine, dead)
+    unreachable = [
+        vertex
+        for vertex in statemachine.vertices().values()
+        if vertex.id not in reachable
+    ]
+
+    report = PruningReport()
+    removed = {transition.id: transition for transition in dead}
+    for vertex in unreachable:
+        for transition in vertex.outgoing_transitions:
+            removed[transition.id] = transition
+    for transition in removed.values():
+        report.removed_transitions.append(transition_label(transition))
+        remove_transition(statemachine, transition)
+    for vertex in unreachable:
+        report.removed_vertices.append(vertex_label(vertex))
+        remove_vertex(statemachine, vertex)
+    return report
@@ -35,7 +35,7 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
     parser.add_argument(
         "--target",
         dest="target_name",
-        help="Name of target for code generation. Available targets: [`python3/native`]",
+        help="Name of target for code generation. Available targets: [`python3/native`, `python3/fleet`, `python3/extension`, `python3/mypyc`, `c/switch`]",
         type=str,
         default="python3/native",
     )
@@ -46,4 +46,104 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
         help="Generate entrypoint code (e.g. `main` file)",
         default=False,
     )
+    parser.add_argument(
+        "--prune-unreachable",
+        action="store_true",
+        dest="prune_unreachable",
+        help="Remove states that cannot be reached and transitions that are never "
+        "taken before generating code, warning about each",
+        default=False,
+    )
+    parser.add_argument(
+        "--minimise-states",
+        action="store_true",
+        dest="minimise_states",
+        help="Merge states with the same behaviour before generating code",
+        default=False,
+    )
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        dest="threaded",
+        help="Generate a statemachine that processes events on a dedicated worker thread",
+        default=False,
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        help="Maximum number of pending events for a `--threaded` statemachine. "
+        "Producers calling `queue_event` are blocked while the queue is full",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        dest="instrument",
+        help="Generate per-(state, event) counters, guard evaluation counters and action timings",
+        default=False,
+    )
+    parser.add_argument(
+        "--priority-queue",
+        action="store_true",
+        dest="priority_queue",
+        help="Dispatch pending events by the priority given to them with `<<priority=N>>` transition stereotypes",
+        default=False,
+    )
+    parser.add_argument(
+        "--payload-pool",
+        action="store_true",
+        dest="payload_pool",
+        help="Generate free-list pools that reuse the payload objects of events with parameters",
+        default=False,
+    )
+    parser.add_argument(
+        "--journal",
+        action="store_true",
+        dest="journal",
+        help="Generate a statemachine that can record each dispatched event to a binary journal, "
+        "and a `replay_journal` function",
+        default=False,
+    )
+    parser.add_argument(
+        "--router",
+        action="store_true",
+        dest="router",
+        help="Generate an `EventRouter` that indexes statemachines by their current state, "
+        "so that broadcast events only reach the statemachines that accept them",
+        default=False,
+    )
+    parser.add_argument(
+        "--shard-handlers",
+        action="store_true",
+        dest="shard_handlers",
+        help="Generate the event handlers of each state in a separate module, "
+        "which is only imported on the first dispatch of an event in that state",
+        default=False,
+    )
+    parser.add_argument(
+        "--int-constants",
+        action="store_true",
+        dest="int_constants",
+        help="Generate `State` and `Event` as plain int constants rather than Enums, "
+        "with Enum views `StateEnum` and `EventEnum` that are built on first use",
+        default=False,
+    )
+    parser.add_argument(
+        "--precompile",
+        action="store_true",
+        dest="precompile",
+        help="Write the bytecode of generated Python modules to `__pycache__`, "
+        "so that their first import does not compile them",
+        default=False,
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="append",
+        dest="coalesce",
+        metavar="EVENT=POLICY",
+        help="Coalesce pending occurrences of EVENT with POLICY `latest`, `drop` or `count`, "
+        "overriding any `<<coalesce=POLICY>>` stereotype. May be given more than once",
+        default=[],
+    )
     return parser.parse_known_args()
@@ -33,7 +33,8 @@ class Program:
         1. The Parser takes the input PlantUML file and generates a ParseTree
            that represents the file's text
         2. The ModelBuilder then takes the ParseTree and generates a
-           StateMachine model from it
+           StateMachine model from it, which optimisation passes selected
+           by the arguments may then reduce
         3. The StateMachine model is passed to the TargetGenerator which
            performs code generation for the target language
         """
@@ -55,11 +56,24 @@ class Program:
 
             LOGGER.info("Generating statemachine model..")
             statemachine: StateMachine = self.model_builder.build(parse_tree)
+            if args.prune_unreachable:
+                LOGGER.info("Pruning unreachable states..")
+                report = model.prune_unreachable(statemachine)
+                if report.removed_vertices or report.removed_transitions:
+                    LOGGER.warning(report)
+                else:
+                    LOGGER.info(report)
+            if args.minimise_states:
+                LOGGER.info("Minimising states..")
+                LOGGER.info(model.minimise_states(statemachine))
 
             LOGGER.info("Generating statemachine code..")
             args.output_dir.mkdir(parents=True, exist_ok=True)
             self.target_generator.generate(
-                args.target_name, args.output_dir, statemachine
+                args.target_name,
+                args.output_dir,
+                statemachine,
+                backend.GenerationOptions.from_args(args),
             )
 
             LOGGER.info("Done!")
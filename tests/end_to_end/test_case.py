@@ -12,14 +12,20 @@ from typing import List
 
 
 class EndToEndTestCase(TestCaseBase):
+    # Extra command line arguments passed to gen_statemachine
+    generation_args: List[str] = []
+    # Directory holding the `tests` specs and `results` output
+    tests_dir: Path = Path(__file__).parent.absolute()
+    # Appended to the test name for the output dir, so that a spec can be
+    # generated for another target without clashing
+    output_suffix: str = ""
+
     def setUp(self):
         super().setUp()
         test_name = self.__class__.__name__
-        self.test_spec = (
-            Path(__file__).parent.absolute() / "tests" / (test_name + ".test")
-        )
+        self.test_spec = self.tests_dir / "tests" / (test_name + ".test")
         # Remove and re-create test output dir
-        self.output_dir = Path(__file__).parent.absolute() / "results" / test_name
+        self.output_dir = self.tests_dir / "results" / (test_name + self.output_suffix)
         shutil.rmtree(self.output_dir, ignore_errors=True)
         self.output_dir.mkdir(parents=True)
 
@@ -28,7 +34,12 @@ class EndToEndTestCase(TestCaseBase):
 
     def run_gen_statemachine(self):
         # Set program args & logging config
-        sys.argv = [__name__, str(self.test_spec), str(self.output_dir), "--diag"]
+        sys.argv = [
+            __name__,
+            str(self.test_spec),
+            str(self.output_dir),
+            "--diag",
+        ] + self.generation_args
         # logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
 
         program = gen_statemachine.main.Program(enable_stdout_debug=lambda: None)
@@ -43,10 +54,10 @@ class EndToEndTestCase(TestCaseBase):
         expected_output = file_content[start_tag_index + len(start_tag) : end_tag_index]
         return [line for line in expected_output.split("\n") if line.strip() != ""]
 
-    def import_statemachine_module(self):
+    def import_statemachine_module(self, module_name: str = "statemachine"):
         sys.path.append(str(self.output_dir))
         spec = importlib.util.spec_from_file_location(
-            "statemachine", self.output_dir / "statemachine.py"
+            module_name, self.output_dir / (module_name + ".py")
         )
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
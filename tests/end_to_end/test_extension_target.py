@@ -0,0 +1,116 @@
+from tests.end_to_end.test_case import EndToEndTestCase
+from tests.end_to_end import test_gen_statemachine as native
+from gen_statemachine.backend.dispatch import extension_module_name
+from pathlib import Path
+from contextlib import redirect_stdout
+import importlib
+import io
+import shutil
+import subprocess
+import sys
+import sysconfig
+import unittest
+
+
+def can_build_extensions() -> bool:
+    compiler = (sysconfig.get_config_var("CC") or "").split()[:1]
+    python_header = Path(sysconfig.get_paths()["include"]) / "Python.h"
+    return bool(compiler) and bool(shutil.which(compiler[0])) and python_header.exists()
+
+
+@unittest.skipUnless(can_build_extensions(), "cannot build C extension modules")
+class ExtensionTargetTestCase(EndToEndTestCase):
+    """
+    Runs the tests of a python3/native spec against the python3/extension
+    target, which has the same StateMachine API
+    """
+
+    generation_args = ["--target", "python3/extension"]
+    output_suffix = "_extension"
+
+    def import_statemachine_module(self, module_name: str = "statemachine"):
+        result = subprocess.run(
+            [sys.executable, "setup.py", "build_ext", "--inplace"],
+            cwd=self.output_dir,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # Each test of a class rebuilds the extension module of its output dir
+        sys.modules.pop(extension_module_name(self.output_dir), None)
+        sys.path.insert(0, str(self.output_dir))
+        try:
+            importlib.invalidate_caches()
+            return super().import_statemachine_module(module_name)
+        finally:
+            sys.path.remove(str(self.output_dir))
+
+
+class T3_nested_entry_exit(ExtensionTargetTestCase, native.T3_nested_entry_exit):
+    def test_other_statemachine(self):
+        """Test that the extension modules of different statemachines can be used together"""
+        self.run_gen_statemachine()
+        first = self.import_statemachine_module()
+        first_output = self.read_expected_output()
+        # Another statemachine, generated into an output dir of its own
+        self.test_spec = self.tests_dir / "tests" / "T6_event_actions.test"
+        self.output_dir = self.output_dir.with_name("T6_event_actions_other_extension")
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        self.output_dir.mkdir(parents=True)
+        self.run_gen_statemachine()
+        second = self.import_statemachine_module()
+        self.assertNotEqual(
+            first.StateMachineBase.__module__, second.StateMachineBase.__module__
+        )
+
+        for module, expected_output in [
+            (first, first_output),
+            (second, self.read_expected_output()),
+        ]:
+            sm = module.StateMachine()
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                sm.start()
+            output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+            self.assertEqual(output, expected_output)
+
+
+class T6_event_actions(ExtensionTargetTestCase, native.T6_event_actions):
+    pass
+
+
+class T19_hierarchical_is_in(ExtensionTargetTestCase, native.T19_hierarchical_is_in):
+    pass
+
+
+class T20_inherited_transitions(
+    ExtensionTargetTestCase, native.T20_inherited_transitions
+):
+    test_shard_handlers = None
+    test_fleet = None
+
+
+class T22_decision_tables(ExtensionTargetTestCase, native.T22_decision_tables):
+    def test(self):
+        self.run_test()
+        self.assertIn("OP_GUARD", (self.output_dir / "_statemachine.c").read_text())
+
+    test_instrumented = None
+    test_shard_handlers = None
+
+
+class T23_bounded_processing(ExtensionTargetTestCase, native.T23_bounded_processing):
+    test_priority_queue = None
+
+    def test_queue_growth(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        sm.ticks = 0
+        sm.start()
+        # The queue starts small and grows to hold every pending event
+        for _ in range(1000):
+            sm.queue_event(module.Event.go)
+        self.assertEqual(sm.pending_events, 1000)
+        with self.assertRaises(ValueError):
+            sm.queue_event(len(module.Event))
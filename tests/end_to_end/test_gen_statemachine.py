@@ -1,6 +1,16 @@
 from tests.end_to_end.test_case import EndToEndTestCase
 from pathlib import Path
 from unittest.mock import Mock, call
+from threading import Thread
+from queue import Full
+import threading
+from contextlib import redirect_stdout
+import io
+import subprocess
+import sys
+import time
+import importlib.util
+import unittest
 
 
 class T1_pass_through(EndToEndTestCase):
@@ -31,3 +41,1038 @@ class T5_event_pass_through(EndToEndTestCase):
 class T6_event_actions(EndToEndTestCase):
     def test(self):
         self.run_test()
+
+
+class T7_threaded_worker(EndToEndTestCase):
+    generation_args = ["--threaded", "--queue-size", "4"]
+
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        sm.start()
+
+        def produce():
+            for _ in range(250):
+                sm.queue_event(module.Event.increment)
+
+        producers = [Thread(target=produce) for _ in range(4)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        sm.stop()
+        sm.join(timeout=10)
+
+        self.assertEqual(sm.count, 1000)
+
+    def test_failed_worker(self):
+        """Test that an exception in the worker is raised to producers, rather than blocking them"""
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+
+        class FailingStateMachine(module.StateMachine):
+            def _enter_state(self, state):
+                if state is module.State.Counting:
+                    raise ValueError("Failed to count")
+                super()._enter_state(state)
+
+        sm = FailingStateMachine()
+        sm.start()
+
+        def produce():
+            # More events than the queue holds
+            try:
+                for _ in range(20):
+                    sm.queue_event(module.Event.increment)
+            except ValueError:
+                pass
+
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        producer.join(timeout=10)
+        self.assertFalse(producer.is_alive())
+        with self.assertRaises(ValueError):
+            sm.queue_event(module.Event.increment)
+        with self.assertRaises(ValueError):
+            sm.stop()
+        with self.assertRaises(ValueError):
+            sm.join(timeout=10)
+        self.assertFalse(sm._worker.is_alive())
+
+
+@unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+class T8_fleet(EndToEndTestCase):
+    generation_args = ["--target", "python3/fleet"]
+
+    def test(self):
+        import numpy as np
+
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module("fleet")
+        State, Event, Transition = module.State, module.Event, module.Transition
+        has_supply = np.arange(6) % 2 == 0
+        actions = []
+
+        fleet = module.StateMachineFleet(
+            size=6,
+            guard=lambda transition, indices: has_supply[indices],
+            action=lambda transition, indices: actions.append(
+                (transition, list(indices))
+            ),
+        )
+        fleet.start()
+        self.assertEqual(fleet.count_by_state(), {State.Off: 6})
+
+        # Only instances with a supply are powered on
+        fleet.dispatch(Event.power)
+        self.assertEqual(list(fleet.in_state(State.On)), [0, 2, 4])
+
+        # A batch with one event per instance
+        events = np.array([Event.fault, Event.fault, Event.power, 0, 0, 0])
+        fleet.dispatch(events[:3], indices=np.array([0, 1, 2]))
+        self.assertEqual(
+            list(fleet.states),
+            [State.Fault, State.Off, State.Off, State.Off, State.On, State.Off],
+        )
+
+        # Actions are only called for instances that take the transition
+        fleet.dispatch(Event.reset)
+        self.assertEqual(fleet.count_by_state(), {State.Off: 5, State.On: 1})
+        self.assertEqual(
+            [(Transition(t).name, i) for t, i in actions],
+            [("transition4", [0]), ("transition5", [0])],
+        )
+
+
+class T9_slotted_instances(EndToEndTestCase):
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        sm1 = module.StateMachine()
+        sm2 = module.StateMachine()
+
+        # Attributes used by the diagram's behaviour have slots
+        self.assertFalse(hasattr(sm1, "__dict__"))
+        self.assertIn("value", module.StateMachine.__slots__)
+        self.assertIn("enabled", module.StateMachine.__slots__)
+
+        # All instances share one immutable dispatch table
+        self.assertIs(sm1._event_handlers, sm2._event_handlers)
+        with self.assertRaises(TypeError):
+            sm1._event_handlers[(module.State.A, module.Event._null_event)] = None
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm1.enabled = True
+            sm1.start()
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(output, self.read_expected_output())
+
+
+class T10_snapshot_restore(EndToEndTestCase):
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        sm.start()
+        sm.queue_event(module.Event.next)
+        sm.queue_event(module.Event.next)
+
+        # 1 byte state ID, 4 byte event count and 1 byte per pending event
+        snapshot = sm.snapshot()
+        self.assertEqual(len(snapshot), 7)
+
+        restored = module.StateMachine()
+        restored.restore(snapshot)
+        self.assertEqual(restored.snapshot(), snapshot)
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            restored.process_events()
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(output, self.read_expected_output())
+
+        # Many statemachines are packed into one buffer
+        machines = module.unpack_snapshots(module.pack_snapshots([sm, restored]))
+        self.assertEqual(len(machines), 2)
+        self.assertEqual(machines[0].snapshot(), snapshot)
+        self.assertEqual(machines[1].snapshot(), restored.snapshot())
+
+
+class T11_instrumentation(EndToEndTestCase):
+    generation_args = ["--instrument"]
+
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        instrumentation = module.Instrumentation()
+        sm = module.StateMachine(instrumentation)
+        sm.ready = False
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            sm.queue_event(Event.go)
+            sm.queue_event(Event.go)
+            sm.process_events()
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(output, self.read_expected_output())
+
+        self.assertEqual(instrumentation.transitions[(State.A, Event.go)], 2)
+        self.assertEqual(instrumentation.guard_evaluations["self.ready"], 2)
+        self.assertEqual(instrumentation.action_calls['print("Exited A")'], 2)
+        self.assertEqual(instrumentation.action_calls['print("Going")'], 1)
+        self.assertEqual(
+            sum(instrumentation.action_latency['print("Going")'].values()), 1
+        )
+        self.assertGreater(instrumentation.action_time_ns['print("Going")'], 0)
+
+        # Instrumentation is not generated unless requested
+        self.generation_args = []
+        self.run_gen_statemachine()
+        source = (self.output_dir / "statemachine.py").read_text()
+        self.assertNotIn("instrumentation", source)
+        self.assertNotIn("perf_counter_ns", source)
+
+
+class T12_event_priorities(EndToEndTestCase):
+    generation_args = ["--priority-queue"]
+
+    def run_statemachine(self, threaded: bool = False):
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            if threaded:
+                # Queued before the worker starts, so the order is deterministic
+                for event in [module.Event.telemetry] * 3:
+                    sm.queue_event(event)
+                sm.queue_event(module.Event.EvEmergencyStop)
+                sm.start()
+                sm.stop()
+                sm.join(timeout=10)
+            else:
+                sm.start()
+                for event in [module.Event.telemetry] * 3:
+                    sm.queue_event(event)
+                sm.queue_event(module.Event.EvEmergencyStop)
+                sm.process_events()
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_threaded(self):
+        self.generation_args = ["--priority-queue", "--threaded"]
+        self.run_gen_statemachine()
+        self.assertEqual(
+            self.run_statemachine(threaded=True), self.read_expected_output()
+        )
+
+
+class T13_time_events(EndToEndTestCase):
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        from timing_wheel import TimingWheel
+
+        now = [0.0]
+        wheel = TimingWheel(tick=0.1, slots=16, clock=lambda: now[0])
+        sm = module.StateMachine(timing_wheel=wheel)
+
+        def advance_to(time: float):
+            now[0] = time
+            wheel.advance()
+            sm.process_events()
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            advance_to(4.9)
+            self.assertIs(sm._current_state, module.State.Waiting)
+            advance_to(5.0)
+            self.assertIs(sm._current_state, module.State.TimedOut)
+
+            # A long timer starts in a high level of the wheel
+            advance_to(5.0 + 7199.9)
+            self.assertIs(sm._current_state, module.State.TimedOut)
+            advance_to(5.0 + 7200)
+            self.assertIs(sm._current_state, module.State.Waiting)
+
+            # Timers are cancelled when their state is exited
+            sm.queue_event(module.Event.finish)
+            sm.process_events()
+            self.assertEqual(len(wheel), 0)
+            advance_to(10000)
+
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(output, self.read_expected_output())
+
+    def test_stale_timer(self):
+        """Test that a timer which expires before its state is exited has no effect"""
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        from timing_wheel import TimingWheel
+
+        now = [0.0]
+        wheel = TimingWheel(tick=0.1, slots=16, clock=lambda: now[0])
+        sm = module.StateMachine(timing_wheel=wheel)
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            sm.queue_event(module.Event.finish)
+            sm.queue_event(module.Event.restart)
+            now[0] = 5.0
+            wheel.advance()
+            sm.process_events()
+        # The timer started on re-entry to Waiting is still running
+        self.assertIs(sm._current_state, module.State.Waiting)
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(stdout.getvalue().split(), ["Waiting", "Done", "Waiting"])
+
+    def test_snapshot_restore(self):
+        """Test that restoring a snapshot restarts the timers of the restored state"""
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        from timing_wheel import TimingWheel
+
+        now = [0.0]
+        wheel = TimingWheel(tick=0.1, slots=16, clock=lambda: now[0])
+        sm = module.StateMachine(timing_wheel=wheel)
+
+        def advance_to(time: float):
+            now[0] = time
+            wheel.advance()
+            sm.process_events()
+
+        with redirect_stdout(io.StringIO()):
+            sm.start()
+            snapshot = sm.snapshot()
+            advance_to(5.0)
+            self.assertIs(sm._current_state, module.State.TimedOut)
+            sm.restore(snapshot)
+            # The timer of TimedOut is cancelled, and that of Waiting restarted
+            self.assertEqual(len(wheel), 1)
+            advance_to(9.9)
+            self.assertIs(sm._current_state, module.State.Waiting)
+            advance_to(10.0)
+            self.assertIs(sm._current_state, module.State.TimedOut)
+
+    def test_threaded_full_queue(self):
+        """Test that a timer does not block on the full queue of a threaded statemachine"""
+        self.generation_args = ["--threaded", "--queue-size", "1"]
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        from timing_wheel import TimingWheel
+
+        now = [0.0]
+        wheel = TimingWheel(tick=0.1, slots=16, clock=lambda: now[0])
+        sm = module.StateMachine(timing_wheel=wheel)
+        with redirect_stdout(io.StringIO()):
+            sm.start()
+            sm.stop()
+            sm.join(timeout=10)
+            # The stopped worker leaves the queue full
+            sm.queue_event(module.Event.finish)
+            now[0] = 5.0
+            advance = Thread(target=wheel.advance, daemon=True)
+            advance.start()
+            advance.join(timeout=10)
+        self.assertFalse(advance.is_alive())
+        self.assertEqual(len(sm._time_events), 1)
+
+
+class T14_event_coalescing(EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in [
+                module.Event.EvSample,
+                module.Event.EvRefresh,
+                module.Event.EvPing,
+                module.Event.EvSample,
+                module.Event.EvRefresh,
+                module.Event.EvPing,
+                module.Event.EvSample,
+                module.Event.EvSample,
+            ]:
+                sm.queue_event(event)
+            # Merged occurrences survive a snapshot
+            sm.restore(sm.snapshot())
+            sm.process_events()
+            sm.queue_event(module.Event.EvSample)
+            sm.process_events()
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_coalesce_option(self):
+        self.generation_args = ["--coalesce", "EvPing=drop"]
+        self.run_gen_statemachine()
+        expected_output = self.read_expected_output()
+        expected_output.remove("Ping")
+        self.assertEqual(self.run_statemachine(), expected_output)
+
+    def test_threaded(self):
+        """Test that occurrences merged into an event that fails to queue are still dispatched"""
+        self.generation_args = ["--threaded", "--queue-size", "1"]
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        busy = threading.Event()
+        release = threading.Event()
+
+        class BlockingStateMachine(module.StateMachine):
+            def _process_event(self, event):
+                if event is module.Event.EvPing and not busy.is_set():
+                    busy.set()
+                    release.wait(timeout=10)
+                super()._process_event(event)
+
+        sm = BlockingStateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            # Keep the worker busy and fill the queue
+            sm.queue_event(module.Event.EvPing)
+            busy.wait(timeout=10)
+            sm.queue_event(module.Event.EvPing)
+            errors = []
+
+            def produce():
+                try:
+                    sm.queue_event(module.Event.EvSample, timeout=0.5)
+                except Full as error:
+                    errors.append(error)
+
+            producer = Thread(target=produce)
+            producer.start()
+            while module.Event.EvSample not in sm._pending_events:
+                time.sleep(0.01)
+            # Merged into the occurrence that the producer is queueing
+            sm.queue_event(module.Event.EvSample)
+            producer.join(timeout=10)
+            release.set()
+            sm.stop()
+            sm.join(timeout=10)
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            [line for line in stdout.getvalue().split("\n") if line.strip()],
+            # The merged occurrences bypass the full queue
+            ["Ping", "Samples 2", "Ping"],
+        )
+
+
+class T15_event_payloads(EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        Payload = getattr(module.EvSamplePayload, "acquire", module.EvSamplePayload)
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            sm.queue_event(module.Event.EvSample, Payload(-1.0, "probe"))
+            sm.process_events()
+            sm.queue_event(module.Event.EvSample, Payload(2.5, "probe"))
+            sm.process_events()
+            with self.assertRaises(ValueError):
+                sm.queue_event(module.Event.EvSample, Payload(3.0, "probe"))
+                sm.snapshot()
+            sm.queue_event(module.Event.EvSample, Payload(4.0, "probe"))
+            sm.process_events()
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_payload_pool(self):
+        self.generation_args = ["--payload-pool"]
+        self.run_test()
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        with redirect_stdout(io.StringIO()):
+            sm.start()
+            payload = module.EvSamplePayload.acquire(1.0, "probe")
+            sm.queue_event(module.Event.EvSample, payload)
+            sm.process_events()
+        # The processed payload is returned to the pool and reused
+        self.assertIs(module.EvSamplePayload.acquire(2.0, "probe"), payload)
+
+
+class T16_event_journal(EndToEndTestCase):
+    generation_args = ["--journal"]
+
+    def run_statemachine(self, threaded: bool = False):
+        module = self.import_statemachine_module()
+        journal_path = self.output_dir / "events.journal"
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            with module.open_journal(journal_path, commit_records=2) as journal:
+                sm = module.StateMachine(journal=journal)
+                sm.start()
+                for event in ["open", "close", "lock", "unlock"]:
+                    sm.queue_event(module.Event[event])
+                    if not threaded:
+                        sm.process_events()
+                if threaded:
+                    sm.stop()
+                    sm.join(timeout=10)
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+        # An interrupted write leaves an incomplete record, which is ignored
+        with open(journal_path, "ab") as file:
+            file.write(b"\x01")
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            replayed = module.replay_journal(journal_path)
+        replay_output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(replay_output, output)
+        self.assertIs(replayed._current_state, sm._current_state)
+        return output
+
+    def test(self):
+        self.run_test()
+
+    def test_threaded(self):
+        self.generation_args = ["--journal", "--threaded"]
+        self.run_gen_statemachine()
+        self.assertEqual(
+            self.run_statemachine(threaded=True), self.read_expected_output()
+        )
+        # The journal can be replayed from the command line
+        result = subprocess.run(
+            [sys.executable, "journal.py", "events.journal"],
+            cwd=self.output_dir,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("final state: State.Closed", result.stdout)
+
+
+class T17_hot_reload(EndToEndTestCase):
+    def regenerate(self):
+        # The regenerated diagram renames a state and adds one before it,
+        # so the values of the existing states change
+        regenerated_spec = self.output_dir / "regenerated.test"
+        regenerated_spec.write_text(
+            self.test_spec.read_text()
+            .replace("Stopped", "Halted")
+            .replace("state Halted", "state Starting\nstate Halted", 1)
+        )
+        self.test_spec = regenerated_spec
+        self.run_gen_statemachine()
+
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        hot_reload = self.import_statemachine_module("hot_reload")
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            machines = [module.StateMachine(), module.StateMachine()]
+            for machine in machines:
+                machine.start()
+            machines[1].queue_event(module.Event.start)
+            machines[1].process_events()
+            machines[1].queue_event(module.Event.stop)
+
+            self.regenerate()
+            with self.assertRaises(hot_reload.StateMigrationError) as context:
+                hot_reload.reload_statemachines(module, machines)
+            self.assertEqual(context.exception.unknown_states, {"Stopped": 1})
+
+            report = hot_reload.reload_statemachines(
+                module, machines, state_renames={"Stopped": "Halted"}
+            )
+            # The class layout is unchanged, so the instances keep their identity
+            self.assertEqual(report.machines, machines)
+            self.assertIs(type(machines[0]), module.StateMachine)
+            self.assertIs(machines[0]._current_state, module.State.Halted)
+            machines[1].process_events()
+            self.assertIs(machines[1]._current_state, module.State.Halted)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_fleet(self):
+        self.generation_args = ["--target", "python3/fleet"]
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module("fleet")
+        hot_reload = self.import_statemachine_module("hot_reload")
+        fleet = module.StateMachineFleet(size=4)
+        fleet.start()
+        fleet.dispatch(module.Event.start, indices=[1, 2])
+
+        self.regenerate()
+        report = hot_reload.reload_statemachines(
+            module, [fleet], state_renames={"Stopped": "Halted"}
+        )
+        self.assertIs(report.machines[0], fleet)
+        self.assertEqual(
+            fleet.count_by_state(), {module.State.Halted: 2, module.State.Running: 2}
+        )
+
+    def test_int_constants(self):
+        self.generation_args = ["--int-constants"]
+        self.run_test()
+
+    def test_threaded(self):
+        self.generation_args = ["--threaded"]
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        hot_reload = self.import_statemachine_module("hot_reload")
+        old_class = module.StateMachine
+        with redirect_stdout(io.StringIO()):
+            machine = module.StateMachine()
+            machine.start()
+            self.regenerate()
+            with self.assertRaises(TypeError):
+                hot_reload.reload_statemachines(
+                    module, [machine], state_renames={"Stopped": "Halted"}
+                )
+            machine.stop()
+            machine.join(timeout=10)
+        # Neither the module nor the instance was changed
+        self.assertIs(module.StateMachine, old_class)
+        self.assertIn("Stopped", module.State.__members__)
+        self.assertIs(type(machine), old_class)
+
+
+class T18_event_router(EndToEndTestCase):
+    generation_args = ["--router"]
+
+    def run_statemachine(self, threaded: bool = False):
+        module = self.import_statemachine_module()
+        machines = [module.StateMachine() for _ in range(5)]
+        router = module.EventRouter(machines)
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            for machine in machines:
+                machine.start()
+            for machine in machines[:2]:
+                machine.queue_event(module.Event.arm)
+            if threaded:
+                # The router is updated by the workers as they change state
+                deadline = time.monotonic() + 10
+                while len(router.subscribers(module.Event.fire)) < 2:
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.001)
+            else:
+                for machine in machines[:2]:
+                    machine.process_events()
+            self.assertTrue(machines[0].can_handle(module.Event.fire))
+            self.assertFalse(machines[2].can_handle(module.Event.fire))
+            # Threaded workers may change state in any order
+            self.assertCountEqual(router.subscribers(module.Event.fire), machines[:2])
+
+            self.assertEqual(router.broadcast(module.Event.fire), 2)
+            if threaded:
+                for machine in machines:
+                    machine.stop()
+                    machine.join(timeout=10)
+            self.assertEqual(router.subscribers(module.Event.arm), machines[2:])
+            self.assertEqual(len(router.subscribers(module.Event.reset)), 2)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_threaded(self):
+        self.generation_args = ["--router", "--threaded"]
+        self.run_gen_statemachine()
+        self.assertEqual(
+            self.run_statemachine(threaded=True), self.read_expected_output()
+        )
+
+
+class T19_hierarchical_is_in(EndToEndTestCase):
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        sm = module.StateMachine()
+        sm.start()
+        self.assertTrue(sm.is_in(State.PoweredOff))
+        self.assertFalse(sm.is_in(State.PoweredOn))
+
+        sm.queue_event(Event.power)
+        sm.process_events()
+        self.assertTrue(sm.is_in(State.PoweredOn))
+        sm.queue_event(Event.start)
+        sm.process_events()
+        self.assertEqual(sm._current_state, State.Heating)
+        for state in [State.Heating, State.Active, State.PoweredOn]:
+            self.assertTrue(sm.is_in(state))
+        for state in [State.Idle, State.PoweredOff]:
+            self.assertFalse(sm.is_in(state))
+
+        # Handled by the transition inherited from PoweredOn
+        sm.queue_event(Event.power)
+        sm.process_events()
+        self.assertTrue(sm.is_in(State.PoweredOff))
+        self.assertFalse(sm.is_in(State.Active))
+
+
+class T20_inherited_transitions(EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        Event = module.Event
+        sm = module.StateMachine()
+        sm.resettable = False
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in ["power", "start", "stop", "stop", "start", "reset"]:
+                sm.queue_event(Event[event])
+                sm.process_events()
+            sm.resettable = True
+            for event in ["reset", "power"]:
+                sm.queue_event(Event[event])
+                sm.process_events()
+        self.assertEqual(sm._current_state, module.State.Off)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_shard_handlers(self):
+        self.generation_args = ["--shard-handlers"]
+        self.run_test()
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_fleet(self):
+        import numpy as np
+
+        self.generation_args = ["--target", "python3/fleet"]
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module("fleet")
+        State, Event = module.State, module.Event
+        actions = []
+        fleet = module.StateMachineFleet(
+            size=2,
+            guard=lambda transition, indices: indices == 0,
+            action=lambda transition, indices: actions.append(
+                (module.Transition(transition).name, list(indices))
+            ),
+        )
+        fleet.start()
+        for event in ["power", "start", "stop"]:
+            fleet.dispatch(Event[event])
+        self.assertEqual(list(fleet.states), [State.Cooling, State.Cooling])
+
+        # Substates take the transitions of the states that enclose them
+        actions.clear()
+        fleet.dispatch(Event.stop)
+        self.assertEqual(list(fleet.states), [State.Idle, State.Idle])
+        self.assertEqual(actions, [("transition7", [0, 1])])
+        fleet.dispatch(Event.start)
+        fleet.dispatch(Event.reset)
+        self.assertEqual(list(fleet.states), [State.Heating, State.Heating])
+        self.assertEqual(actions[-2:], [("transition8", [0]), ("transition5", [0])])
+        fleet.dispatch(Event.power)
+        self.assertEqual(fleet.count_by_state(), {State.Off: 2})
+
+
+class T21_pseudo_state_lowering(EndToEndTestCase):
+    generation_args = ["--instrument"]
+
+    def test(self):
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        instrumentation = module.Instrumentation()
+        sm = module.StateMachine(instrumentation)
+        sm.ready = False
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in [Event.go, Event.go, Event.finish]:
+                sm.queue_event(event)
+                sm.process_events()
+                if event is Event.go:
+                    sm.ready = True
+        output = [line for line in stdout.getvalue().split("\n") if line.strip()]
+        self.assertEqual(output, self.read_expected_output())
+        self.assertIs(sm._current_state, State.Idle)
+
+        # Choices and sub region terminal states are passed through within
+        # the handler of the incoming transition
+        dispatched_states = {state for state, _ in instrumentation.transitions}
+        self.assertNotIn(State.Check, dispatched_states)
+        self.assertNotIn(State.Busy_terminal_state, dispatched_states)
+        self.assertEqual(
+            instrumentation.transitions[(State.Busy, Event._null_event)], 1
+        )
+
+
+class T22_decision_tables(EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        sm = module.StateMachine()
+        sm.step = 2
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for program in ["wash", "rinse", "dry", "full", None, "custom", "custom"]:
+                sm.program = program
+                sm.queue_event(Event.start)
+                sm.process_events()
+                if sm._current_state is not State.Idle:
+                    sm.queue_event(Event.stop)
+                    sm.process_events()
+                sm.step = 4
+        self.assertIs(sm._current_state, State.Idle)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+        source = (self.output_dir / "statemachine.py").read_text()
+        self.assertIn("_decide(self._decision_table_0, self.program)", source)
+        self.assertIn("_decide(self._decision_table_1, self.step)", source)
+
+    def test_unhashable_values(self):
+        """Test that unhashable values match the same guards as without a table"""
+
+        class Program:
+            __hash__ = None
+
+            def __init__(self, name):
+                self.name = name
+
+            def __eq__(self, other):
+                return other == self.name
+
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        sm = module.StateMachine()
+        sm.step = 4
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            sm.program = Program("rinse")
+            sm.queue_event(Event.start)
+            sm.process_events()
+            self.assertIs(sm._current_state, State.Rinsing)
+            sm.queue_event(Event.stop)
+            sm.program = ["wash"]
+            sm.queue_event(Event.start)
+            sm.process_events()
+            self.assertIs(sm._current_state, State.Idle)
+        self.assertEqual(stdout.getvalue().split(), ["Rinse", "Custom"])
+
+    def test_shard_handlers(self):
+        self.generation_args = ["--shard-handlers"]
+        self.run_test()
+        shard = (self.output_dir / "statemachine_handlers" / "Idle.py").read_text()
+        self.assertIn("_decide(_Handlers._decision_table_0, self.program)", shard)
+
+    def test_instrumented(self):
+        # Guards are evaluated one by one when instrumented, so that each is counted
+        self.generation_args = ["--instrument"]
+        self.run_gen_statemachine()
+        source = (self.output_dir / "statemachine.py").read_text()
+        self.assertNotIn("_decision_table", source)
+
+
+class T23_bounded_processing(EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        sm.ticks = 0
+        sm.start()
+        self.assertEqual(sm.process_events(), 0)
+
+        # Running feeds itself a tick event forever, so only a budget stops it
+        sm.queue_event(module.Event.go)
+        remaining = sm.process_events(max_events=10)
+        self.assertGreater(remaining, 0)
+        # Every other event processed is a tick, the rest are completion events
+        ticks = sm.ticks
+        self.assertIn(ticks, [4, 5])
+
+        self.assertEqual(sm.process_events(deadline=time.monotonic() - 1), remaining)
+        self.assertEqual(sm.ticks, ticks)
+
+        started = time.monotonic()
+        self.assertGreater(sm.process_events(deadline=started + 0.01), 0)
+        self.assertGreater(sm.ticks, ticks)
+        self.assertLess(time.monotonic() - started, 5)
+
+        remaining = sm.process_events(max_events=2, deadline=time.monotonic() + 5)
+        self.assertGreater(remaining, 0)
+        return []
+
+    def test(self):
+        self.run_test()
+
+    def test_priority_queue(self):
+        self.generation_args = ["--priority-queue"]
+        self.run_test()
+
+
+class T24_sharded_handlers(EndToEndTestCase):
+    generation_args = ["--shard-handlers"]
+
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        sm = module.StateMachine()
+        handlers = module.StateMachine._event_handlers
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            self.assertEqual(
+                handlers._loaded_states, {State._initial_state, State.Idle}
+            )
+            for event in [Event.start, Event.full, Event.stop]:
+                sm.queue_event(event)
+                sm.process_events()
+        self.assertIs(sm._current_state, State.Idle)
+        # Fault's handlers are never needed, so its shard is never loaded
+        self.assertEqual(
+            handlers._loaded_states,
+            {
+                State._initial_state,
+                State.Idle,
+                State.Running_initial_state,
+                State.Filling,
+                State.Heating,
+            },
+        )
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+        shards = self.output_dir / "statemachine_handlers"
+        self.assertEqual(
+            sorted(path.stem for path in shards.glob("*.py")),
+            sorted(
+                [
+                    "_initial_state",
+                    "Idle",
+                    "Running",
+                    "Running_initial_state",
+                    "Filling",
+                    "Heating",
+                    "Fault",
+                ]
+            ),
+        )
+        source = (self.output_dir / "statemachine.py").read_text()
+        self.assertNotIn("def _process_start_in_Idle", source)
+
+
+class T25_int_constants(EndToEndTestCase):
+    generation_args = ["--int-constants", "--precompile"]
+
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        self.assertIsInstance(State.Heating, int)
+        # The Enum views are only built when first used
+        self.assertNotIn("StateEnum", vars(module))
+        self.assertEqual(module.StateEnum(State.Heating).name, "Heating")
+        self.assertIs(module.EventEnum.full, module.EventEnum(Event.full))
+
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            sm.queue_event(Event.start)
+            sm.process_events()
+            self.assertTrue(sm.can_handle(Event.full))
+            sm.queue_event(Event.full)
+            sm.process_events()
+            self.assertIs(sm._current_state, State.Heating)
+            self.assertTrue(sm.is_in(State.Running))
+
+            restored = module.StateMachine()
+            restored.restore(sm.snapshot())
+            self.assertIs(restored._current_state, State.Heating)
+            restored.queue_event(Event.stop)
+            restored.process_events()
+        self.assertIs(restored._current_state, State.Idle)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+        bytecode = list((self.output_dir / "__pycache__").glob("statemachine.*.pyc"))
+        self.assertEqual(len(bytecode), 1)
+        self.assertIn(sys.implementation.cache_tag, bytecode[0].name)
+
+
+class T26_state_minimisation(EndToEndTestCase):
+    generation_args = ["--minimise-states"]
+
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        State, Event = module.State, module.Event
+        # FromB behaves as FromA, but Other has a different action
+        self.assertEqual(
+            [state.name for state in State],
+            ["_initial_state", "_terminal_state", "Idle", "FromA", "Other", "Done"],
+        )
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in ["b", "tick", "go", "reset", "c", "tick", "go"]:
+                sm.queue_event(Event[event])
+                sm.process_events()
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+
+class T27_unreachable_pruning(EndToEndTestCase):
+    generation_args = ["--prune-unreachable"]
+
+    def run_gen_statemachine(self):
+        with self.assertLogs("gen_statemachine.program", "WARNING") as logs:
+            super().run_gen_statemachine()
+        self.assertEqual(
+            logs.records[0].getMessage(),
+            "Removed 6 unreachable states (_terminal_state, Legacy, "
+            "Legacy_initial_state, Legacy_terminal_state, LegacyIdle, Diagnostics) "
+            "and 4 transitions (Idle --> Idle : start, Legacy --> Diagnostics : stop, "
+            "Legacy_initial_state --> LegacyIdle, Diagnostics --> Idle : reset)",
+        )
+
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        self.assertEqual(
+            [state.name for state in module.State],
+            ["_initial_state", "Idle", "Running"],
+        )
+        return self.dispatch_events(module)
+
+    def dispatch_events(self, module):
+        sm = module.StateMachine()
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in [module.Event.start, module.Event.stop]:
+                sm.queue_event(event)
+                sm.process_events()
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+    def test_unpruned(self):
+        """Test that the dead transitions that are pruned are never taken without pruning"""
+        self.generation_args = []
+        EndToEndTestCase.run_gen_statemachine(self)
+        module = self.import_statemachine_module()
+        self.assertEqual(self.dispatch_events(module), self.read_expected_output())
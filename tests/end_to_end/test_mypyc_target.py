@@ -0,0 +1,112 @@
+from tests.end_to_end.test_case import EndToEndTestCase
+from tests.end_to_end import test_gen_statemachine as native
+from contextlib import redirect_stdout
+import importlib
+import importlib.util
+import io
+import subprocess
+import sys
+import unittest
+
+
+def has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+class MypycTarget:
+    """
+    Mixin that runs the tests of a python3/native spec against the
+    python3/mypyc target, compiling the generated module when mypyc is
+    installed
+    """
+
+    generation_args = ["--target", "python3/mypyc"]
+    output_suffix = "_mypyc"
+
+    def import_statemachine_module(self, module_name: str = "statemachine"):
+        if not has_module("mypyc"):
+            return super().import_statemachine_module(module_name)
+        result = subprocess.run(
+            [sys.executable, "setup.py", "build_ext", "--inplace"],
+            cwd=self.output_dir,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        sys.modules.pop(module_name, None)
+        sys.path.insert(0, str(self.output_dir))
+        try:
+            importlib.invalidate_caches()
+            module = importlib.import_module(module_name)
+        finally:
+            sys.path.remove(str(self.output_dir))
+            sys.modules.pop(module_name, None)
+        self.assertTrue(
+            module.__file__.endswith(".so") or module.__file__.endswith(".pyd")
+        )
+        return module
+
+    @unittest.skipUnless(has_module("mypy"), "mypy is not installed")
+    def test_type_check(self):
+        self.run_gen_statemachine()
+        result = subprocess.run(
+            [sys.executable, "-m", "mypy", "--strict", "statemachine.py"],
+            cwd=self.output_dir,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+
+class T3_nested_entry_exit(MypycTarget, native.T3_nested_entry_exit):
+    pass
+
+
+class T6_event_actions(MypycTarget, native.T6_event_actions):
+    pass
+
+
+class T19_hierarchical_is_in(MypycTarget, native.T19_hierarchical_is_in):
+    pass
+
+
+class T20_inherited_transitions(MypycTarget, native.T20_inherited_transitions):
+    test_shard_handlers = None
+    test_fleet = None
+
+    def test_handler_table(self):
+        """Test that the handler table holds a handler for each event that a state handles"""
+        self.run_gen_statemachine()
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        for state in module.State:
+            sm._current_state = state
+            for event in module.Event:
+                cell = module._HANDLER_BASE[state] + event
+                handler = module._HANDLERS[cell]
+                if module._HANDLER_CHECK[cell] != state:
+                    handler = None
+                self.assertEqual(handler is not None, sm.can_handle(event))
+
+
+class T21_pseudo_state_lowering(MypycTarget, EndToEndTestCase):
+    def run_statemachine(self):
+        module = self.import_statemachine_module()
+        sm = module.StateMachine()
+        sm.ready = False
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sm.start()
+            for event in [module.Event.go, module.Event.go, module.Event.finish]:
+                sm.queue_event(event)
+                sm.process_events()
+                sm.ready = True
+        self.assertEqual(sm._current_state, module.State.Idle)
+        return [line for line in stdout.getvalue().split("\n") if line.strip()]
+
+    def test(self):
+        self.run_test()
+
+
+class T23_bounded_processing(MypycTarget, native.T23_bounded_processing):
+    test_priority_queue = None
@@ -0,0 +1,50 @@
+from pathlib import Path
+import shutil
+import subprocess
+import unittest
+from typing import List, Optional
+from tests.end_to_end.test_case import EndToEndTestCase
+
+
+@unittest.skipUnless(shutil.which("gcc"), "gcc is not installed")
+class CEndToEndTestCase(EndToEndTestCase):
+    generation_args = ["--target", "c/switch"]
+    tests_dir = Path(__file__).parent.absolute()
+    # Fields added to the StateMachine struct for the diagram's actions and guards
+    user_fields: str = ""
+    # Source of a C program that drives the statemachine, instead of the target's main.c
+    driver: Optional[str] = None
+
+    def compile_statemachine(self) -> Path:
+        (self.output_dir / "actions.h").write_text("#include <stdio.h>\n")
+        sources = ["statemachine.c"]
+        if self.driver is None:
+            sources.append("main.c")
+        else:
+            (self.output_dir / "driver.c").write_text(self.driver)
+            sources.append("driver.c")
+        executable = self.output_dir / "statemachine"
+        command = [
+            "gcc",
+            "-std=c99",
+            "-Wall",
+            "-Wextra",
+            "-Werror",
+            '-DSTATEMACHINE_ACTIONS_HEADER="actions.h"',
+            f"-DSTATEMACHINE_USER_FIELDS={self.user_fields}",
+            "-o",
+            str(executable),
+        ] + sources
+        result = subprocess.run(
+            command, cwd=self.output_dir, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return executable
+
+    def run_statemachine(self) -> List[str]:
+        executable = self.compile_statemachine()
+        result = subprocess.run(
+            [str(executable)], capture_output=True, text=True, timeout=10
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return [line for line in result.stdout.split("\n") if line.strip() != ""]
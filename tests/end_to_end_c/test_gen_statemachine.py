@@ -0,0 +1,130 @@
+from tests.end_to_end_c.test_case import CEndToEndTestCase
+
+
+class C1_nested_entry_exit(CEndToEndTestCase):
+    def test(self):
+        self.run_test()
+
+
+class C2_events_and_guards(CEndToEndTestCase):
+    user_fields = "int program; int spin; int cycles;"
+    driver = r"""
+#include <stdio.h>
+#include "statemachine.h"
+
+static void dispatch(StateMachine *sm, Event event)
+{
+    statemachine_queue_event(sm, event);
+    statemachine_process_events(sm, STATEMACHINE_ALL_EVENTS);
+}
+
+int main(void)
+{
+    static StateMachine sm;
+    statemachine_init(&sm);
+    sm.program = 0;
+    sm.spin = 1;
+    sm.cycles = 0;
+    statemachine_start(&sm);
+
+    dispatch(&sm, EVENT_power);
+    dispatch(&sm, EVENT_start);
+    sm.program = 2;
+    dispatch(&sm, EVENT_start);
+    dispatch(&sm, EVENT_rinse);
+    dispatch(&sm, EVENT_stop);
+    dispatch(&sm, EVENT_power);
+
+    dispatch(&sm, EVENT_power);
+    sm.program = 3;
+    sm.spin = 0;
+    dispatch(&sm, EVENT_start);
+    dispatch(&sm, EVENT_rinse);
+    dispatch(&sm, EVENT_power);
+    puts(statemachine_state_name(sm.current_state));
+    return 0;
+}
+"""
+
+    def test(self):
+        self.run_test()
+
+
+class C3_queue_capacity(CEndToEndTestCase):
+    generation_args = CEndToEndTestCase.generation_args + ["--queue-size", "4"]
+    user_fields = "int ticks;"
+    driver = r"""
+#include <stdio.h>
+#include "statemachine.h"
+
+static int queue_ticks(StateMachine *sm, int count)
+{
+    int queued = 0;
+    for (int i = 0; i < count; i++) {
+        queued += statemachine_queue_event(sm, EVENT_tick);
+    }
+    return queued;
+}
+
+int main(void)
+{
+    static StateMachine sm;
+    statemachine_init(&sm);
+    sm.ticks = 0;
+    statemachine_start(&sm);
+
+    printf("queued %d of 5\n", queue_ticks(&sm, 5));
+    printf("remaining %zu\n", statemachine_process_events(&sm, 2));
+    printf("remaining %zu\n", statemachine_process_events(&sm, STATEMACHINE_ALL_EVENTS));
+    printf("ticks %d\n", sm.ticks);
+
+    /* The ring buffer wraps around */
+    printf("queued %d of 3\n", queue_ticks(&sm, 3));
+    statemachine_process_events(&sm, STATEMACHINE_ALL_EVENTS);
+    printf("ticks %d\n", sm.ticks);
+    return 0;
+}
+"""
+
+    def test(self):
+        self.run_test()
+
+
+class C4_full_queue_completion(CEndToEndTestCase):
+    generation_args = CEndToEndTestCase.generation_args + ["--queue-size", "4"]
+    user_fields = "int ticks;"
+    driver = r"""
+#include <stdio.h>
+#include "statemachine.h"
+
+static int queue_ticks(StateMachine *sm, int count)
+{
+    int queued = 0;
+    for (int i = 0; i < count; i++) {
+        queued += statemachine_queue_event(sm, EVENT_tick);
+    }
+    return queued;
+}
+
+int main(void)
+{
+    static StateMachine sm;
+    statemachine_init(&sm);
+    sm.ticks = 0;
+    statemachine_start(&sm);
+
+    /* The action of `fill` fills the queue, ahead of the completion event */
+    printf("queued %d of 1\n", statemachine_queue_event(&sm, EVENT_fill));
+    printf("remaining %zu\n", statemachine_process_events(&sm, STATEMACHINE_ALL_EVENTS));
+    puts(statemachine_state_name(sm.current_state));
+    printf("ticks %d\n", sm.ticks);
+
+    printf("queued %d of 5\n", queue_ticks(&sm, 5));
+    statemachine_process_events(&sm, STATEMACHINE_ALL_EVENTS);
+    printf("ticks %d\n", sm.ticks);
+    return 0;
+}
+"""
+
+    def test(self):
+        self.run_test()
@@ -0,0 +1,108 @@
+import unittest
+from pathlib import Path
+from textwrap import dedent
+from tests.utilities import TestCaseBase
+
+from gen_statemachine.frontend.parser import Parser
+from gen_statemachine.model import ModelBuilder
+from gen_statemachine.backend.dispatch import (
+    NULL_EVENT_NAME,
+    dispatched_transitions,
+    enum_name,
+    extension_module_name,
+    self_attributes,
+    transitions_by_source_and_event,
+)
+
+
+class TestDispatch(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        file_path = self.create_file(
+            contents=dedent(
+                """
+                @startuml
+                state Off
+                state On {
+                    state Idle
+                    state Busy
+                }
+                [*] --> Off
+                Off --> On : power
+                state On {
+                    [*] --> Idle
+                    Idle --> Busy : start [self.ready]
+                    Busy --> Idle : stop / self.count += 1
+                    Busy --> [*] : done
+                }
+                On --> Off : power / self.log("off")
+                On --> Off
+                @enduml
+                """
+            )
+        )
+        with open(file_path, "r") as file:
+            self.statemachine = ModelBuilder().build(Parser().parse_puml(file))
+
+    def test_enum_names(self):
+        """Test that initial and terminal states are named after their enclosing state"""
+        self.assertCountEqual(
+            [enum_name(vertex) for vertex in self.statemachine.vertices().values()],
+            [
+                "Off",
+                "On",
+                "Idle",
+                "Busy",
+                "_initial_state",
+                "On_initial_state",
+                "_terminal_state",
+                "On_terminal_state",
+            ],
+        )
+
+    def test_transitions_by_source_and_event(self):
+        """Test that transitions are grouped by source and trigger in diagram order"""
+        transitions = transitions_by_source_and_event(self.statemachine)
+        self.assertEqual(
+            list(transitions),
+            [
+                ("_initial_state", NULL_EVENT_NAME),
+                ("Off", "power"),
+                ("On_initial_state", NULL_EVENT_NAME),
+                ("Idle", "start"),
+                ("Busy", "stop"),
+                ("Busy", "done"),
+                ("On", "power"),
+                ("On", NULL_EVENT_NAME),
+            ],
+        )
+
+    def test_inherited_transitions(self):
+        """Test that substates inherit the transitions of their enclosing state"""
+        dispatched = dispatched_transitions(self.statemachine)
+        on_power = dispatched[("On", "power")]
+        self.assertEqual(on_power[1], [])
+        for vertex_name in ["Idle", "Busy"]:
+            transitions, exited = dispatched[(vertex_name, "power")]
+            self.assertIs(transitions, on_power[0])
+            self.assertEqual([enum_name(vertex) for vertex in exited], [vertex_name])
+        # Pseudo states inherit no transitions
+        self.assertNotIn(("On_initial_state", "power"), dispatched)
+        self.assertNotIn(("On_terminal_state", "power"), dispatched)
+        # Completion transitions are not inherited
+        self.assertNotIn(("Idle", NULL_EVENT_NAME), dispatched)
+
+    def test_self_attributes(self):
+        """Test that attributes used by actions and guards are found, but not methods"""
+        self.assertEqual(self_attributes(self.statemachine), {"ready", "count"})
+
+    def test_extension_module_name(self):
+        """Test that extension modules are named after their output directory"""
+        self.assertEqual(
+            extension_module_name(Path("/out/traffic-lights")),
+            "_traffic_lights_statemachine",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
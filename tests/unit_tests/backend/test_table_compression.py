@@ -0,0 +1,44 @@
+import random
+import unittest
+from tests.utilities import TestCaseBase
+
+from gen_statemachine.backend.table_compression import EMPTY, compress_table
+
+
+class TestTableCompression(TestCaseBase):
+    def assertLookups(self, cells, rows, columns):
+        table = compress_table(cells, rows, columns)
+        values = table.values(cells, None)
+        for row in range(rows):
+            for column in range(columns):
+                self.assertEqual(
+                    table.lookup(values, row, column, None), cells.get((row, column))
+                )
+        return table
+
+    def test_empty_table(self):
+        table = self.assertLookups({}, 3, 4)
+        self.assertEqual(table.check, [EMPTY] * 4)
+
+    def test_rows_share_slots(self):
+        """Test that the cells of one row fill the gaps of another"""
+        cells = {(0, 0): "a", (0, 2): "b", (1, 1): "c", (1, 3): "d", (2, 0): "e"}
+        table = self.assertLookups(cells, 3, 4)
+        self.assertEqual(table.base[:2], [0, 0])
+        self.assertLessEqual(len(table), 2 * 4)
+
+    def test_sparse_table(self):
+        """Test a table that is mostly empty, like that of a large statemachine"""
+        generator = random.Random(0)
+        rows, columns = 500, 200
+        cells = {
+            (row, generator.randrange(columns)): row
+            for row in range(rows)
+            for _ in range(generator.randrange(4))
+        }
+        table = self.assertLookups(cells, rows, columns)
+        self.assertLess(len(table), len(cells) + 2 * columns)
+
+    def test_cell_outside_table(self):
+        with self.assertRaises(ValueError):
+            compress_table([(0, 4)], 3, 4)
@@ -0,0 +1,70 @@
+import tempfile
+import unittest
+from pathlib import Path
+from textwrap import dedent
+from tests.utilities import TestCaseBase
+
+from gen_statemachine.backend import GenerationOptions, TargetGenerator
+from gen_statemachine.error import ProgramError
+from gen_statemachine.frontend.parser import Parser
+from gen_statemachine.model import ModelBuilder
+
+
+class TestTargetGeneratorValidation(TestCaseBase):
+    def build(self, diagram: str):
+        file_path = self.create_file(contents=dedent(diagram))
+        with open(file_path, "r") as file:
+            parse_tree = Parser().parse_puml(file)
+        return ModelBuilder().build(parse_tree)
+
+    def assertGenerationError(self, target_name, statemachine, options, message):
+        with tempfile.TemporaryDirectory() as output_dir:
+            with self.assertRaises(ProgramError) as context:
+                TargetGenerator().generate(
+                    target_name, Path(output_dir), statemachine, options
+                )
+            self.assertEqual(context.exception.error_message, message)
+            # Nothing is generated once the statemachine is rejected
+            self.assertEqual(list(Path(output_dir).iterdir()), [])
+
+    def test_unsupported_features(self):
+        """Test that targets reject diagram features listed as unsupported in their manifest"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            [*] --> Idle
+            Idle --> Idle : after_5s
+            @enduml
+            """
+        )
+        self.assertGenerationError(
+            "c/switch",
+            statemachine,
+            GenerationOptions(),
+            "Time events are not supported by the c/switch target (after_5s)",
+        )
+
+    def test_invalid_options(self):
+        """Test that options which cannot be used with the diagram are rejected"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            [*] --> Idle
+            Idle --> Idle : EvSample(value: float)
+            @enduml
+            """
+        )
+        self.assertGenerationError(
+            "python3/native",
+            statemachine,
+            GenerationOptions(journal=True),
+            "Events with payloads cannot be journaled, as payloads are not recorded",
+        )
+        self.assertGenerationError(
+            "python3/native",
+            statemachine,
+            GenerationOptions(coalesce=["EvMissing=latest"]),
+            "Coalesce option given for unknown events: EvMissing",
+        )
@@ -1,7 +1,7 @@
 import unittest
 from tests.utilities import TestCaseBase
 
-from gen_statemachine.model.model import StateType
+from gen_statemachine.model.model import CoalescePolicy, Parameter, StateType
 from gen_statemachine.model import ModelBuilder
 from gen_statemachine.frontend import Token, TokenType, ParseTree
 
@@ -162,6 +162,190 @@ class TestModelBuilder(TestCaseBase):
         self.assertEqual(len(state2.incoming_transitions), 1)
         self.assertEqual(state2.incoming_transitions[0], transition1)
 
+    def test_transitions_sharing_a_trigger(self):
+        """Test a parse tree with 2 transitions triggered by the same event"""
+        # Construct tree
+        parse_tree = ParseTree()
+        declarations_node = parse_tree.root_node.add_child(
+            Token(TokenType.declarations)
+        )
+        for state_name in ["STATE1", "STATE2"]:
+            state_declaration = declarations_node.add_child(
+                Token(TokenType.state_declaration)
+            )
+            state_declaration.add_child(Token(TokenType.KEYWORD_STATE))
+            state_declaration.add_child(Token(TokenType.NAME, 0, 0, state_name))
+
+        for source_name, target_name in [("STATE1", "STATE2"), ("STATE2", "STATE1")]:
+            transition_declaration = declarations_node.add_child(
+                Token(TokenType.transition_declaration)
+            )
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, source_name))
+            transition_declaration.add_child(Token(TokenType.ARROW))
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, target_name))
+            transition_declaration.add_child(Token(TokenType.COLON))
+            transition_label = transition_declaration.add_child(
+                Token(TokenType.transition_label)
+            )
+            transition_label.add_child(Token(TokenType.TRIGGER, 0, 0, "evToggle"))
+
+        # Generate statemachine
+        statemachine = ModelBuilder().build(parse_tree)
+
+        # Assert
+        self.assertEqual(len(statemachine.events()), 1)
+        transition1 = statemachine.region.transitions[0]
+        transition2 = statemachine.region.transitions[1]
+        self.assertEqual(transition1.trigger.name, "evToggle")
+        self.assertTrue(transition1.trigger is transition2.trigger)
+
+    def test_transition_priority_stereotype(self):
+        """Test a parse tree with a transition that sets the priority of its event"""
+        # Construct tree
+        parse_tree = ParseTree()
+        declarations_node = parse_tree.root_node.add_child(
+            Token(TokenType.declarations)
+        )
+        state_declaration = declarations_node.add_child(
+            Token(TokenType.state_declaration)
+        )
+        state_declaration.add_child(Token(TokenType.KEYWORD_STATE))
+        state_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+
+        transition_declaration = declarations_node.add_child(
+            Token(TokenType.transition_declaration)
+        )
+        transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+        transition_declaration.add_child(Token(TokenType.ARROW))
+        transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+        transition_declaration.add_child(
+            Token(TokenType.STEREOTYPE_ANY, 0, 0, "<<priority=5>>")
+        )
+        transition_declaration.add_child(Token(TokenType.COLON))
+        transition_label = transition_declaration.add_child(
+            Token(TokenType.transition_label)
+        )
+        transition_label.add_child(Token(TokenType.TRIGGER, 0, 0, "evStop"))
+
+        # Generate statemachine
+        statemachine = ModelBuilder().build(parse_tree)
+
+        # Assert
+        transition = statemachine.region.transitions[0]
+        self.assertEqual(transition.stereotype, "priority=5")
+        self.assertEqual(transition.trigger.priority, 5)
+
+    def test_transition_event_properties_stereotype(self):
+        """Test a parse tree with a transition that sets the priority and coalesce policy of its event"""
+        # Construct tree
+        parse_tree = ParseTree()
+        declarations_node = parse_tree.root_node.add_child(
+            Token(TokenType.declarations)
+        )
+        state_declaration = declarations_node.add_child(
+            Token(TokenType.state_declaration)
+        )
+        state_declaration.add_child(Token(TokenType.KEYWORD_STATE))
+        state_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+
+        transition_declaration = declarations_node.add_child(
+            Token(TokenType.transition_declaration)
+        )
+        transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+        transition_declaration.add_child(Token(TokenType.ARROW))
+        transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+        transition_declaration.add_child(
+            Token(TokenType.STEREOTYPE_ANY, 0, 0, "<<priority=5, coalesce=count>>")
+        )
+        transition_declaration.add_child(Token(TokenType.COLON))
+        transition_label = transition_declaration.add_child(
+            Token(TokenType.transition_label)
+        )
+        transition_label.add_child(Token(TokenType.TRIGGER, 0, 0, "evSample"))
+
+        # Generate statemachine
+        statemachine = ModelBuilder().build(parse_tree)
+
+        # Assert
+        transition = statemachine.region.transitions[0]
+        self.assertEqual(transition.trigger.priority, 5)
+        self.assertIs(transition.trigger.coalesce, CoalescePolicy.COUNT)
+
+    def test_trigger_parameters(self):
+        """Test a parse tree with triggers that declare the parameters of their event"""
+        # Construct tree
+        parse_tree = ParseTree()
+        declarations_node = parse_tree.root_node.add_child(
+            Token(TokenType.declarations)
+        )
+        state_declaration = declarations_node.add_child(
+            Token(TokenType.state_declaration)
+        )
+        state_declaration.add_child(Token(TokenType.KEYWORD_STATE))
+        state_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+
+        for trigger in ["evSample(value: float, source)", "evSample"]:
+            transition_declaration = declarations_node.add_child(
+                Token(TokenType.transition_declaration)
+            )
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+            transition_declaration.add_child(Token(TokenType.ARROW))
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+            transition_declaration.add_child(Token(TokenType.COLON))
+            transition_label = transition_declaration.add_child(
+                Token(TokenType.transition_label)
+            )
+            transition_label.add_child(Token(TokenType.TRIGGER, 0, 0, trigger))
+
+        # Generate statemachine
+        statemachine = ModelBuilder().build(parse_tree)
+
+        # Assert
+        transition1 = statemachine.region.transitions[0]
+        transition2 = statemachine.region.transitions[1]
+        self.assertEqual(transition1.trigger.name, "evSample")
+        self.assertTrue(transition1.trigger is transition2.trigger)
+        self.assertEqual(
+            transition1.trigger.parameters,
+            [Parameter("value", "float"), Parameter("source")],
+        )
+
+    def test_time_event_trigger(self):
+        """Test a parse tree with a transition triggered by a time event"""
+        # Construct tree
+        parse_tree = ParseTree()
+        declarations_node = parse_tree.root_node.add_child(
+            Token(TokenType.declarations)
+        )
+        state_declaration = declarations_node.add_child(
+            Token(TokenType.state_declaration)
+        )
+        state_declaration.add_child(Token(TokenType.KEYWORD_STATE))
+        state_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+
+        for trigger in ["after_250ms", "evTimeout"]:
+            transition_declaration = declarations_node.add_child(
+                Token(TokenType.transition_declaration)
+            )
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+            transition_declaration.add_child(Token(TokenType.ARROW))
+            transition_declaration.add_child(Token(TokenType.NAME, 0, 0, "STATE1"))
+            transition_declaration.add_child(Token(TokenType.COLON))
+            transition_label = transition_declaration.add_child(
+                Token(TokenType.transition_label)
+            )
+            transition_label.add_child(Token(TokenType.TRIGGER, 0, 0, trigger))
+
+        # Generate statemachine
+        statemachine = ModelBuilder().build(parse_tree)
+
+        # Assert
+        transition1 = statemachine.region.transitions[0]
+        transition2 = statemachine.region.transitions[1]
+        self.assertEqual(transition1.trigger.name, "after_250ms")
+        self.assertAlmostEqual(transition1.trigger.delay, 0.25)
+        self.assertIsNone(transition2.trigger.delay)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,213 @@
+import unittest
+from textwrap import dedent
+from tests.utilities import TestCaseBase
+
+from gen_statemachine.frontend.parser import Parser
+from gen_statemachine.model import ModelBuilder, minimise_states, prune_unreachable
+
+
+class OptimiseTestCase(TestCaseBase):
+    def build(self, diagram: str):
+        file_path = self.create_file(contents=dedent(diagram))
+        with open(file_path, "r") as file:
+            parse_tree = Parser().parse_puml(file)
+        return ModelBuilder().build(parse_tree)
+
+    def state_names(self, statemachine):
+        return [state.name for state in statemachine.states().values()]
+
+
+class TestMinimiseStates(OptimiseTestCase):
+    def test_equivalent_cycles(self):
+        """Test that states are merged when their targets are only equivalent once merged"""
+        statemachine = self.build(
+            """
+            @startuml
+            state A1
+            state B1
+            state A2
+            state B2
+            [*] --> A1
+            A1 --> B1 : next
+            B1 --> A1 : next
+            A1 --> A2 : swap
+            A2 --> B2 : next
+            B2 --> A2 : next
+            A2 --> A1 : swap
+            @enduml
+            """
+        )
+        report = minimise_states(statemachine)
+        self.assertEqual(report.merged_states, {"A1": ["A2"], "B1": ["B2"]})
+        self.assertEqual(report.removed_transitions, 3)
+        self.assertEqual(self.state_names(statemachine), ["A1", "B1"])
+        a1, b1 = statemachine.states().values()
+        self.assertEqual(
+            [transition.target.name for transition in a1.outgoing_transitions],
+            ["B1", "A1"],
+        )
+        self.assertEqual(len(a1.incoming_transitions), 3)
+        self.assertEqual(len(statemachine.transitions()), 4)
+
+    def test_actions_prevent_merge(self):
+        """Test that states with different behaviour are not merged"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            state A
+            state B
+            state C
+            [*] --> Idle
+            Idle --> A : a
+            Idle --> B : b
+            Idle --> C : c
+            A --> Idle : done / print("A")
+            B --> Idle : done / print("B")
+            state C : entry/ print("C")
+            C --> Idle : done / print("A")
+            @enduml
+            """
+        )
+        report = minimise_states(statemachine)
+        self.assertEqual(report.merged_states, {})
+        self.assertEqual(self.state_names(statemachine), ["Idle", "A", "B", "C"])
+
+    def test_hierarchy(self):
+        """Test that only states in the same region are merged, and not composite states"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Outer {
+                state Inner1
+                state Inner2
+            }
+            state Other {
+                state Inner3
+            }
+            [*] --> Outer
+            state Outer {
+                [*] --> Inner1
+                Inner1 --> Inner2 : next
+                Inner2 --> Inner2 : next
+            }
+            state Other {
+                [*] --> Inner3
+                Inner3 --> Inner3 : next
+            }
+            Outer --> Other : swap
+            Other --> Outer : swap
+            @enduml
+            """
+        )
+        report = minimise_states(statemachine)
+        self.assertEqual(report.merged_states, {"Inner1": ["Inner2"]})
+        self.assertEqual(
+            self.state_names(statemachine), ["Outer", "Inner1", "Other", "Inner3"]
+        )
+
+    def test_referenced_states(self):
+        """Test that states named in actions or guards are not merged"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            state A
+            state B
+            [*] --> Idle
+            Idle --> A : a
+            Idle --> B : b [not self.is_in(State.B)]
+            A --> Idle : done
+            B --> Idle : done
+            @enduml
+            """
+        )
+        self.assertEqual(minimise_states(statemachine).merged_states, {})
+
+
+class TestPruneUnreachable(OptimiseTestCase):
+    def test_reachable_through_enclosing_state(self):
+        """Test that the transitions of a composite state are taken from its sub states"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            state Active {
+                state Inner
+            }
+            state Fault
+            state Unused
+            [*] --> Idle
+            Idle --> Inner : start
+            state Active {
+                [*] --> Inner
+            }
+            Active --> Fault : error
+            Unused --> Fault : error
+            @enduml
+            """
+        )
+        report = prune_unreachable(statemachine)
+        self.assertEqual(
+            report.removed_vertices,
+            ["_terminal_state", "Active_terminal_state", "Unused"],
+        )
+        self.assertEqual(report.removed_transitions, ["Unused --> Fault : error"])
+        self.assertEqual(
+            self.state_names(statemachine), ["Idle", "Active", "Inner", "Fault"]
+        )
+        self.assertEqual(len(statemachine.transitions()), 4)
+        self.assertIsNone(statemachine.region.terminal_state)
+
+    def test_dead_transitions(self):
+        """Test that only the first unguarded transition for a trigger is kept"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            state A
+            state B
+            state C
+            [*] --> Idle
+            Idle --> A : go [self.ready]
+            Idle --> B : go
+            Idle --> C : go
+            A --> Idle : back / print("A")
+            B --> Idle : back / print("B")
+            C --> Idle : back / print("C")
+            @enduml
+            """
+        )
+        report = prune_unreachable(statemachine)
+        self.assertEqual(report.removed_vertices, ["_terminal_state", "C"])
+        self.assertEqual(
+            report.removed_transitions, ["Idle --> C : go", "C --> Idle : back"]
+        )
+        actions = [
+            entity.text
+            for entity in statemachine.entities.values()
+            if type(entity).__name__ == "Action"
+        ]
+        self.assertEqual(actions, ['print("A")', 'print("B")'])
+
+    def test_referenced_states(self):
+        """Test that states named in actions or guards are kept, with the states they reach"""
+        statemachine = self.build(
+            """
+            @startuml
+            state Idle
+            state Legacy
+            state Diagnostics
+            [*] --> Idle
+            Idle --> Idle : check [not self.is_in(State.Legacy)]
+            Legacy --> Diagnostics : stop
+            Diagnostics --> Idle : reset
+            @enduml
+            """
+        )
+        report = prune_unreachable(statemachine)
+        self.assertEqual(report.removed_vertices, ["_terminal_state"])
+        self.assertEqual(report.removed_transitions, [])
+        self.assertEqual(
+            self.state_names(statemachine), ["Idle", "Legacy", "Diagnostics"]
+        )